@@ -0,0 +1,29 @@
+# app/api/deps.py
+from fastapi import Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app import crud, crud_async
+from app.database import get_async_db, get_db
+from app.utils import tenxa_cache
+
+
+def get_tenxa_id(tenxa: str = Query(...), db: Session = Depends(get_db)) -> int:
+    """Dependency: đổi slug xã → tenxa_id (1 lần mỗi request), 404 nếu không có xã.
+    Dùng chung session của request (get_db): cache trúng thì session không lấy kết nối nào"""
+    tenxa_id = tenxa_cache.get_id(tenxa)
+    if tenxa_id is None:
+        tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
+
+    if tenxa_id is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy xã")
+    return tenxa_id
+
+
+async def get_tenxa_id_async(tenxa: str = Query(...), db: AsyncSession = Depends(get_async_db)) -> int:
+    """Như get_tenxa_id cho endpoint async: dùng AsyncSession của request, không chờ chỗ của get_db
+    (giới hạn DB_REQUEST_SLOTS chỉ dành cho endpoint đồng bộ chạy trong threadpool)"""
+    tenxa_id = await crud_async.get_tenxa_id_from_slug(db, tenxa)
+    if tenxa_id is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy xã")
+    return tenxa_id
@@ -1,34 +1,42 @@
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
 from sqlalchemy.orm import Session
-from app import crud, database, schemas, models
-from app.models import Counter, User
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import crud, crud_async, database, schemas, models
+from app.api.deps import get_tenxa_id, get_tenxa_id_async
+from app.models import Counter
 from app.schemas import CounterPauseCreate, CounterPauseLog
-from app.auth import get_db, get_current_user, check_counter_permission
+from app.auth import get_current_user, get_current_user_async, check_counter_permission
+from app.database import get_db
 from typing import Optional, List
-from app.api.endpoints.realtime import notify_frontend
-from app.utils.auto_call_loop import reset_events
+from app.api.endpoints.realtime import notify_frontend, ticket_payload, ticket_status_event, counter_payload
+from app.utils.auto_call_loop import registry as auto_call_registry
+from app.utils import live_queue
+from app.utils.user_cache import CachedUser
 from datetime import datetime
 import pytz
 
 router = APIRouter()
 
 @router.post("/{counter_id}/call-next", response_model=Optional[schemas.CalledTicket])
-def call_next_manually(
+async def call_next_manually(
     counter_id: int,
     background_tasks: BackgroundTasks,
     tenxa: str = Query(...),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    tenxa_id: int = Depends(get_tenxa_id_async),
+    db: AsyncSession = Depends(database.get_async_db),
+    current_user: CachedUser = Depends(get_current_user_async)
 ):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
     check_counter_permission(counter_id, current_user)
 
-    ticket = crud.call_next_ticket(db, tenxa_id, counter_id)
-    counter = db.query(Counter).filter(
-    Counter.id == ticket.counter_id,
-    Counter.tenxa_id == tenxa_id
-    ).first()
-    if ticket:
+    with live_queue.resync_on_error(tenxa_id):
+        advance = await crud_async.call_next_ticket(db, tenxa_id, counter_id)
+    # Vé đang gọi đã được đóng kể cả khi hết vé chờ → cập nhật hàng đợi và màn hình
+    for finished in advance.finished if advance else ():
+        live_queue.apply(tenxa_id, live_queue.UPDATED, finished)
+        background_tasks.add_task(notify_frontend, ticket_status_event(finished, tenxa))
+    if advance and advance.ticket:
+        ticket, counter_name = advance.ticket, advance.counter_name
+        live_queue.apply(tenxa_id, live_queue.CALLED, ticket)
         # ✅ Gửi sự kiện WebSocket qua background task
         vn_time = datetime.now(pytz.timezone("Asia/Ho_Chi_Minh")).isoformat()
         background_tasks.add_task(
@@ -36,20 +44,19 @@ def call_next_manually(
             {
                 "event": "ticket_called",
                 "ticket_number": ticket.number,
-                "counter_name": counter.name,
+                "counter_id": counter_id,
+                "counter_name": counter_name,
                 "tenxa": tenxa,
-                "timestamp": vn_time
+                "timestamp": vn_time,
+                "ticket": ticket_payload(ticket)
             }
         )
-        event = reset_events.get((counter_id, tenxa_id))
-        if event:
-            print(f"♻️ Reset auto-call cho quầy {counter_id} xã {tenxa_id}")
-            event.set()
+        await auto_call_registry.signal(tenxa_id, counter_id)
 
 
         return schemas.CalledTicket(
             number=ticket.number,
-            counter_name=ticket.counter.name,
+            counter_name=counter_name,
             tenxa=tenxa
         )
 
@@ -59,42 +66,67 @@ def call_next_manually(
 def pause_counter(
     counter_id: int,
     data: CounterPauseCreate,
+    background_tasks: BackgroundTasks,
     tenxa: str = Query(...),
+    tenxa_id: int = Depends(get_tenxa_id),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CachedUser = Depends(get_current_user)
 ):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
     check_counter_permission(counter_id, current_user)
 
     counter = db.query(Counter).filter(Counter.tenxa_id == tenxa_id).filter(Counter.id == counter_id).first()
     if not counter:
         raise HTTPException(status_code=404, detail="Counter not found")
-    return crud.pause_counter(db, tenxa_id, counter_id, data.reason)
+    log = crud.pause_counter(db, tenxa_id, counter_id, data.reason)
+    background_tasks.add_task(
+        notify_frontend, {
+            "event": "counter_paused",
+            "counter_id": counter_id,
+            "tenxa": tenxa,
+            "reason": data.reason,
+            "counter": counter_payload(counter)
+        }
+    )
+    return log
 
 @router.put("/{counter_id}/resume", response_model=schemas.Counter)
 def resume_counter_route(
     counter_id: int,
+    background_tasks: BackgroundTasks,
     tenxa: str = Query(...),
+    tenxa_id: int = Depends(get_tenxa_id),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CachedUser = Depends(get_current_user)
 ):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
     check_counter_permission(counter_id, current_user)
 
     counter = crud.resume_counter(db, tenxa_id, counter_id=counter_id)
     if not counter:
         raise HTTPException(status_code=404, detail="Counter not found")
+    background_tasks.add_task(
+        notify_frontend, {
+            "event": "counter_resumed",
+            "counter_id": counter_id,
+            "tenxa": tenxa,
+            "counter": counter_payload(counter)
+        }
+    )
+    # Quầy mở lại → bắt đầu lại chu kỳ chờ trước khi tự gọi số
+    background_tasks.add_task(auto_call_registry.signal, tenxa_id, counter_id)
     return counter
 
+@router.get("/auto-call/status")
+async def auto_call_status(tenxa_id: int = Depends(get_tenxa_id_async)):
+    """Các quầy của xã đang được tự gọi số và thời gian tới lần kiểm tra kế tiếp (theo worker trả lời request)"""
+    return auto_call_registry.status(tenxa_id)
+
 @router.get("/", response_model=List[schemas.Counter])
-def get_all_counters(tenxa: str = Query(...), db: Session = Depends(get_db)):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
+def get_all_counters(tenxa_id: int = Depends(get_tenxa_id), db: Session = Depends(get_db)):
     counters = db.query(models.Counter).filter(Counter.tenxa_id == tenxa_id).order_by(models.Counter.id).all()
     return counters
 
 @router.get("/{counter_id}", response_model=schemas.Counter)
-def get_counter_by_id(counter_id: int,tenxa: str = Query(...), db: Session = Depends(get_db)):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
+def get_counter_by_id(counter_id: int,tenxa_id: int = Depends(get_tenxa_id), db: Session = Depends(get_db)):
     counter = db.query(models.Counter).filter(Counter.tenxa_id == tenxa_id).filter(models.Counter.id == counter_id).first()
     if not counter:
         raise HTTPException(status_code=404, detail="Counter not found")
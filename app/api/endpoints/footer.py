@@ -2,23 +2,14 @@
 
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from app import crud, schemas, database
+from app import crud, schemas
+from app.api.deps import get_tenxa_id
+from app.database import get_db
 
 router = APIRouter()
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @router.get("/", response_model=schemas.FooterResponse)
-def get_footer(tenxa: str = Query(...), db: Session = Depends(get_db)):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
-    if not tenxa_id:
-        raise HTTPException(status_code=404, detail="Không tìm thấy xã")
-
+def get_footer(tenxa: str = Query(...), tenxa_id: int = Depends(get_tenxa_id), db: Session = Depends(get_db)):
     footer = crud.get_footer_by_tenxa(db, tenxa_id)
     if not footer:
         raise HTTPException(status_code=404, detail="Chưa có dữ liệu footer cho xã này")
@@ -30,11 +21,7 @@ def get_footer(tenxa: str = Query(...), db: Session = Depends(get_db)):
     )
 
 @router.post("/", response_model=schemas.FooterResponse)
-def update_footer(data: schemas.FooterCreate, tenxa: str = Query(...), db: Session = Depends(get_db)):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
-    if not tenxa_id:
-        raise HTTPException(status_code=404, detail="Không tìm thấy xã")
-
+def update_footer(data: schemas.FooterCreate, tenxa: str = Query(...), tenxa_id: int = Depends(get_tenxa_id), db: Session = Depends(get_db)):
     footer = crud.upsert_footer(db, tenxa_id, data.work_time, data.hotline)
 
     return schemas.FooterResponse(
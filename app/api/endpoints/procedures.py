@@ -1,24 +1,80 @@
 # app/api/endpoints/procedures.py
-from fastapi import APIRouter, Depends, Query
+import asyncio
+import json
+from fastapi import APIRouter, Depends, Query, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
-from typing import List
-from app import crud, schemas, database
+from typing import List, Optional
+from app import crud, crud_async, schemas, database
+from app.api.deps import get_tenxa_id, get_tenxa_id_async
+from app.auth import get_admin_user
+from app.utils import event_bus, procedure_index, typeahead
+from app.database import get_db
+from app.utils.user_cache import CachedUser
 
 router = APIRouter()
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @router.get("/", response_model=List[schemas.Procedure])
-def list_procedures(search: str = "", tenxa: str = Query(...), db: Session = Depends(get_db)):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
+def list_procedures(search: str = "", tenxa_id: int = Depends(get_tenxa_id), db: Session = Depends(get_db)):
     return crud.get_procedures(db, tenxa_id, search)
 
 @router.get("/search-extended", response_model=List[schemas.ProcedureSearchResponse])
-def search_procedures_with_counters(search: str = "", tenxa: str = Query(...), db: Session = Depends(get_db)):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
+def search_procedures_with_counters(search: str = "", tenxa_id: int = Depends(get_tenxa_id), db: Session = Depends(get_db)):
     return crud.get_procedures_with_counters(db, tenxa_id, search)
+
+@router.get("/typeahead", response_model=schemas.TypeaheadResponse)
+async def typeahead_procedures(
+    q: str = "",
+    session_id: Optional[str] = Query(None, description="Mã phiên của kiosk; truy vấn cũ của phiên bị bỏ khi có phím mới"),
+    tenxa_id: int = Depends(get_tenxa_id_async),
+):
+    results = await typeahead.typeahead(tenxa_id, q, session_id)
+    if results is None:
+        return schemas.TypeaheadResponse(query=q, superseded=True)
+    return schemas.TypeaheadResponse(query=q, results=results)
+
+@router.get("/typeahead/stats")
+async def typeahead_stats():
+    return typeahead.stats()
+
+@router.websocket("/ws/typeahead")
+async def typeahead_websocket(websocket: WebSocket, tenxa: str = Query(...)):
+    """Kiosk gửi mỗi lần gõ 1 tin (chuỗi thô hoặc {"q": ..., "id": ...}); server chỉ trả lời tin mới nhất:
+    tin cũ đang chờ / đang tìm bị huỷ khi có tin mới"""
+    await websocket.accept()
+    async with database.AsyncSessionLocal() as db:
+        tenxa_id = await crud_async.get_tenxa_id_from_slug(db, tenxa)
+    if tenxa_id is None:
+        await websocket.close(code=1008, reason="Không tìm thấy xã")
+        return
+
+    async def answer(query: str, message_id):
+        await asyncio.sleep(typeahead.TYPEAHEAD_DEBOUNCE_MS / 1000)
+        results = await typeahead.lookup(tenxa_id, query)
+        await websocket.send_text(json.dumps({"id": message_id, "query": query, "results": jsonable_encoder(results)}))
+
+    pending: Optional[asyncio.Task] = None
+    try:
+        while True:
+            text = await websocket.receive_text()
+            try:
+                message = json.loads(text)
+            except ValueError:
+                message = text
+            if not isinstance(message, dict):
+                message = {"q": text}
+            if pending is not None and not pending.done():
+                pending.cancel()
+            pending = asyncio.create_task(answer(str(message.get("q") or ""), message.get("id")))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+@router.post("/reindex")
+async def reindex_procedures(tenxa_id: int = Depends(get_tenxa_id_async), current_user: CachedUser = Depends(get_admin_user)):
+    """Dựng lại chỉ mục tìm kiếm của xã trên mọi worker (sau khi sửa thủ tục / lĩnh vực của quầy)"""
+    procedure_index.invalidate(tenxa_id)
+    await event_bus.publish(event_bus.CHANNEL_PROCEDURE_INDEX_INVALIDATE, {"tenxa_id": tenxa_id})
+    return {"tenxa_id": tenxa_id, "status": "invalidated"}
@@ -1,31 +1,98 @@
 # app/api/endpoints/realtime.py
-from fastapi import APIRouter, WebSocket
+# Giao thức /ws/updates?tenxa=<slug>[&counter_id=<id>][&since=<epoch>:<seq>]:
+#  1. Kết nối mới (hoặc since không còn hợp lệ) → 1 tin {"event": "snapshot", "epoch", "seq", "counters",
+#     "waiting", "called"} là toàn bộ hàng đợi hôm nay của xã (lọc theo quầy nếu có counter_id).
+#  2. Sau đó là các sự kiện có "epoch" + "seq" tăng dần: new_ticket, ticket_called, ticket_status,
+#     counter_paused, counter_resumed. Sự kiện vé mang đủ object "ticket" → client cập nhật theo ticket.id.
+#     ticket_called: vé đang gọi trước đó của quầy (nếu có) được gửi trước bằng 1 ticket_status "done".
+#  3. Mất kết nối → kết nối lại với since=<epoch>:<seq cuối cùng đã nhận> để nhận bù; nếu worker đã
+#     khởi động lại hoặc replay buffer không còn đủ → nhận snapshot mới như bước 1.
 import json
+from typing import Optional
+from fastapi import APIRouter, Query, WebSocket
+from fastapi.encoders import jsonable_encoder
+from app import crud_async, schemas
+from app.database import AsyncSessionLocal
+from app.utils import event_bus, live_queue, ws_hub
 
 router = APIRouter()
-connected_clients: list[WebSocket] = []
+
+
+def ticket_payload(ticket) -> dict:
+    return jsonable_encoder(schemas.Ticket.from_orm(ticket))
+
+
+def ticket_status_event(ticket, tenxa: str) -> dict:
+    return {
+        "event": "ticket_status",
+        "ticket_number": ticket.number,
+        "counter_id": ticket.counter_id,
+        "status": ticket.status,
+        "tenxa": tenxa,
+        "ticket": ticket_payload(ticket)
+    }
+
+
+def counter_payload(counter) -> dict:
+    return jsonable_encoder(schemas.Counter.from_orm(counter))
+
+
+async def build_snapshot(tenxa: str, counter_id: Optional[int]) -> Optional[dict]:
+    async with AsyncSessionLocal() as db:
+        tenxa_id = await crud_async.get_tenxa_id_from_slug(db, tenxa)
+        if tenxa_id is None:
+            return None
+        counters = await crud_async.get_counters(db, tenxa_id)
+    waiting = await live_queue.get_waiting(tenxa_id, counter_id)
+    called = await live_queue.get_called(tenxa_id, counter_id)
+
+    return {
+        "event": "snapshot",
+        "tenxa": tenxa,
+        "counters": [counter_payload(c) for c in counters if counter_id is None or c.id == counter_id],
+        "waiting": [ticket_payload(t) for t in waiting],
+        "called": [ticket_payload(t) for t in called],
+    }
+
 
 @router.websocket("/ws/updates")
-async def websocket_updates(websocket: WebSocket):
+async def websocket_updates(
+    websocket: WebSocket,
+    tenxa: Optional[str] = Query(None, description="Slug xã cần nhận sự kiện (bỏ trống = tất cả)"),
+    counter_id: Optional[int] = Query(None, description="Chỉ nhận sự kiện của quầy này (tùy chọn)"),
+    since: Optional[str] = Query(None, description="<epoch>:<seq> của sự kiện cuối cùng đã nhận"),
+):
     await websocket.accept()
-    connected_clients.append(websocket)
-    print("🔌 Client kết nối WebSocket")
+    subscriber = ws_hub.subscribe(websocket, tenxa, counter_id, since)
+    print(f"🔌 Client kết nối WebSocket xã {tenxa or 'tất cả'}" + (f" quầy {counter_id}" if counter_id else ""))
 
     try:
+        if tenxa and not subscriber.resumed:
+            # seq lấy trước khi đọc DB: sự kiện tới trong lúc đọc vẫn nằm trong hàng đợi (client bỏ trùng theo id)
+            seq = ws_hub.current_seq(tenxa)
+            snapshot = await build_snapshot(tenxa, counter_id)
+            if snapshot is None:
+                await websocket.close(code=1008, reason="Không tìm thấy xã")
+                return
+            snapshot.update(epoch=ws_hub.EPOCH, seq=seq)
+            await websocket.send_text(json.dumps(snapshot))
+        subscriber.start()
+
         while True:
             await websocket.receive_text()  # giữ kết nối
     except Exception as e:
         print("⚠️ Client mất kết nối WebSocket:", e)
     finally:
-        connected_clients.remove(websocket)
+        ws_hub.unsubscribe(subscriber)
         print("❌ Client ngắt kết nối WebSocket")
 
 
 async def notify_frontend(data: dict):
-    """Gửi dữ liệu đến tất cả client đang kết nối WebSocket"""
-    message = json.dumps(data)
-    for client in connected_clients.copy():
-        try:
-            await client.send_text(message)
-        except:
-            connected_clients.remove(client)
+    """Gửi dữ liệu đến các client WebSocket đã đăng ký xã / quầy của sự kiện (trên mọi worker)"""
+    await event_bus.publish(event_bus.CHANNEL_WS, data)
+
+
+async def _deliver(data: dict):
+    ws_hub.publish(data)
+
+event_bus.subscribe(event_bus.CHANNEL_WS, _deliver)
@@ -1,31 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from sqlalchemy import case, func, insert, update
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Dict, List
 from datetime import datetime
 import pytz
-from app import models, schemas, database, crud
-from app.utils.auto_call_loop import reset_events
+from app import models, schemas
+from app.api.deps import get_tenxa_id
+from app.utils.auto_call_loop import registry as auto_call_registry
+from app.database import get_db
 
 vn_tz = pytz.timezone("Asia/Ho_Chi_Minh")
 router = APIRouter()
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 
 @router.get("/", response_model=List[schemas.Seat])
-def list_seats(tenxa: str = Query(...), db: Session = Depends(get_db)):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
+def list_seats(tenxa_id: int = Depends(get_tenxa_id), db: Session = Depends(get_db)):
     return db.query(models.Seat).filter(models.Seat.tenxa_id == tenxa_id).all()
 
 
 @router.put("/{seat_id}", response_model=schemas.Seat)
-def update_seat(seat_id: int, seat_update: schemas.SeatUpdate, tenxa: str = Query(...), db: Session = Depends(get_db)):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
+def update_seat(seat_id: int, seat_update: schemas.SeatUpdate, background_tasks: BackgroundTasks, tenxa_id: int = Depends(get_tenxa_id), db: Session = Depends(get_db)):
     seat = db.query(models.Seat).filter(models.Seat.tenxa_id == tenxa_id).filter(models.Seat.id == seat_id).first()
     if not seat:
         raise HTTPException(status_code=404, detail="Seat not found")
@@ -50,24 +44,119 @@ def update_seat(seat_id: int, seat_update: schemas.SeatUpdate, tenxa: str = Quer
     db.commit()
     db.refresh(seat)
     if old_status != new_status and seat.type == "client":
-        event = reset_events.get(seat.counter_id)
-        if event:
-            print(f"♻️ Reset auto-call cho quầy {seat.counter_id}")
-            event.set()
+        # Hàm đồng bộ chạy trong threadpool → gửi tín hiệu qua background task trên event loop.
+        # Khách rời ghế → kiểm tra ngay (bộ lập lịch chỉ gọi số khi cán bộ đang ngồi và mọi ghế khách trống);
+        # khách ngồi vào → chờ lại từ đầu
+        immediate = old_status is True and new_status is False
+        background_tasks.add_task(auto_call_registry.signal, tenxa_id, seat.counter_id, immediate)
 
     return seat
 
+def _reading_time(reading: schemas.SeatReading, now: datetime) -> datetime:
+    if reading.timestamp is None:
+        return now
+    if reading.timestamp.tzinfo is None:
+        return vn_tz.localize(reading.timestamp)
+    return reading.timestamp
+
+
+@router.post("/batch", response_model=schemas.SeatBatchResult)
+def update_seats_batch(batch: schemas.SeatReadingBatch, background_tasks: BackgroundTasks, tenxa_id: int = Depends(get_tenxa_id), db: Session = Depends(get_db)):
+    """Nhận 1 lô kết quả đọc cảm biến từ gateway: bỏ các lần đọc không đổi trạng thái,
+    ghi seat_logs bằng 1 câu INSERT nhiều dòng, cập nhật ghế bằng 1 câu UPDATE, reset auto-call 1 lần / quầy"""
+    now = datetime.now(vn_tz)
+    # Theo từng ghế, theo thời gian đọc; giờ không kèm múi giờ → giờ VN
+    readings = sorted((r.seat_id, _reading_time(r, now), r.status) for r in batch.readings)
+    seat_ids = {seat_id for seat_id, _, _ in readings}
+    if not seat_ids:
+        return schemas.SeatBatchResult(received=0, applied=0, seats_updated=0)
+
+    # Khoá các ghế trong lô → PUT /seats/{id} hoặc lô khác cùng lúc không ghi đè lẫn nhau
+    seats = {
+        seat.id: seat for seat in db.query(
+            models.Seat.id, models.Seat.status, models.Seat.type, models.Seat.counter_id, models.Seat.last_empty_time
+        ).filter(models.Seat.tenxa_id == tenxa_id, models.Seat.id.in_(seat_ids)).with_for_update()
+    }
+    # Thời điểm trạng thái hiện tại của ghế (lần đổi gần nhất trong seat_logs / lần trống gần nhất):
+    # lần đọc không mới hơn là gói tin gửi lại / tới muộn → bỏ, không ghi đè trạng thái mới hơn
+    latest: Dict[int, datetime] = {
+        seat_id: seat.last_empty_time for seat_id, seat in seats.items() if seat.last_empty_time is not None
+    }
+    if seats:
+        for seat_id, logged_at in db.query(models.SeatLog.seat_id, func.max(models.SeatLog.timestamp)).filter(
+            models.SeatLog.seat_id.in_(seats.keys())
+        ).group_by(models.SeatLog.seat_id):
+            if logged_at is not None:
+                latest[seat_id] = max(logged_at, latest.get(seat_id, logged_at))
+
+    logs = []
+    stale = 0
+    status: Dict[int, bool] = {}
+    emptied_at: Dict[int, datetime] = {}
+    for seat_id, timestamp, new_status in readings:
+        if seat_id not in seats:
+            continue
+        # Cột DateTime không múi giờ lưu giờ VN
+        if seat_id in latest and timestamp.astimezone(vn_tz).replace(tzinfo=None) <= latest[seat_id]:
+            stale += 1
+            continue
+        old_status = status.get(seat_id, seats[seat_id].status)
+        if old_status == new_status:
+            continue  # cảm biến báo lại trạng thái cũ
+        logs.append({
+            "seat_id": seat_id,
+            "old_status": old_status,
+            "new_status": new_status,
+            "timestamp": timestamp,
+            "tenxa_id": tenxa_id,
+        })
+        status[seat_id] = new_status
+        if new_status is False and old_status is True:
+            emptied_at[seat_id] = timestamp
+
+    # Ghế có ít nhất 1 lần đổi trạng thái (kể cả ngồi rồi rời ghế ngay trong lô)
+    changed = list(status)
+    if logs:
+        db.execute(insert(models.SeatLog).values(logs))
+    if changed:
+        values = {"status": case({seat_id: status[seat_id] for seat_id in changed}, value=models.Seat.id)}
+        if emptied_at:
+            values["last_empty_time"] = case(emptied_at, value=models.Seat.id, else_=models.Seat.last_empty_time)
+        db.execute(
+            update(models.Seat)
+            .where(models.Seat.tenxa_id == tenxa_id, models.Seat.id.in_(changed))
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+    db.commit()
+
+    # 1 tín hiệu / quầy có ghế khách đổi trạng thái; kiểm tra ngay nếu có ghế khách vừa trống (như PUT /seats/{id})
+    resets: Dict[int, bool] = {}
+    for seat_id in status:
+        seat = seats[seat_id]
+        if seat.type == "client":
+            emptied = seat_id in emptied_at and status[seat_id] is False
+            resets[seat.counter_id] = resets.get(seat.counter_id, False) or emptied
+    for counter_id, immediate in resets.items():
+        background_tasks.add_task(auto_call_registry.signal, tenxa_id, counter_id, immediate)
+
+    return schemas.SeatBatchResult(
+        received=len(readings),
+        applied=len(logs),
+        seats_updated=len(changed),
+        unknown_seat_ids=sorted(seat_ids - seats.keys()),
+        stale=stale,
+    )
+
 @router.get("/{seat_id}", response_model=schemas.SeatPublic)
-def get_seat(seat_id: int, tenxa: str = Query(...), db: Session = Depends(get_db)):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
+def get_seat(seat_id: int, tenxa_id: int = Depends(get_tenxa_id), db: Session = Depends(get_db)):
     seat = db.query(models.Seat).filter(models.Seat.tenxa_id == tenxa_id).filter(models.Seat.id == seat_id).first()
     if not seat:
         raise HTTPException(status_code=404, detail="Seat not found")
     return seat
 
 @router.get("/counter/{counter_id}", response_model=List[schemas.SeatPublic])
-def get_client_seats_by_counter(counter_id: int, tenxa: str = Query(...), db: Session = Depends(get_db)):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
+def get_client_seats_by_counter(counter_id: int, tenxa_id: int = Depends(get_tenxa_id), db: Session = Depends(get_db)):
     seats = db.query(models.Seat).filter(
         models.Seat.counter_id == counter_id,
         models.Seat.type == "client"
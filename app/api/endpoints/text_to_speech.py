@@ -1,112 +1,98 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Header
+from fastapi.responses import Response
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-import uuid, os, subprocess
+from typing import Optional
 
-from app import database, models, crud
+from app import models
+from app.api.deps import get_tenxa_id
+from app.utils import event_bus, tts_audio
+from app.database import get_db
 
 router = APIRouter()
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # endpoint/
-APP_DIR = os.path.abspath(os.path.join(BASE_DIR, "../../"))  # về tới thư mục app/
-TTS_FOLDER = os.path.join(APP_DIR, "utils", "TTS")  # app/utils/TTS
 
-PREFIX_PATH = os.path.join(TTS_FOLDER, "prefix", "prefix.mp3")
-NUMBERS_PATH = os.path.join(TTS_FOLDER, "numbers")
-COUNTER_PATH = os.path.join(TTS_FOLDER, "counter_audio")
+async def _on_tts_invalidate(payload: dict):
+    # Audio quầy đã thay ở worker nào đó → bỏ audio + thông báo đã ghép của quầy trong bộ nhớ worker này
+    tts_audio.invalidate_counter(payload["tenxa_id"], payload["counter_id"])
 
-#print("PREFIX_PATH:", PREFIX_PATH)
-#print("NUMBERS_PATH:", NUMBERS_PATH)
-#print("COUNTER_PATH:", COUNTER_PATH)
+event_bus.subscribe(event_bus.CHANNEL_TTS_INVALIDATE, _on_tts_invalidate)
 
 class TTSRequest(BaseModel):
     counter_id: int
     ticket_number: int
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+def announcement_response(
+    db: Session,
+    source: str,
+    tenxa: str,
+    tenxa_id: int,
+    request: TTSRequest,
+    if_none_match: Optional[str]
+) -> Response:
+    cached = tts_audio.get_announcement(source, tenxa_id, request.counter_id, request.ticket_number)
+    if cached is None:
+        # Lấy thông tin quầy
+        counter = db.query(models.Counter).filter(
+            models.Counter.tenxa_id == tenxa_id,
+            models.Counter.id == request.counter_id
+        ).first()
+
+        if not counter:
+            raise HTTPException(status_code=404, detail="Counter not found")
+
+        # Ghép frame MP3 từ các đoạn đã nạp sẵn, không tạo file tạm
+        try:
+            cached = tts_audio.assemble_announcement(db, source, tenxa_id, request.counter_id, request.ticket_number)
+        except LookupError as e:
+            raise HTTPException(status_code=404, detail=f"Missing audio file: {e}")
+
+    audio, etag = cached
+    # ✅ Màn hình đã có bản này → 304, không cần tải lại
+    if tts_audio.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    filename = f"tts_{tenxa}_{request.counter_id}_{request.ticket_number}.mp3"
+    return Response(
+        content=audio,
+        media_type="audio/mpeg",
+        headers={
+            "ETag": etag,
+            "Content-Disposition": f'inline; filename="{filename}"'
+        }
+    )
 
-@router.post("/", response_class=FileResponse)
+@router.post("/", response_class=Response)
 def generate_tts(
     request: TTSRequest,
-    background_tasks: BackgroundTasks,
     tenxa: str = Query(...),
+    tenxa_id: int = Depends(get_tenxa_id),
+    if_none_match: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
+    return announcement_response(db, tts_audio.SOURCE_FILE, tenxa, tenxa_id, request, if_none_match)
 
-    # Lấy thông tin quầy
-    counter = db.query(models.Counter).filter(
-        models.Counter.tenxa_id == tenxa_id,
-        models.Counter.id == request.counter_id
-    ).first()
+@router.post("/warm-up")
+def warm_up_announcements(
+    limit: int = Query(5, ge=1, le=50, description="Số vé chờ mỗi quầy cần ghép sẵn"),
+    tenxa_id: int = Depends(get_tenxa_id),
+    db: Session = Depends(get_db)
+):
+    warmed = tts_audio.warm_up_announcements(db, tenxa_id, limit)
+    return {"detail": "Đã ghép sẵn thông báo", "warmed": warmed}
 
-    if not counter:
-        raise HTTPException(status_code=404, detail="Counter not found")
-
-
-    # Đường dẫn 3 file cần ghép
-    prefix = PREFIX_PATH
-    number = os.path.join(NUMBERS_PATH, f"{request.ticket_number}.mp3")
-    print("Number file:", number)
-    print("Exists:", os.path.exists(number))
-    counter_file = os.path.join(COUNTER_PATH, f"Quay{request.counter_id}_xa{tenxa_id}.mp3")
-    print("Number file:", counter_file)
-    print("Exists:", os.path.exists(counter_file))
-
-    # Kiểm tra tồn tại
-    for path in [prefix, number, counter_file]:
-        if not os.path.exists(path):
-            raise HTTPException(status_code=404, detail=f"Missing audio file: {os.path.basename(path)}")
-
-    # Tạo file tạm
-    filename = f"tts_{uuid.uuid4().hex}.mp3"
-
-    # Ghép file bằng ffmpeg
-    list_path = f"temp_{uuid.uuid4().hex}.txt"
-    with open(list_path, "w", encoding="utf-8") as f:
-        f.write(f"file '{prefix}'\n")
-        f.write(f"file '{number}'\n")
-        f.write(f"file '{counter_file}'\n")
-
-    try:
-        subprocess.run(
-            ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", filename],
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-        )
-    except subprocess.CalledProcessError:
-        raise HTTPException(status_code=500, detail="Failed to generate audio")
-
-    # Dọn rác
-    background_tasks.add_task(lambda: os.remove(filename))
-    background_tasks.add_task(lambda: os.remove(list_path))
-
-    return FileResponse(filename, media_type="audio/mpeg", filename=filename)
-
-from fastapi import UploadFile
 from gtts import gTTS
-from sqlalchemy import insert
 from datetime import datetime
-from app import models
 from io import BytesIO
 from fastapi.responses import StreamingResponse
 
 @router.post("/generate_counter_audio")
 def generate_counter_audio(
     counter_id: int,
-    tenxa: str = Query(...),
+    background_tasks: BackgroundTasks,
+    tenxa_id: int = Depends(get_tenxa_id),
     db: Session = Depends(get_db)
 ):
-    # Lấy ID xã
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
-
     # Tìm quầy
     counter = db.query(models.Counter).filter(
         models.Counter.id == counter_id,
@@ -141,6 +127,12 @@ def generate_counter_audio(
     db.add(new_audio)
     db.commit()
 
+    # ♻️ Audio quầy đã thay → bỏ các thông báo cũ đã ghép của quầy này (trên mọi worker)
+    tts_audio.invalidate_counter(tenxa_id, counter_id)
+    background_tasks.add_task(
+        event_bus.publish, event_bus.CHANNEL_TTS_INVALIDATE, {"tenxa_id": tenxa_id, "counter_id": counter_id}
+    )
+
     return {
         "detail": "Tạo và lưu file thành công",
         "counter_name": counter.name
@@ -150,12 +142,10 @@ def generate_counter_audio(
 @router.get("/export_counter_audio", response_class=StreamingResponse)
 def export_counter_audio(
     tenxa: str = Query(...),
+    tenxa_id: int = Depends(get_tenxa_id),
     counter_id: int = Query(...),
     db: Session = Depends(get_db)
 ):
-    # Lấy ID xã từ slug
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
-
     # Tìm file audio mới nhất cho quầy này
     audio_record = db.query(models.TTSAudio).filter(
         models.TTSAudio.tenxa_id == tenxa_id,
@@ -175,68 +165,12 @@ def export_counter_audio(
         }
     )
 
-@router.post("/new", response_class=FileResponse)
+@router.post("/new", response_class=Response)
 def generate_tts(
     request: TTSRequest,
-    background_tasks: BackgroundTasks,
     tenxa: str = Query(...),
+    tenxa_id: int = Depends(get_tenxa_id),
+    if_none_match: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
-
-    # Lấy thông tin quầy
-    counter = db.query(models.Counter).filter(
-        models.Counter.tenxa_id == tenxa_id,
-        models.Counter.id == request.counter_id
-    ).first()
-
-    if not counter:
-        raise HTTPException(status_code=404, detail="Counter not found")
-
-    # Đường dẫn 2 file local
-    prefix = PREFIX_PATH
-    number = os.path.join(NUMBERS_PATH, f"{request.ticket_number}.mp3")
-
-    # Lấy audio từ DB
-    audio_record = db.query(models.TTSAudio).filter(
-        models.TTSAudio.tenxa_id == tenxa_id,
-        models.TTSAudio.counter_id == request.counter_id
-    ).order_by(models.TTSAudio.created_at.desc()).first()
-
-    if not audio_record:
-        raise HTTPException(status_code=404, detail="Missing audio file in DB for counter")
-
-    # Ghi file counter ra đĩa tạm
-    counter_file_path = f"counter_{uuid.uuid4().hex}.mp3"
-    with open(counter_file_path, "wb") as f:
-        f.write(audio_record.audio_data)
-
-    # Kiểm tra tồn tại 2 file local
-    for path in [prefix, number]:
-        if not os.path.exists(path):
-            raise HTTPException(status_code=404, detail=f"Missing audio file: {os.path.basename(path)}")
-
-    # Tạo danh sách file ghép
-    output_file = f"tts_{uuid.uuid4().hex}.mp3"
-    list_path = f"temp_{uuid.uuid4().hex}.txt"
-    with open(list_path, "w", encoding="utf-8") as f:
-        f.write(f"file '{prefix}'\n")
-        f.write(f"file '{number}'\n")
-        f.write(f"file '{counter_file_path}'\n")
-
-    try:
-        subprocess.run(
-            ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", output_file],
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-        )
-    except subprocess.CalledProcessError:
-        raise HTTPException(status_code=500, detail="Failed to generate audio")
-
-    # Dọn rác
-    background_tasks.add_task(lambda: os.remove(output_file))
-    background_tasks.add_task(lambda: os.remove(list_path))
-    background_tasks.add_task(lambda: os.remove(counter_file_path))
-
-    return FileResponse(output_file, media_type="audio/mpeg", filename=output_file)
+    return announcement_response(db, tts_audio.SOURCE_DB, tenxa, tenxa_id, request, if_none_match)
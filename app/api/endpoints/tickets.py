@@ -1,63 +1,77 @@
 from fastapi import APIRouter, Depends, Query, BackgroundTasks
 from sqlalchemy.orm import Session
-from app import crud, schemas, database
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import crud, crud_async, schemas, database
+from app.api.deps import get_tenxa_id, get_tenxa_id_async
 from typing import List, Optional
-from app.api.endpoints.realtime import notify_frontend
+from app.api.endpoints.realtime import notify_frontend, ticket_payload, ticket_status_event
+from app.utils import live_queue, tts_audio
+from app.database import get_db
 
 router = APIRouter()
 
-def get_db():
+def warm_up_announcements(tenxa_id: int):
     db = database.SessionLocal()
     try:
-        yield db
+        tts_audio.warm_up_announcements(db, tenxa_id, tts_audio.WARMUP_TICKETS)
+    except Exception as e:
+        print(f"⚠️ Lỗi khi ghép sẵn thông báo xã {tenxa_id}: {e}")
     finally:
         db.close()
 
 @router.post("/", response_model=schemas.Ticket)
-def create_ticket(
+async def create_ticket(
     ticket: schemas.TicketCreate,
     background_tasks: BackgroundTasks,  
     tenxa: str = Query(...),
-    db: Session = Depends(get_db)
+    tenxa_id: int = Depends(get_tenxa_id_async),
+    db: AsyncSession = Depends(database.get_async_db)
 ):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
-
     # Gán tenant_id vào ticket
-    new_ticket = crud.create_ticket(db, tenxa_id, ticket)
+    with live_queue.resync_on_error(tenxa_id):
+        new_ticket = await crud_async.create_ticket(db, tenxa_id, ticket)
+    live_queue.apply(tenxa_id, live_queue.CREATED, new_ticket)
 
     background_tasks.add_task(
         notify_frontend, {
             "event": "new_ticket",
             "ticket_number": new_ticket.number,
             "counter_id": new_ticket.counter_id,
-            "tenxa" : tenxa
+            "tenxa" : tenxa,
+            "ticket": ticket_payload(new_ticket)
         }
     )
+    if tts_audio.WARMUP_TICKETS > 0:
+        background_tasks.add_task(warm_up_announcements, tenxa_id)
 
     return new_ticket
 
 @router.get("/waiting", response_model=List[schemas.Ticket])
-def get_waiting_tickets(
+async def get_waiting_tickets(
     counter_id: Optional[int] = Query(None, description="ID của quầy (tùy chọn)"),
-    tenxa: str = Query(...),
-    db: Session = Depends(get_db)
+    tenxa_id: int = Depends(get_tenxa_id_async)
 ):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
-    
-    return crud.get_waiting_tickets(db, tenxa_id, counter_id)
+    # Đọc từ hàng đợi trong bộ nhớ (app/utils/live_queue.py), không truy vấn DB
+    return await live_queue.get_waiting(tenxa_id, counter_id)
 
 @router.get("/called", response_model=List[schemas.Ticket])
-def get_called_tickets(
+async def get_called_tickets(
     counter_id: Optional[int] = Query(None, description="ID của quầy (tùy chọn)"),
-    tenxa: str = Query(...),
-    db: Session = Depends(get_db)
+    tenxa_id: int = Depends(get_tenxa_id_async)
 ):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
-    
-    return crud.get_called_tickets(db, tenxa_id, counter_id)
+    return await live_queue.get_called(tenxa_id, counter_id)
 
 @router.put("/update_status", response_model=schemas.Ticket)
-def update_ticket_status(ticket_number: int, status_update: schemas.TicketUpdateStatus, tenxa: str = Query(...), db: Session = Depends(get_db)):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
-    
-    return crud.update_ticket_status(db, tenxa_id, ticket_number, status_update)
+def update_ticket_status(
+    ticket_number: int,
+    status_update: schemas.TicketUpdateStatus,
+    background_tasks: BackgroundTasks,
+    tenxa: str = Query(...),
+    tenxa_id: int = Depends(get_tenxa_id),
+    db: Session = Depends(get_db)
+):
+    with live_queue.resync_on_error(tenxa_id):
+        ticket = crud.update_ticket_status(db, tenxa_id, ticket_number, status_update)
+    live_queue.apply(tenxa_id, live_queue.UPDATED, ticket)
+    background_tasks.add_task(notify_frontend, ticket_status_event(ticket, tenxa))
+    return ticket
@@ -1,37 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from app import crud, schemas, database, auth, models
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import crud, schemas, auth
+from app.api.deps import get_tenxa_id, get_tenxa_id_async
 from fastapi.security import OAuth2PasswordRequestForm
+from app.database import get_db, get_async_db
+from app.utils.user_cache import CachedUser
 
 router = APIRouter()
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
 @router.post("/login", response_model=schemas.Token)
-def login_for_access_token(
+async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    tenxa: str = Query(...),
-    db: Session = Depends(get_db)
+    tenxa_id: int = Depends(get_tenxa_id_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
-    user = auth.authenticate_user(db, tenxa_id, form_data.username, form_data.password)
+    user = await auth.authenticate_user_async(db, tenxa_id, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=401, detail="Sai tài khoản hoặc mật khẩu")
 
-    access_token = auth.create_access_token(data={"sub": user.username})
+    access_token = auth.create_access_token(data=auth.token_claims(user))
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.post("/users/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, current_user: models.User = Depends(auth.get_current_user), tenxa: str = Query(...), db: Session = Depends(get_db)):
+def create_user(user: schemas.UserCreate, current_user: CachedUser = Depends(auth.get_current_user), tenxa_id: int = Depends(get_tenxa_id), db: Session = Depends(get_db)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Not enough permissions")
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
     return crud.create_user(db, tenxa_id, user)
 
 @router.get("/me", response_model=schemas.User)
-def get_current_user_info(current_user: models.User = Depends(auth.get_current_user)):
+def get_current_user_info(current_user: CachedUser = Depends(auth.get_current_user)):
     return current_user
@@ -1,14 +1,21 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import models, schemas, database
+from app import models, schemas
+from app.database import get_db, get_async_db
+from app.utils import user_cache
 
 # --- CONFIG ---
 SECRET_KEY = "your-secret-key"  # Thay bằng biến môi trường khi production
@@ -16,7 +23,22 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440
 
 # --- PASSWORD HASHING ---
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# Số vòng pbkdf2_sha256 (mặc định của passlib 29000). Đổi giá trị → hash cũ được băm lại khi người dùng đăng nhập
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "29000"))
+# Pool riêng cho việc băm / kiểm mật khẩu: hashlib.pbkdf2_hmac nhả GIL nên chạy song song được trên nhiều lõi,
+# và đăng nhập dồn dập (đầu giờ sáng) không chiếm hết threadpool của các endpoint khác
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Số lượt băm được chờ tối đa trong pool; vượt quá → trả 503 ngay thay vì để request treo tới timeout
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 16)))
+pwd_context = CryptContext(
+    schemes=["pbkdf2_sha256"],
+    deprecated="auto",
+    pbkdf2_sha256__default_rounds=PASSWORD_HASH_ROUNDS,
+    pbkdf2_sha256__min_rounds=PASSWORD_HASH_ROUNDS,
+    pbkdf2_sha256__max_rounds=PASSWORD_HASH_ROUNDS,
+)
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="pwd-hash")
+_hash_pending = 0
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
@@ -29,6 +51,24 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+async def _run_hashing(fn, *args):
+    global _hash_pending
+    if _hash_pending >= PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(status_code=503, detail="Hệ thống đang bận, vui lòng đăng nhập lại sau ít giây",
+                            headers={"Retry-After": "2"})
+    _hash_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, fn, *args)
+    finally:
+        _hash_pending -= 1
+
+async def hash_password_async(password: str) -> str:
+    return await _run_hashing(pwd_context.hash, password)
+
+async def verify_and_update_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """(đúng mật khẩu?, hash mới nếu cần băm lại theo cấu hình hiện tại)"""
+    return await _run_hashing(pwd_context.verify_and_update, plain_password, hashed_password)
+
 # --- AUTHENTICATE ---
 def authenticate_user(db: Session, tenxa_id: int, username: str, password: str) -> Optional[models.User]:
     user = db.query(models.User).filter(models.User.tenxa_id == tenxa_id).filter(models.User.username == username).first()
@@ -36,6 +76,25 @@ def authenticate_user(db: Session, tenxa_id: int, username: str, password: str)
         return None
     return user
 
+async def authenticate_user_async(db: AsyncSession, tenxa_id: int, username: str, password: str) -> Optional[models.User]:
+    """Đăng nhập không chặn event loop: băm trong pool riêng, tự băm lại mật khẩu theo số vòng hiện tại"""
+    user = (await db.execute(
+        select(models.User).where(models.User.tenxa_id == tenxa_id, models.User.username == username).limit(1)
+    )).scalar()
+    if user is None:
+        # Vẫn tốn 1 lượt băm → không đoán được tài khoản có tồn tại qua thời gian phản hồi
+        await _run_hashing(pwd_context.dummy_verify)
+        return None
+
+    ok, new_hash = await verify_and_update_async(password, user.hashed_password)
+    if not ok:
+        return None
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+        print(f"🔄 Băm lại mật khẩu của {username} ({PASSWORD_HASH_ROUNDS} vòng)")
+    return user
+
 # --- TOKEN HANDLING ---
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
@@ -43,53 +102,106 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+def token_claims(user: models.User) -> dict:
+    """Claims của access token: id, xã, vai trò, quầy đi kèm → request sau không cần tra bảng users theo username"""
+    return {
+        "sub": user.username,
+        "uid": user.id,
+        "tenxa_id": user.tenxa_id,
+        "role": getattr(user.role, "value", user.role),
+        "counter_id": user.counter_id,
+    }
 
 # --- GET CURRENT USER FROM TOKEN ---
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> models.User:
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Không thể xác thực người dùng",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def _decode_token(token: str) -> dict:
+    # Token đã kiểm chữ ký 1 lần thì lấy claims từ cache tới khi hết hạn
+    claims = user_cache.get_claims(token)
+    if claims is not None:
+        return claims
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
+    if claims.get("sub") is None:
+        raise _credentials_exception()
+    user_cache.put_claims(token, claims)
+    return claims
+
+def _cached_user(claims: dict) -> Optional[user_cache.CachedUser]:
+    return user_cache.get_user(claims["uid"]) if "uid" in claims else None
+
+def _user_query(claims: dict):
+    query = select(models.User, models.Tenxa.slug).join(models.Tenxa, models.Tenxa.id == models.User.tenxa_id)
+    if "uid" in claims:
+        return query.where(models.User.id == claims["uid"]).limit(1)
+    # Token cũ (trước khi có claims uid / tenxa_id) chỉ có username
+    return query.where(models.User.username == claims["sub"]).limit(1)
+
+def _remember_user(claims: dict, row) -> Optional[user_cache.CachedUser]:
+    if row is None:
+        return None
+    user = user_cache.CachedUser(row[0], row[1])
+    user_cache.put_user(user)
+    claims.setdefault("uid", user.id)  # token cũ: lần sau tìm theo id trong cache
+    return user
 
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if user is None:
-        raise credentials_exception
+def _check_user(user: Optional[user_cache.CachedUser], claims: dict, request: Request) -> user_cache.CachedUser:
+    if user is None or not user.is_active:
+        raise _credentials_exception()
+    if claims.get("tenxa_id") is not None and claims["tenxa_id"] != user.tenxa_id:
+        raise _credentials_exception()
+    # Request theo xã (?tenxa=...) phải đúng xã của tài khoản
+    tenxa = request.query_params.get("tenxa")
+    if tenxa is not None and tenxa != user.tenxa_slug:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Tài khoản không thuộc xã này")
     return user
 
+def get_current_user(
+    request: Request, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
+) -> user_cache.CachedUser:
+    claims = _decode_token(token)
+    user = _cached_user(claims)
+    if user is None:
+        user = _remember_user(claims, db.execute(_user_query(claims)).first())
+    return _check_user(user, claims, request)
+
+async def get_current_user_async(
+    request: Request, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)
+) -> user_cache.CachedUser:
+    """Như get_current_user cho endpoint async: dùng chung AsyncSession của request, không mở thêm session đồng bộ"""
+    claims = _decode_token(token)
+    user = _cached_user(claims)
+    if user is None:
+        user = _remember_user(claims, (await db.execute(_user_query(claims))).first())
+    return _check_user(user, claims, request)
+
 # --- ROLE CHECK ---
-def get_current_active_user(user: models.User = Depends(get_current_user)) -> models.User:
+def get_current_active_user(user: user_cache.CachedUser = Depends(get_current_user)) -> user_cache.CachedUser:
     return user
 
-def get_admin_user(user: models.User = Depends(get_current_user)) -> models.User:
+def get_admin_user(user: user_cache.CachedUser = Depends(get_current_user)) -> user_cache.CachedUser:
     if user.role != "admin":
         raise HTTPException(status_code=403, detail="Chỉ quản trị viên mới có quyền")
     return user
 
-def get_leader_user(user: models.User = Depends(get_current_user)) -> models.User:
+def get_leader_user(user: user_cache.CachedUser = Depends(get_current_user)) -> user_cache.CachedUser:
     if user.role != "leader":
         raise HTTPException(status_code=403, detail="Chỉ lãnh đạo mới có quyền")
     return user
 
-def get_staff_user(user: models.User = Depends(get_current_user)) -> models.User:
+def get_staff_user(user: user_cache.CachedUser = Depends(get_current_user)) -> user_cache.CachedUser:
     if user.role != "officer":
         raise HTTPException(status_code=403, detail="Chỉ cán bộ mới có quyền")
     return user
 
-def check_counter_permission(counter_id: int, user: models.User):
+def check_counter_permission(counter_id: int, user: user_cache.CachedUser):
     if user.role in ["admin", "leader"]:
         return
     if user.role == "officer" and user.counter_id == counter_id:
@@ -1,94 +1,77 @@
-import asyncio
-from datetime import datetime, time
-from app.database import SessionLocal
-from app.models import Counter, Ticket
-from app.api.endpoints.realtime import notify_frontend
-from app import crud
+from datetime import datetime
+from typing import List
+from sqlalchemy import text, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import AsyncSessionLocal
+from app.api.endpoints.realtime import notify_frontend, ticket_payload, ticket_status_event
+from app import crud_async
+from app.utils import live_queue
 import pytz
 
 vn_tz = pytz.timezone("Asia/Ho_Chi_Minh")
 
-async def check_and_call_next_for_counter(counter_id: int, tenxa_id: int):
-    db = SessionLocal()
-    try:
-        now = datetime.now(vn_tz)
-        today = now.date()
-        start_of_day = datetime.combine(today, time.min, tzinfo=vn_tz)
-        end_of_day = datetime.combine(today, time.max, tzinfo=vn_tz)
+# Các quầy (trong số quầy đến hạn của 1 xã) đủ điều kiện tự gọi: quầy đang hoạt động,
+# có cán bộ ngồi và ghế khách đang trống → 1 câu truy vấn cho cả xã thay vì mỗi quầy 2 câu
+ELIGIBLE_COUNTERS_SQL = text("""
+    SELECT c.id
+    FROM counters c
+    JOIN seats s ON s.tenxa_id = c.tenxa_id AND s.counter_id = c.id
+    WHERE c.tenxa_id = :tenxa_id AND c.id IN :counter_ids AND c.status = 'active'
+    GROUP BY c.id
+    HAVING bool_or(s.type = 'officer' AND s.status)
+       AND bool_or(s.type = 'client')
+       AND NOT bool_or(s.type = 'client' AND COALESCE(s.status, false))
+""").bindparams(bindparam("counter_ids", expanding=True))
 
-        counter = db.query(Counter).filter(Counter.tenxa_id == tenxa_id).filter(Counter.id == counter_id).first()
-        if not counter:
-            print(f"❌ Không tìm thấy quầy với ID {counter_id}")
-            return
-        if counter.status != "active":
-            return  
 
-        seats = counter.seats
-        if not seats or len(seats) < 2:
-            return
+async def eligible_counters(db: AsyncSession, tenxa_id: int, counter_ids: List[int]) -> List[int]:
+    rows = await db.execute(ELIGIBLE_COUNTERS_SQL, {"tenxa_id": tenxa_id, "counter_ids": list(counter_ids)})
+    return rows.scalars().all()
 
-        officer_seat = next((s for s in seats if s.type == 'officer'), None)
-        client_seat = next((s for s in seats if s.type == 'client'), None)
 
-        if officer_seat is None or client_seat is None:
-            return
-        
-        if officer_seat.tenxa_id != tenxa_id or client_seat.tenxa_id != tenxa_id:
-            print(f"❌ Seat không thuộc xã {tenxa_id}")
-            return
+async def call_next_for_counter(db: AsyncSession, tenxa_id: int, counter_id: int):
+    # 👉 Đóng vé đang gọi + gọi vé tiếp theo: như gọi tay (crud_async.call_next_ticket)
+    with live_queue.resync_on_error(tenxa_id):
+        advance = await crud_async.call_next_ticket(db, tenxa_id, counter_id)
+    if advance is None:
+        return None
 
-        if not officer_seat.status:
-            print(f"⚠️ Không có cán bộ ngồi tại quầy {counter.name} xã {tenxa_id}")
-            return
+    tenxa = await crud_async.get_slug_from_tenxa_id(db, tenxa_id)
+    for finished in advance.finished:
+        live_queue.apply(tenxa_id, live_queue.UPDATED, finished)
+        await notify_frontend(ticket_status_event(finished, tenxa))
+    if advance.ticket is None:
+        return None
+    next_ticket, counter_name = advance.ticket, advance.counter_name
+    live_queue.apply(tenxa_id, live_queue.CALLED, next_ticket)
 
-        if officer_seat.status and not client_seat.status:
-            # 👉 Đánh dấu vé đang "called" (nếu có) thành "done"
-            current_ticket = (
-                db.query(Ticket)
-                .filter(
-                    Ticket.status == "called",
-                    Ticket.counter_id == counter.id,
-                    Ticket.tenxa_id == tenxa_id
-                )
-                .order_by(Ticket.called_at.desc())  # Ưu tiên mới nhất nếu có nhiều
-                .first()
-            )
-            if current_ticket:
-                current_ticket.status = "done"
-                current_ticket.finished_at = now  # nếu có field thời gian kết thúc
-                db.commit()
+    print(f"🎯 Gọi vé {next_ticket.number} tại quầy {counter_name} xã {tenxa}")
 
-            # 👉 Gọi vé tiếp theo
-            next_ticket = (
-                db.query(Ticket)
-                .filter(
-                    Ticket.status == "waiting",
-                    Ticket.counter_id == counter.id,
-                    Ticket.tenxa_id == tenxa_id
-                )
-                .filter(Ticket.created_at >= start_of_day)
-                .filter(Ticket.created_at <= end_of_day)
-                .order_by(Ticket.created_at)
-                .first()
-            )
+    vn_time = datetime.now(pytz.timezone("Asia/Ho_Chi_Minh")).isoformat()
+    await notify_frontend({
+        "event": "ticket_called",
+        "ticket_number": next_ticket.number,
+        "counter_id": counter_id,
+        "counter_name": counter_name,
+        "tenxa": tenxa,
+        "timestamp": vn_time,
+        "ticket": ticket_payload(next_ticket)
+    })
+    return next_ticket
 
-            if next_ticket:
-                tenxa = crud.get_slug_from_tenxa_id(db, tenxa_id)
-                print(f"🎯 Gọi vé {next_ticket.number} tại quầy {counter.name} xã {tenxa}")
-                next_ticket.status = "called"
-                next_ticket.called_at = now  # nếu có field thời gian gọi
-                db.commit()
 
-                vn_time = datetime.now(pytz.timezone("Asia/Ho_Chi_Minh")).isoformat()
-                await notify_frontend({
-                    "event": "ticket_called",
-                    "ticket_number": next_ticket.number,
-                    "counter_name": counter.name,
-                    "tenxa": tenxa,
-                    "timestamp": vn_time
-                })
+async def check_and_call_next(tenxa_id: int, counter_ids: List[int]):
+    """Kiểm tra 1 lượt các quầy đến hạn của 1 xã và tự gọi vé cho quầy đủ điều kiện"""
+    async with AsyncSessionLocal() as db:
+        try:
+            eligible = await eligible_counters(db, tenxa_id, counter_ids)
+        except Exception as e:
+            print(f"❌ Lỗi khi kiểm tra auto-call xã {tenxa_id}: {e}")
+            return
 
-    except Exception as e:
-        print(f"❌ Lỗi khi auto-call cho quầy {counter_id}: {e}")
-    finally:
-        db.close()
+        for counter_id in eligible:
+            try:
+                await call_next_for_counter(db, tenxa_id, counter_id)
+            except Exception as e:
+                await db.rollback()
+                print(f"❌ Lỗi khi auto-call cho quầy {counter_id} xã {tenxa_id}: {e}")
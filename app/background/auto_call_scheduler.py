@@ -0,0 +1,196 @@
+# app/background/auto_call_scheduler.py
+# Bộ lập lịch auto-call dùng chung cho mọi quầy, thay cho 1 coroutine / quầy / worker:
+#  - chỉ 1 worker (leader) chạy nhờ pg_try_advisory_lock trên 1 kết nối riêng; leader chết → lock tự nhả,
+#    worker khác lên thay. Mỗi vòng leader SELECT 1 trên kết nối đó (tối đa LEADER_CHECK_TIMEOUT giây);
+#    lỗi / quá hạn (mạng rớt, DB đã nhả lock) → thôi làm leader, không gọi số song song với leader mới
+#  - chạy nhiều worker (--workers N / WEB_CONCURRENCY > 1) bắt buộc EVENT_BUS_BACKEND=postgres: reset
+#    auto-call từ worker khác chỉ tới được leader qua event bus → khởi động sẽ báo lỗi nếu thiếu
+#  - heap (thời điểm đến hạn, xã, quầy): mỗi lần thức dậy lấy hết quầy đến hạn, gom theo xã rồi kiểm tra
+#    bằng 1 câu truy vấn / xã (auto_call.check_and_call_next)
+#  - định kỳ đọc lại danh sách quầy của các xã bật auto_call → quầy / xã mới không cần khởi động lại
+#  - chu kỳ của mỗi quầy = counters.timeout_seconds; ghế khách vừa trống → kiểm tra ngay (immediate)
+import asyncio
+import heapq
+import os
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import asyncpg
+from sqlalchemy import select
+
+from app.background.auto_call import check_and_call_next
+from app.database import AsyncSessionLocal, asyncpg_dsn
+from app.models import Counter, Tenxa
+from app.utils import event_bus
+
+AUTO_CALL_INTERVAL = 60  # chu kỳ mặc định khi quầy chưa cấu hình timeout_seconds
+AUTO_CALL_REFRESH_SECONDS = float(os.getenv("AUTO_CALL_REFRESH_SECONDS", "30"))
+AUTO_CALL_LOCK_KEY = int(os.getenv("AUTO_CALL_LOCK_KEY", "7420001"))
+LEADER_RETRY_SECONDS = 5
+LEADER_CHECK_TIMEOUT = float(os.getenv("LEADER_CHECK_TIMEOUT", "3"))  # giây
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+Key = Tuple[int, int]  # (tenxa_id, counter_id)
+
+
+class AutoCallScheduler:
+    def __init__(self):
+        self.counters: Dict[Key, float] = {}   # quầy đang được điều khiển -> chu kỳ (giây)
+        self.heap: List[Tuple[float, int, int, int]] = []  # (đến hạn, tenxa_id, counter_id, version)
+        self.versions: Dict[Key, int] = {}     # version mới nhất của mỗi quầy; mục cũ trong heap bị bỏ qua
+        self.due: Dict[Key, float] = {}        # lần kiểm tra kế tiếp của mỗi quầy
+        self.wakeup = asyncio.Event()
+        self.is_leader = False
+        self.task = None
+
+    async def start(self):
+        if WEB_CONCURRENCY > 1 and event_bus.EVENT_BUS_BACKEND != "postgres":
+            raise RuntimeError(
+                f"WEB_CONCURRENCY={WEB_CONCURRENCY} cần EVENT_BUS_BACKEND=postgres "
+                "(reset auto-call, hàng đợi, cache giữa các worker)"
+            )
+        self.task = asyncio.create_task(self._run_forever())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    # ==== Lịch ====
+
+    def _schedule(self, key: Key, delay: float):
+        version = self.versions.get(key, 0) + 1
+        self.versions[key] = version
+        due = asyncio.get_running_loop().time() + delay
+        self.due[key] = due
+        heapq.heappush(self.heap, (due, key[0], key[1], version))
+        self.wakeup.set()
+
+    def reset(self, tenxa_id: int, counter_id: int, immediate: bool = False):
+        """Bắt đầu lại chu kỳ chờ của quầy (gọi số thủ công, khách ngồi vào ghế...);
+        immediate=True → kiểm tra ngay ở lượt kế tiếp (khách vừa rời ghế)"""
+        key = (tenxa_id, counter_id)
+        if key in self.counters:
+            print(f"♻️ {'Kiểm tra ngay' if immediate else 'Reset'} auto-call cho quầy {counter_id} xã {tenxa_id}")
+            self._schedule(key, 0 if immediate else self.counters[key])
+
+    def _pop_due(self, now: float) -> Dict[int, List[int]]:
+        due = defaultdict(list)
+        while self.heap and self.heap[0][0] <= now:
+            _, tenxa_id, counter_id, version = heapq.heappop(self.heap)
+            key = (tenxa_id, counter_id)
+            if key in self.counters and self.versions.get(key) == version:
+                due[tenxa_id].append(counter_id)
+        return due
+
+    def controlled(self, tenxa_id: int = None) -> List[dict]:
+        now = asyncio.get_running_loop().time()
+        return [
+            {
+                "tenxa_id": key[0],
+                "counter_id": key[1],
+                "interval_seconds": interval,
+                "next_check_in": round(max(0.0, self.due.get(key, now) - now), 1),
+            }
+            for key, interval in sorted(self.counters.items())
+            if tenxa_id is None or key[0] == tenxa_id
+        ]
+
+    async def refresh(self):
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(Counter.tenxa_id, Counter.id, Counter.timeout_seconds)
+                .join(Tenxa, Counter.tenxa_id == Tenxa.id)
+                .where(Tenxa.auto_call == True)
+            )).all()
+
+        # Đổi timeout_seconds của quầy có hiệu lực từ chu kỳ kế tiếp
+        current = {
+            (tenxa_id, counter_id): timeout_seconds or AUTO_CALL_INTERVAL
+            for tenxa_id, counter_id, timeout_seconds in rows
+        }
+        added = [key for key in current if key not in self.counters]
+        removed = [key for key in self.counters if key not in current]
+        self.counters = current
+        for key in removed:
+            self.versions.pop(key, None)
+            self.due.pop(key, None)
+        for key in added:
+            self._schedule(key, current[key])
+        if added or removed:
+            print(f"🔄 Auto-call: {len(current)} quầy (+{len(added)} / -{len(removed)})")
+
+    # ==== Vòng lặp leader ====
+
+    async def _run_forever(self):
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(asyncpg_dsn())
+                while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", AUTO_CALL_LOCK_KEY):
+                    await asyncio.sleep(LEADER_RETRY_SECONDS)
+                print(f"👑 Worker {os.getpid()} điều khiển auto-call")
+                self.is_leader = True
+                await self._lead(conn)
+                print("⚠️ Mất kết nối giữ quyền điều khiển auto-call")
+            except Exception as e:
+                print(f"❌ Lỗi bộ lập lịch auto-call: {e}")
+            finally:
+                self.is_leader = False
+                self.counters, self.heap, self.versions, self.due = {}, [], {}, {}
+                if conn is not None and not conn.is_closed():
+                    try:
+                        await conn.close(timeout=LEADER_CHECK_TIMEOUT)  # đóng kết nối → nhả advisory lock
+                    except Exception:
+                        conn.terminate()  # kết nối đã chết: bỏ luôn, DB tự nhả lock khi phát hiện
+            await asyncio.sleep(LEADER_RETRY_SECONDS)
+
+    async def _lead(self, conn):
+        loop = asyncio.get_running_loop()
+        next_refresh = loop.time()
+
+        while await self._still_leader(conn):
+            now = loop.time()
+            if now >= next_refresh:
+                try:
+                    await self.refresh()
+                except Exception as e:
+                    print(f"❌ Lỗi khi tải danh sách quầy auto-call: {e}")
+                next_refresh = now + AUTO_CALL_REFRESH_SECONDS
+
+            due = self._pop_due(now)
+            if due:
+                popped = {
+                    (tenxa_id, counter_id): self.versions.get((tenxa_id, counter_id))
+                    for tenxa_id, counter_ids in due.items() for counter_id in counter_ids
+                }
+                await asyncio.gather(*(
+                    check_and_call_next(tenxa_id, counter_ids) for tenxa_id, counter_ids in due.items()
+                ))
+                # Quầy được reset trong lúc đang kiểm tra đã có lịch mới → giữ nguyên lịch đó
+                for key, version in popped.items():
+                    if key in self.counters and self.versions.get(key) == version:
+                        self._schedule(key, self.counters[key])
+
+            # Ngủ tới quầy đến hạn sớm nhất / lần làm mới kế tiếp; thức dậy sớm khi có reset
+            wake_at = min(next_refresh, self.heap[0][0]) if self.heap else next_refresh
+            timeout = min(max(0.0, wake_at - loop.time()), LEADER_RETRY_SECONDS)
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _still_leader(self, conn) -> bool:
+        # is_closed() không phát hiện kết nối chết im lặng (mạng rớt): advisory lock có thể đã được DB
+        # nhả và worker khác đã lên làm leader → hỏi thẳng DB trước mỗi lượt gọi số
+        if conn.is_closed():
+            return False
+        try:
+            await asyncio.wait_for(conn.fetchval("SELECT 1"), timeout=LEADER_CHECK_TIMEOUT)
+            return True
+        except Exception as e:
+            print(f"⚠️ Kết nối giữ quyền auto-call không phản hồi: {e!r}")
+            return False
+
+
+scheduler = AutoCallScheduler()
@@ -0,0 +1,26 @@
+import asyncio
+import os
+from app.database import SessionLocal
+from app.utils import daily_stats
+
+# Chu kỳ kiểm tra chốt số liệu ngày (giây) và số ngày gần nhất được chốt bù nếu server tắt qua đêm
+DAILY_STATS_INTERVAL = int(os.getenv("DAILY_STATS_INTERVAL", "600"))
+DAILY_STATS_LOOKBACK_DAYS = int(os.getenv("DAILY_STATS_LOOKBACK_DAYS", "7"))
+
+
+def close_pending_days():
+    db = SessionLocal()
+    try:
+        return daily_stats.close_pending_days(db, DAILY_STATS_LOOKBACK_DAYS)
+    finally:
+        db.close()
+
+
+async def daily_stats_loop():
+    while True:
+        try:
+            # Truy vấn đồng bộ → chạy trong thread để không chặn event loop
+            await asyncio.to_thread(close_pending_days)
+        except Exception as e:
+            print(f"❌ Lỗi khi chốt thống kê ngày: {e}")
+        await asyncio.sleep(DAILY_STATS_INTERVAL)
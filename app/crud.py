@@ -1,31 +1,44 @@
 from sqlalchemy.orm import Session
 from app import models
-from typing import List, Optional
+from typing import List, NamedTuple, Optional
 from rapidfuzz import fuzz
 from datetime import datetime, time
 from sqlalchemy import extract
-from app.models import Procedure, Counter, CounterField, Ticket
+from app.models import Procedure, CounterField, Ticket
 from app import models, schemas, auth
-from passlib.context import CryptContext
 from fastapi import HTTPException
 from pytz import timezone
+from app.utils import procedure_index, tenxa_cache
 
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 vn_tz = timezone("Asia/Ho_Chi_Minh")
 
 def get_tenxa_id_from_slug(db: Session, slug: str) -> Optional[int]:
+    tenxa_id = tenxa_cache.get_id(slug)
+    if tenxa_id is not None:
+        return tenxa_id
+
     tenxa = db.query(models.Tenxa).filter(models.Tenxa.slug == slug).first()
-    return tenxa.id if tenxa else None
+    if not tenxa:
+        return None
+    tenxa_cache.put(tenxa.id, tenxa.slug)
+    return tenxa.id
 
 def get_slug_from_tenxa_id(db: Session, tenxa_id: int) ->Optional[str]:
+    slug = tenxa_cache.get_slug(tenxa_id)
+    if slug is not None:
+        return slug
+
     tenxa = db.query(models.Tenxa).filter(models.Tenxa.id == tenxa_id).first()
-    return tenxa.slug if tenxa else None
+    if not tenxa:
+        return None
+    tenxa_cache.put(tenxa.id, tenxa.slug)
+    return tenxa.slug
 
 def get_user_by_username(db: Session, tenxa_id: int, username: str):
     return db.query(models.User).filter(models.User.tenxa_id == tenxa_id).filter(models.User.username == username).first()
 
 def create_user(db: Session,tenxa_id: int, user: schemas.UserCreate):
-    hashed_password = pwd_context.hash(user.password)
+    hashed_password = auth.hash_password(user.password)
     db_user = models.User(
         username=user.username,
         hashed_password=hashed_password,
@@ -40,24 +53,14 @@ def create_user(db: Session,tenxa_id: int, user: schemas.UserCreate):
 
 def authenticate_user(db: Session,tenxa_id: int, username: str, password: str):
     user = get_user_by_username(db, tenxa_id, username)
-    if not user or not pwd_context.verify(password, user.hashed_password):
+    if not user or not auth.verify_password(password, user.hashed_password):
         return None
     return user
-def get_procedures(db: Session, tenxa_id: int, search: str = "") -> List[models.Procedure]:
-    if not search:
-        return db.query(models.Procedure).filter(models.Procedure.tenxa_id == tenxa_id).all()
-
-    all_procedures = db.query(models.Procedure).filter(models.Procedure.tenxa_id == tenxa_id).all()
-    results = []
-
-    for proc in all_procedures:
-        score = fuzz.partial_ratio(search.lower(), proc.name.lower())
-        if score > 60:  # ngưỡng độ tương đồng (có thể điều chỉnh)
-            results.append((score, proc))
-
-    # Sắp xếp theo độ giống giảm dần
-    results.sort(reverse=True, key=lambda x: x[0])
-    return [proc for _, proc in results]
+def get_procedures(db: Session, tenxa_id: int, search: str = "") -> List[dict]:
+    # Chấm điểm trên chỉ mục trong bộ nhớ của xã (tên đã bỏ dấu), không truy vấn DB mỗi lần gõ phím
+    index = procedure_index.get_index(db, tenxa_id)
+    matches = index.search(search, fuzz.partial_ratio, score_cutoff=60, limit=None)
+    return [index.procedures[i] for i, score in matches if score > 60]  # ngưỡng độ tương đồng (như trước: > 60)
 
 def create_ticket_old(db: Session, tenxa_id: int, ticket: schemas.TicketCreate) -> models.Ticket:
     today = datetime.now(timezone("Asia/Ho_Chi_Minh")).date()
@@ -87,12 +90,19 @@ def create_ticket_old(db: Session, tenxa_id: int, ticket: schemas.TicketCreate)
     db.refresh(db_ticket)
     return db_ticket
 
-from datetime import datetime, time, timedelta
+from datetime import datetime, time, timedelta, date
 from pytz import timezone
+from sqlalchemy import DateTime, bindparam, literal_column, select, text
 
-def create_ticket(db: Session, tenxa_id: int, ticket: schemas.TicketCreate) -> models.Ticket:
-    now = datetime.now(timezone("Asia/Ho_Chi_Minh"))
+def get_today_range(now: Optional[datetime] = None):
+    """Khoảng [00:00, 23:59:59.999999] của ngày hôm nay theo giờ VN"""
+    today = (now or datetime.now(vn_tz)).date()
+    start_of_day = datetime.combine(today, time.min, tzinfo=vn_tz)
+    end_of_day = datetime.combine(today, time.max, tzinfo=vn_tz)
+    return start_of_day, end_of_day
 
+def get_ticket_number_range(tenxa_id: int, now: datetime):
+    """Khoảng thời gian dùng chung 1 dãy số vé (mốc reset số vé)"""
     if tenxa_id == 0:
         # Reset vé lúc 17:30 hôm nay
         reset_time = datetime.combine(now.date(), time(17, 30, 0), tzinfo=timezone("Asia/Ho_Chi_Minh"))
@@ -110,29 +120,148 @@ def create_ticket(db: Session, tenxa_id: int, ticket: schemas.TicketCreate) -> m
         today = now.date()
         start_of_range = datetime.combine(today, time.min, tzinfo=timezone("Asia/Ho_Chi_Minh"))
         end_of_range = datetime.combine(today, time.max, tzinfo=timezone("Asia/Ho_Chi_Minh"))
+    return start_of_range, end_of_range
+
+def get_ticket_business_day(tenxa_id: int, now: datetime) -> date:
+    """Ngày làm việc mà số vé thuộc về (khoá của bộ đếm ticket_sequences)"""
+    _, end_of_range = get_ticket_number_range(tenxa_id, now)
+    return end_of_range.date()
+
+# Cấp số + tạo vé trong 1 câu lệnh: bộ đếm (xã, ngày) được khoá dòng bởi ON CONFLICT DO UPDATE
+# nên các kiosk bấm cùng lúc luôn nhận số khác nhau, không trùng, không cần SELECT MAX trước
+ALLOCATE_TICKET_SQL = text("""
+    WITH seq AS (
+        INSERT INTO ticket_sequences (tenxa_id, business_day, last_number)
+        VALUES (:tenxa_id, :business_day, 1)
+        ON CONFLICT (tenxa_id, business_day)
+        DO UPDATE SET last_number = ticket_sequences.last_number + 1
+        RETURNING last_number
+    )
+    INSERT INTO tickets (number, counter_id, tenxa_id, created_at, status)
+    SELECT seq.last_number, :counter_id, :tenxa_id, now(), 'waiting' FROM seq
+    RETURNING tickets.id, tickets.number, tickets.counter_id, tickets.created_at, tickets.status,
+              tickets.called_at, tickets.finished_at, tickets.tenxa_id
+""")
+
+def allocate_ticket_statement(tenxa_id: int, counter_id: int, now: datetime):
+    return select(models.Ticket).from_statement(
+        ALLOCATE_TICKET_SQL.bindparams(
+            tenxa_id=tenxa_id,
+            counter_id=counter_id,
+            business_day=get_ticket_business_day(tenxa_id, now)
+        )
+    )
 
-    # Tìm vé mới nhất trong khoảng thời gian áp dụng
-    latest = (
-        db.query(models.Ticket)
-        .filter(models.Ticket.tenxa_id == tenxa_id)
-        .filter(models.Ticket.created_at >= start_of_range)
-        .filter(models.Ticket.created_at <= end_of_range)
-        .order_by(models.Ticket.number.desc())
-        .first()
+# Khoá dòng quầy FOR NO KEY UPDATE (chờ, không bỏ qua) trong 1 câu lệnh riêng trước ADVANCE_QUEUE_SQL: các lượt
+# gọi của cùng quầy (gọi tay + auto-call) chạy lần lượt. Phải là câu lệnh riêng: ở READ COMMITTED mỗi câu lệnh lấy
+# snapshot lúc bắt đầu, khoá trong CTE thì các CTE còn lại vẫn đọc snapshot trước lúc chờ khoá → không thấy vé lượt
+# trước vừa gọi (2 vé "called" cùng quầy, gọi nhảy cóc). Không xung đột với FOR KEY SHARE do kiosk đang thêm vé
+# vào quầy giữ (kiểm tra khoá ngoại tickets.counter_id).
+LOCK_COUNTER_SQL = text("""
+    SELECT name FROM counters
+    WHERE tenxa_id = :tenxa_id AND id = :counter_id AND status = 'active'
+    FOR NO KEY UPDATE
+""")
+
+# Gọi vé kế tiếp của 1 quầy (sau LOCK_COUNTER_SQL, cùng transaction), dùng chung cho gọi tay và auto-call:
+#  - đóng mọi vé "called" của quầy, nhận vé "waiting" sớm nhất hôm nay (theo created_at)
+#  - trả về cả vé vừa gọi (event = 'called') lẫn các vé vừa đóng (event = 'finished'), kể cả khi hết vé chờ
+ADVANCE_QUEUE_SQL = text("""
+    WITH counter AS (
+        SELECT name FROM counters
+        WHERE tenxa_id = :tenxa_id AND id = :counter_id AND status = 'active'
+        LIMIT 1
+    ),
+    finished AS (
+        UPDATE tickets t SET status = 'done', finished_at = :now
+        FROM counter
+        WHERE t.tenxa_id = :tenxa_id AND t.counter_id = :counter_id AND t.status = 'called'
+        RETURNING t.id, t.number, t.counter_id, t.created_at, t.status, t.called_at, t.finished_at, t.tenxa_id
+    ),
+    claimed AS (
+        SELECT t.id FROM tickets t
+        WHERE EXISTS (SELECT 1 FROM counter)
+          AND t.tenxa_id = :tenxa_id AND t.counter_id = :counter_id AND t.status = 'waiting'
+          AND t.created_at >= :start_of_day AND t.created_at <= :end_of_day
+        ORDER BY t.created_at
+        LIMIT 1
+        FOR UPDATE
+    ),
+    called AS (
+        UPDATE tickets t SET status = 'called', called_at = :now
+        FROM claimed
+        WHERE t.id = claimed.id
+        RETURNING t.id, t.number, t.counter_id, t.created_at, t.status, t.called_at, t.finished_at, t.tenxa_id
+    )
+    SELECT called.*, counter.name AS counter_name, 'called' AS event FROM called, counter
+    UNION ALL
+    SELECT finished.*, counter.name, 'finished' FROM finished, counter
+""").bindparams(
+    # timestamptz để asyncpg nhận datetime có múi giờ; Postgres tự quy đổi cho cột timestamp (như crud_async.tz_param)
+    bindparam("now", type_=DateTime(timezone=True)),
+    bindparam("start_of_day", type_=DateTime(timezone=True)),
+    bindparam("end_of_day", type_=DateTime(timezone=True)),
+)
+
+class QueueAdvance(NamedTuple):
+    ticket: Optional[Ticket]   # vé vừa gọi, None nếu hết vé chờ
+    counter_name: str
+    finished: List[Ticket]     # các vé "called" vừa được đóng
+
+def lock_counter_statement(tenxa_id: int, counter_id: int):
+    """Khoá quầy cho lượt gọi số; không có dòng nào → quầy không tồn tại / không hoạt động"""
+    return LOCK_COUNTER_SQL.bindparams(tenxa_id=tenxa_id, counter_id=counter_id)
+
+def advance_queue_statement(tenxa_id: int, counter_id: int, now: datetime):
+    """Câu lệnh gọi vé kế tiếp; mỗi dòng kết quả là (Ticket, tên quầy, 'called' | 'finished')"""
+    start_of_day, end_of_day = get_today_range(now)
+    return select(models.Ticket, literal_column("counter_name"), literal_column("event")).from_statement(
+        ADVANCE_QUEUE_SQL.bindparams(
+            tenxa_id=tenxa_id,
+            counter_id=counter_id,
+            now=now,
+            start_of_day=start_of_day,
+            end_of_day=end_of_day
+        )
     )
 
-    next_number = 1 if not latest else latest.number + 1
+def queue_advance(rows) -> Optional[QueueAdvance]:
+    """Gom kết quả của advance_queue_statement; None nếu quầy không hoạt động hoặc không có gì thay đổi"""
+    if not rows:
+        return None
+    called = [ticket for ticket, _, event in rows if event == "called"]
+    finished = [ticket for ticket, _, event in rows if event == "finished"]
+    return QueueAdvance(called[0] if called else None, rows[0][1], finished)
 
-    db_ticket = models.Ticket(
-        number=next_number,
-        counter_id=ticket.counter_id,
-        tenxa_id=tenxa_id
-    )
-    db.add(db_ticket)
+def create_ticket(db: Session, tenxa_id: int, ticket: schemas.TicketCreate) -> models.Ticket:
+    now = datetime.now(timezone("Asia/Ho_Chi_Minh"))
+    db_ticket = db.execute(allocate_ticket_statement(tenxa_id, ticket.counter_id, now)).scalars().one()
     db.commit()
-    db.refresh(db_ticket)
     return db_ticket
 
+def seed_ticket_sequences(db: Session):
+    """Đồng bộ bộ đếm với số vé lớn nhất đã cấp trong ngày (khi mới triển khai giữa ngày)"""
+    now = datetime.now(vn_tz)
+    for (tenxa_id,) in db.query(models.Tenxa.id).all():
+        start_of_range, end_of_range = get_ticket_number_range(tenxa_id, now)
+        db.execute(
+            text("""
+                INSERT INTO ticket_sequences (tenxa_id, business_day, last_number)
+                SELECT :tenxa_id, :business_day, MAX(number) FROM tickets
+                WHERE tenxa_id = :tenxa_id AND created_at >= :start AND created_at <= :end
+                HAVING MAX(number) IS NOT NULL
+                ON CONFLICT (tenxa_id, business_day)
+                DO UPDATE SET last_number = GREATEST(ticket_sequences.last_number, EXCLUDED.last_number)
+            """),
+            {
+                "tenxa_id": tenxa_id,
+                "business_day": end_of_range.date(),
+                "start": start_of_range,
+                "end": end_of_range,
+            }
+        )
+    db.commit()
+
 
 def get_waiting_tickets(db: Session, tenxa_id: int, counter_id: Optional[int] = None):
     #vn_tz = ZoneInfo("Asia/Ho_Chi_Minh")
@@ -203,93 +332,20 @@ def get_procedures_with_counters1(db: Session, tenxa_id: int, search: str = "")
     return results[:5]
 
 def get_procedures_with_counters(db: Session, tenxa_id: int, search: str = "") -> List[dict]:
-    procedures = db.query(models.Procedure).filter(models.Procedure.tenxa_id == tenxa_id).all()
-
-    # Tạo danh sách field_id từ procedures để truy 1 lần CounterField
-    field_ids = list(set([p.field_id for p in procedures]))
-    
-    # Truy vấn tất cả CounterField liên quan
-    counterfield_map = db.query(models.CounterField).filter(
-        models.CounterField.tenxa_id == tenxa_id,
-        models.CounterField.field_id.in_(field_ids)
-    ).all()
-    
-    # Tạo mapping từ field_id -> set(counter_id)
-    field_to_counters = {}
-    for cf in counterfield_map:
-        field_to_counters.setdefault(cf.field_id, set()).add(cf.counter_id)
-    
-    # Lấy tất cả counter_id cần dùng
-    all_counter_ids = {cid for cids in field_to_counters.values() for cid in cids}
-    counters = db.query(models.Counter).filter(
-        models.Counter.tenxa_id == tenxa_id,
-        models.Counter.id.in_(all_counter_ids)
-    ).all()
-    counter_dict = {c.id: {"id": c.id, "name": c.name} for c in counters}
-
-    results = []
-
-    for proc in procedures:
-        score = fuzz.token_set_ratio(search.lower(), proc.name.lower()) if search else 100
-        if score >= 10:
-            counter_ids = field_to_counters.get(proc.field_id, [])
-            matched_counters = [counter_dict[cid] for cid in counter_ids if cid in counter_dict]
-
-            results.append({
-                "id": proc.id,
-                "name": proc.name,
-                "field_id": proc.field_id,
-                "score": score,
-                "counters": matched_counters
-            })
-
-    results.sort(key=lambda x: x["score"], reverse=True)
-    return results[:3]
+    # Quầy phục vụ từng thủ tục đã tính sẵn trong chỉ mục → không cần truy CounterField / Counter
+    return procedure_index.search_with_counters(procedure_index.get_index(db, tenxa_id), search)
 
-def call_next_ticket(db: Session, tenxa_id: int, counter_id: int) -> Optional[Ticket]:
-    # Kiểm tra xem quầy có tồn tại không
-    now = datetime.now(vn_tz)
-    today = now.date()
-    start_of_day = datetime.combine(today, time.min, tzinfo=vn_tz)
-    end_of_day = datetime.combine(today, time.max, tzinfo=vn_tz)
-    counter = db.query(Counter).filter(Counter.id == counter_id).filter(Counter.tenxa_id == tenxa_id).first()
-    if not counter:
+def call_next_ticket(db: Session, tenxa_id: int, counter_id: int) -> Optional[QueueAdvance]:
+    """Vé vừa gọi + tên quầy + các vé vừa đóng; None nếu quầy không hoạt động hoặc không có gì thay đổi"""
+    if db.execute(lock_counter_statement(tenxa_id, counter_id)).first() is None:
+        db.rollback()
         return None
-    if counter.status != "active":
-        return None 
-    
-    current_ticket = (
-        db.query(Ticket)
-        .filter(Ticket.tenxa_id == tenxa_id)
-        .filter(Ticket.counter_id == counter_id)
-        .filter(Ticket.status == "called")
-        .order_by(Ticket.created_at)
-        .first()
-    )
-    if current_ticket:
-        current_ticket.status = "done"
-        current_ticket.finished_at = now
-        db.commit()
-
-    # Lấy vé tiếp theo theo quầy đó (giả định: theo thứ tự created_at)
-    next_ticket = (
-        db.query(Ticket)
-        .filter(Ticket.tenxa_id == tenxa_id)
-        .filter(Ticket.counter_id == counter_id)
-        .filter(Ticket.status == "waiting")
-        .filter(Ticket.created_at >= start_of_day)
-        .filter(Ticket.created_at <= end_of_day)
-        .order_by(Ticket.created_at)
-        .first()
-    )
-
-    if next_ticket:
-        next_ticket.status = "called"
-        next_ticket.called_at = now
-        db.commit()
-        return next_ticket
-
-    return None
+    # Lấy giờ sau khi có khoá → called_at / finished_at theo đúng thứ tự các lượt gọi
+    rows = db.execute(advance_queue_statement(tenxa_id, counter_id, datetime.now(vn_tz))).all()
+    for ticket, _, _ in rows:
+        db.expunge(ticket)  # giữ nguyên giá trị sau commit, không phải nạp lại vé
+    db.commit()
+    return queue_advance(rows)
 
 def update_ticket_status_old(db: Session, tenxa_id: int, ticket_number: int, status_update: schemas.TicketUpdateStatus):
     ticket = db.query(models.Ticket).filter(models.Ticket.tenxa_id == tenxa_id).filter(models.Ticket.number == ticket_number).first()
@@ -0,0 +1,111 @@
+# app/crud_async.py
+# Các thao tác vé / gọi số dùng AsyncSession (asyncpg) để không chặn event loop
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import select, literal, DateTime
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models, schemas
+from app.crud import (
+    vn_tz, get_today_range, allocate_ticket_statement, lock_counter_statement, advance_queue_statement,
+    queue_advance, QueueAdvance
+)
+from app.models import Counter, Seat, Ticket
+from app.utils import tenxa_cache
+
+
+def tz_param(value: datetime):
+    # asyncpg không nhận datetime có múi giờ cho cột timestamp → gửi dạng timestamptz,
+    # Postgres tự quy đổi giống như psycopg2 ở phần đồng bộ
+    return literal(value, DateTime(timezone=True))
+
+
+async def get_slug_from_tenxa_id(db: AsyncSession, tenxa_id: int) -> Optional[str]:
+    slug = tenxa_cache.get_slug(tenxa_id)
+    if slug is not None:
+        return slug
+
+    tenxa = (await db.execute(select(models.Tenxa).where(models.Tenxa.id == tenxa_id))).scalars().first()
+    if not tenxa:
+        return None
+    tenxa_cache.put(tenxa.id, tenxa.slug)
+    return tenxa.slug
+
+
+async def get_tenxa_id_from_slug(db: AsyncSession, slug: str) -> Optional[int]:
+    tenxa_id = tenxa_cache.get_id(slug)
+    if tenxa_id is not None:
+        return tenxa_id
+
+    tenxa = (await db.execute(select(models.Tenxa).where(models.Tenxa.slug == slug))).scalars().first()
+    if not tenxa:
+        return None
+    tenxa_cache.put(tenxa.id, tenxa.slug)
+    return tenxa.id
+
+
+async def get_counters(db: AsyncSession, tenxa_id: int) -> List[Counter]:
+    result = await db.execute(select(Counter).where(Counter.tenxa_id == tenxa_id).order_by(Counter.id))
+    return list(result.scalars().all())
+
+
+async def get_counter(db: AsyncSession, tenxa_id: int, counter_id: int) -> Optional[Counter]:
+    result = await db.execute(
+        select(Counter).where(Counter.tenxa_id == tenxa_id, Counter.id == counter_id)
+    )
+    return result.scalars().first()
+
+
+async def get_counter_seats(db: AsyncSession, tenxa_id: int, counter_id: int) -> List[Seat]:
+    result = await db.execute(
+        select(Seat).where(Seat.tenxa_id == tenxa_id, Seat.counter_id == counter_id).order_by(Seat.id)
+    )
+    return list(result.scalars().all())
+
+
+async def create_ticket(db: AsyncSession, tenxa_id: int, ticket: schemas.TicketCreate) -> Ticket:
+    # Cấp số và tạo vé trong 1 câu lệnh (xem crud.ALLOCATE_TICKET_SQL)
+    now = datetime.now(vn_tz)
+    db_ticket = (await db.execute(allocate_ticket_statement(tenxa_id, ticket.counter_id, now))).scalars().one()
+    await db.commit()
+    return db_ticket
+
+
+async def _get_today_tickets(db: AsyncSession, status: str, tenxa_id: int, counter_id: Optional[int]) -> List[Ticket]:
+    start_of_day, end_of_day = get_today_range()
+
+    query = (
+        select(Ticket)
+        .where(
+            Ticket.status == status,
+            Ticket.created_at >= tz_param(start_of_day),
+            Ticket.created_at <= tz_param(end_of_day),
+        )
+        .where(Ticket.tenxa_id == tenxa_id)
+    )
+    if counter_id is not None:
+        query = query.where(Ticket.counter_id == counter_id)
+
+    result = await db.execute(query.order_by(Ticket.created_at.asc()))
+    return list(result.scalars().all())
+
+
+async def get_waiting_tickets(db: AsyncSession, tenxa_id: int, counter_id: Optional[int] = None) -> List[Ticket]:
+    return await _get_today_tickets(db, "waiting", tenxa_id, counter_id)
+
+
+async def get_called_tickets(db: AsyncSession, tenxa_id: int, counter_id: Optional[int] = None) -> List[Ticket]:
+    return await _get_today_tickets(db, "called", tenxa_id, counter_id)
+
+
+async def call_next_ticket(db: AsyncSession, tenxa_id: int, counter_id: int) -> Optional[QueueAdvance]:
+    """Vé vừa gọi + tên quầy + các vé vừa đóng (crud.LOCK_COUNTER_SQL rồi crud.ADVANCE_QUEUE_SQL, cùng transaction);
+    None nếu quầy không hoạt động hoặc không có gì thay đổi"""
+    if (await db.execute(lock_counter_statement(tenxa_id, counter_id))).first() is None:
+        await db.rollback()
+        return None
+    # Lấy giờ sau khi có khoá → called_at / finished_at theo đúng thứ tự các lượt gọi
+    rows = (await db.execute(advance_queue_statement(tenxa_id, counter_id, datetime.now(vn_tz)))).all()
+    await db.commit()
+    return queue_advance(rows)
@@ -4,12 +4,14 @@ from fastapi_utils.tasks import repeat_every
 from contextlib import asynccontextmanager
 import asyncio
 from app.api.endpoints import procedures, tickets, seats, counters, users, realtime, text_to_speech, stats, footer
-from app.database import engine, Base, SessionLocal
+from app.database import engine, Base, SessionLocal, async_engine, pool_status
 #from app.background.auto_call import check_and_call_next
-from app.models import Counter, Tenxa
-from app.utils.auto_call_loop import auto_call_loop_for_counter
+from app import crud
+from app.background.auto_call_scheduler import scheduler
+from app.background.daily_stats_job import daily_stats_loop
+from app.utils import event_bus, live_queue, tts_audio
 
-# ✅ Khởi tạo DB
+# ✅ Khởi tạo DB (index mới cho bảng đã có: chạy scripts/create_indexes.py khi triển khai)
 Base.metadata.create_all(bind=engine)
 
 # ✅ Khai báo lifespan thay cho on_event("startup")
@@ -17,16 +19,37 @@ Base.metadata.create_all(bind=engine)
 async def lifespan(app: FastAPI):
     db = SessionLocal()
     try:
-        # 🔍 Truy vấn tất cả counter_id từ database
-        counter_info = db.query(Counter.id, Counter.tenxa_id).join(Tenxa, Counter.tenxa_id == Tenxa.id).filter(Tenxa.auto_call == True).all()
+        # 🔢 Khớp bộ đếm số vé với các vé đã cấp trong ngày
+        crud.seed_ticket_sequences(db)
     finally:
         db.close()
-    tasks = [asyncio.create_task(auto_call_loop_for_counter(counter_id, tenxa_id)) for counter_id, tenxa_id in counter_info]
+
+    # 📊 Chốt số liệu thống kê các ngày đã qua vào daily_counter_stats
+    tasks = [asyncio.create_task(daily_stats_loop())]
+
+    # 🔊 Nạp sẵn các đoạn âm thanh TTS vào bộ nhớ
+    tts_audio.load_segments()
+
+    # 📡 Kênh sự kiện giữa các worker (WebSocket, reset auto-call, cache TTS)
+    await event_bus.start()
+
+    # 📋 Hàng đợi hôm nay của các xã vào bộ nhớ (sau event bus để không lỡ sự kiện từ worker khác)
+    try:
+        await live_queue.load_all()
+    except Exception as e:
+        print(f"⚠️ Chưa nạp được hàng đợi, sẽ nạp khi có request: {e}")
+
+    # 🎯 Bộ lập lịch auto-call: chỉ 1 worker giữ quyền điều khiển (advisory lock), tự nạp quầy của các xã bật auto_call
+    await scheduler.start()
 
     yield
 
+    await scheduler.stop()
+    await event_bus.stop()
+
     for task in tasks:
         task.cancel()
+    await async_engine.dispose()
 
 # ✅ Khởi tạo FastAPI với lifecycle
 app = FastAPI(lifespan=lifespan)
@@ -63,3 +86,8 @@ app.include_router(text_to_speech.router, prefix="/tts", tags=["Text_to_speech"]
 app.include_router(stats.router, prefix="/stats", tags=["Stats"])
 app.include_router(footer.router, prefix="/footers", tags=["Footer"])
 app.include_router(realtime.router)
+
+# 📊 Tình trạng pool kết nối DB của worker trả lời request (để chọn DB_POOL_SIZE / DB_MAX_OVERFLOW)
+@app.get("/health/db-pool", tags=["Health"])
+def db_pool_health():
+    return pool_status()
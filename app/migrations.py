@@ -0,0 +1,75 @@
+# app/migrations.py
+# Tạo bù index: Base.metadata.create_all() chỉ tạo bảng mới, không thêm index mới khai báo trong models
+# vào các bảng đã có. Không chạy lúc khởi động app (mỗi worker / mỗi lần deploy sẽ chờ transaction của
+# instance cũ) mà chạy 1 lần khi triển khai: python scripts/create_indexes.py
+import os
+import re
+import time
+from typing import List, Optional
+
+from sqlalchemy import Index, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateIndex
+
+from app.database import Base
+
+MIGRATION_LOCK_KEY = int(os.getenv("MIGRATION_LOCK_KEY", "7420002"))
+
+INDEX_STATE_SQL = text("""
+    SELECT i.indisvalid
+    FROM pg_class c
+    JOIN pg_index i ON i.indexrelid = c.oid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relname = :name AND n.nspname = current_schema()
+""")
+
+
+def index_state(conn: Connection, name: str) -> Optional[bool]:
+    """None: chưa có; False: có nhưng INVALID (lần tạo CONCURRENTLY trước bị lỗi giữa chừng); True: dùng được"""
+    return conn.execute(INDEX_STATE_SQL, {"name": name}).scalar()
+
+
+def create_index_sql(conn: Connection, index: Index) -> str:
+    # Thêm CONCURRENTLY vào câu lệnh đã biên dịch thay vì sửa dialect_options dùng chung của Index
+    sql = str(CreateIndex(index).compile(dialect=conn.dialect))
+    return re.sub(r"^CREATE (UNIQUE )?INDEX ", r"CREATE \1INDEX CONCURRENTLY ", sql)
+
+
+def pending_indexes(conn: Connection) -> List[tuple]:
+    """[(index, trạng thái)] các index khai báo trong models mà DB chưa có hoặc đang INVALID"""
+    pending = []
+    for table in Base.metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            state = index_state(conn, index.name)
+            if state is not True:
+                pending.append((index, state))
+    return pending
+
+
+def create_missing_indexes(engine: Engine, dry_run: bool = False) -> int:
+    """Tạo các index còn thiếu, dựng lại index INVALID; trả về số index tạo lỗi"""
+    # CREATE / DROP INDEX CONCURRENTLY không chạy được trong transaction → dùng autocommit
+    autocommit_engine = engine.execution_options(isolation_level="AUTOCOMMIT")
+    failures = 0
+    with autocommit_engine.connect() as conn:
+        # 2 tiến trình triển khai cùng lúc → tiến trình sau chờ, rồi thấy các index đã có
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        try:
+            for index, state in pending_indexes(conn):
+                if dry_run:
+                    print(f"🔍 {index.name}: {'INVALID' if state is False else 'chưa có'}")
+                    continue
+                started = time.perf_counter()
+                try:
+                    if state is False:
+                        print(f"♻️ Index {index.name} INVALID → xoá và tạo lại")
+                        conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+                    # Bảng vé lớn → tạo index không khoá ghi (kiosk vẫn lấy số được)
+                    conn.execute(text(create_index_sql(conn, index)))
+                    print(f"✅ Đã tạo index {index.name} ({time.perf_counter() - started:.1f}s)")
+                except Exception as e:
+                    failures += 1
+                    print(f"❌ Không tạo được index {index.name}: {e}")
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+    return failures
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, UniqueConstraint, DateTime, func, Boolean, Text, Enum
+from sqlalchemy import Column, Integer, String, ForeignKey, UniqueConstraint, DateTime, func, Boolean, Text, Enum, Date, Index, text, Float
 from sqlalchemy.orm import relationship
 from app.database import Base
 from sqlalchemy import Enum as PgEnum
@@ -41,6 +41,52 @@ class Ticket(Base):
 
     counter = relationship("Counter", back_populates="tickets")
     tenxa = relationship("Tenxa")
+
+    __table_args__ = (
+        # Danh sách vé trong ngày, thống kê theo khoảng thời gian
+        Index("ix_tickets_tenxa_created", "tenxa_id", "created_at"),
+        # Hàng đợi: vé đang chờ của từng quầy theo thứ tự lấy số
+        Index(
+            "ix_tickets_waiting_queue", "tenxa_id", "counter_id", "created_at",
+            postgresql_where=text("status = 'waiting'")
+        ),
+        # Vé đang được gọi tại từng quầy
+        Index(
+            "ix_tickets_called_queue", "tenxa_id", "counter_id", "called_at",
+            postgresql_where=text("status = 'called'")
+        ),
+    )
+
+class TicketSequence(Base):
+    __tablename__ = "ticket_sequences"
+
+    # Bộ đếm số vé theo (xã, ngày làm việc) → cấp số bằng 1 câu UPDATE ... RETURNING
+    tenxa_id = Column(Integer, ForeignKey("tenxa.id"), primary_key=True)
+    business_day = Column(Date, primary_key=True)
+    last_number = Column(Integer, nullable=False, default=0)
+
+class DailyCounterStats(Base):
+    __tablename__ = "daily_counter_stats"
+
+    # Số liệu thống kê đã chốt theo (xã, quầy, ngày tạo vé giờ VN) - xem app/utils/daily_stats.py
+    tenxa_id = Column(Integer, ForeignKey("tenxa.id"), primary_key=True)
+    counter_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    total_tickets = Column(Integer, nullable=False, default=0)
+    attended_tickets = Column(Integer, nullable=False, default=0)  # có called_at + finished_at
+    called_tickets = Column(Integer, nullable=False, default=0)    # có created_at + called_at
+    wait_seconds = Column(Float, nullable=False, default=0)        # tổng (called_at - created_at)
+    handling_seconds = Column(Float, nullable=False, default=0)    # tổng (finished_at - called_at)
+    absent_minutes = Column(Float, nullable=False, default=0)
+    first_checkin = Column(DateTime, nullable=True)
+
+class DailyStatsDay(Base):
+    __tablename__ = "daily_stats_days"
+
+    # Những ngày đã chốt số liệu (tính lại từ dữ liệu gốc) → API thống kê đọc từ daily_counter_stats
+    day = Column(Date, primary_key=True)
+    closed_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class Counter(Base):
     __tablename__ = "counters"
 
@@ -57,6 +103,8 @@ class Counter(Base):
     users = relationship("User", back_populates="counter")
     tenxa = relationship("Tenxa")
 
+    __table_args__ = (Index("ix_counters_tenxa_counter", "tenxa_id", "id"),)
+
 class CounterField(Base):
     __tablename__ = "counter_field"
 
@@ -87,6 +135,11 @@ class SeatLog(Base):
 
     seat = relationship("Seat", back_populates="logs")
     tenxa = relationship("Tenxa")
+
+    __table_args__ = (
+        Index("ix_seat_logs_tenxa_timestamp", "tenxa_id", "timestamp"),
+        Index("ix_seat_logs_seat_timestamp", "seat_id", "timestamp"),
+    )
 class Seat(Base):
     __tablename__ = "seats"
 
@@ -102,6 +155,8 @@ class Seat(Base):
     logs = relationship("SeatLog", back_populates="seat")
     tenxa = relationship("Tenxa")
 
+    __table_args__ = (Index("ix_seats_tenxa_counter", "tenxa_id", "counter_id"),)
+
 class CounterPauseLog(Base):
     __tablename__ = "counter_pause_logs"
 
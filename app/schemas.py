@@ -25,6 +25,12 @@ class ProcedureSearchResponse(BaseModel):
     name: str
     field_id: int
     counters: List[Counter]
+    score: Optional[float] = None  # độ khớp với chuỗi tìm kiếm (0-100)
+
+class TypeaheadResponse(BaseModel):
+    query: str
+    superseded: bool = False  # phiên đã gõ thêm phím → bỏ qua kết quả này
+    results: List[ProcedureSearchResponse] = []
 
 class TicketCreate(BaseModel):
     counter_id: int
@@ -65,6 +71,21 @@ class Seat(SeatBase):
     class Config:
         orm_mode = True
 
+class SeatReading(BaseModel):
+    seat_id: int
+    status: bool
+    timestamp: Optional[datetime] = None  # thời điểm cảm biến đọc; không có → lúc server nhận
+
+class SeatReadingBatch(BaseModel):
+    readings: List[SeatReading]
+
+class SeatBatchResult(BaseModel):
+    received: int
+    applied: int  # số lần đổi trạng thái được ghi vào seat_logs
+    seats_updated: int
+    unknown_seat_ids: List[int] = []
+    stale: int = 0  # số lần đọc không mới hơn trạng thái hiện tại của ghế, bị bỏ qua
+
 class SeatPublic(BaseModel):
     id: int
     status: bool
@@ -1,33 +1,76 @@
+# app/utils/auto_call_loop.py
+# Sổ đăng ký tín hiệu điều khiển auto-call, khoá theo (tenxa_id, counter_id) — counter_id chỉ duy nhất trong 1 xã.
+# Ghế đổi trạng thái / gọi số thủ công / quầy mở lại → registry.signal(); các tín hiệu dồn dập của cùng 1 quầy
+# (cảm biến nhấp nháy, lô /seats/batch) trong AUTO_CALL_SIGNAL_COALESCE_SECONDS được gộp thành 1 sự kiện trên
+# event bus → bộ lập lịch (worker đang giữ quyền điều khiển) chỉ đánh giá lại quầy 1 lần.
 import asyncio
-from datetime import datetime
-import pytz
-from app.background.auto_call import check_and_call_next_for_counter
-
-vn_tz = pytz.timezone("Asia/Ho_Chi_Minh")
-
-# Dict lưu reset_event cho từng quầy
-reset_events: dict[int, asyncio.Event] = {}
-
-async def auto_call_loop_for_counter(counter_id: int, tenxa_id: int):
-    #event = reset_events.setdefault(counter_id, tenxa_id, asyncio.Event())
-    event = reset_events.setdefault((counter_id, tenxa_id), asyncio.Event())
-
-    while True:
-        try:
-            # Chờ 60 giây hoặc bị reset
-            await asyncio.wait_for(event.wait(), timeout=60)
-            event.clear()
-
-            # Nếu là reset thủ công → không làm gì, chỉ reset thời gian
-            continue  # bỏ qua gọi check lần này
-
-        except asyncio.TimeoutError:
-            # Timeout bình thường sau 60s → mới gọi check
-            try:
-                print(f"⏱️ [Quầy {counter_id}] xã {tenxa_id} Auto-call tick lúc {datetime.now(vn_tz).strftime('%Y-%m-%d %H:%M:%S')}")
-                await check_and_call_next_for_counter(counter_id, tenxa_id)
-            except Exception as e:
-                print(f"[auto_call_loop {counter_id}] Lỗi khi gọi: {e}")
-
-        except Exception as e:
-            print(f"[auto_call_loop {counter_id}] Lỗi khác: {e}")
+import os
+from typing import Dict, List, Set, Tuple
+
+from app.background.auto_call_scheduler import scheduler
+from app.utils import event_bus
+
+AUTO_CALL_SIGNAL_COALESCE_SECONDS = float(os.getenv("AUTO_CALL_SIGNAL_COALESCE_SECONDS", "0.5"))
+
+Key = Tuple[int, int]  # (tenxa_id, counter_id)
+
+
+class AutoCallRegistry:
+    def __init__(self):
+        self.pending: Dict[Key, bool] = {}  # quầy đang chờ gửi tín hiệu -> immediate
+        self.received = 0    # số tín hiệu nhận từ endpoint
+        self.published = 0   # số sự kiện thực sự gửi lên event bus sau khi gộp
+        self.tasks: Set[asyncio.Task] = set()  # task gửi đang chờ (event loop chỉ giữ tham chiếu yếu tới task)
+
+    async def signal(self, tenxa_id: int, counter_id: int, immediate: bool = False):
+        """Báo quầy cần đánh giá lại: immediate=False → chờ lại từ đầu chu kỳ, True → kiểm tra ngay.
+
+        Không chờ gửi: tín hiệu được gộp rồi gửi sau AUTO_CALL_SIGNAL_COALESCE_SECONDS.
+        """
+        key = (tenxa_id, counter_id)
+        self.received += 1
+        if key in self.pending:
+            # Đã có tín hiệu chờ gửi: chỉ cần nhớ có yêu cầu kiểm tra ngay (bộ lập lịch tự kiểm tra lại ghế)
+            self.pending[key] = self.pending[key] or immediate
+            return
+        self.pending[key] = immediate
+        task = asyncio.create_task(self._flush(key))
+        self.tasks.add(task)
+        task.add_done_callback(self._flushed)
+
+    def _flushed(self, task: asyncio.Task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"❌ Lỗi gửi tín hiệu auto-call: {task.exception()!r}")
+
+    async def _flush(self, key: Key):
+        await asyncio.sleep(AUTO_CALL_SIGNAL_COALESCE_SECONDS)
+        immediate = self.pending.pop(key, False)
+        self.published += 1
+        await event_bus.publish(
+            event_bus.CHANNEL_AUTO_CALL_RESET,
+            {"tenxa_id": key[0], "counter_id": key[1], "immediate": immediate}
+        )
+
+    def controlled(self, tenxa_id: int = None) -> List[dict]:
+        """Các quầy đang được tự gọi số (chỉ worker giữ quyền điều khiển có danh sách)"""
+        return scheduler.controlled(tenxa_id)
+
+    def status(self, tenxa_id: int = None) -> dict:
+        return {
+            "leader": scheduler.is_leader,
+            "worker_pid": os.getpid(),
+            "signals_received": self.received,
+            "signals_published": self.published,
+            "counters": self.controlled(tenxa_id),
+        }
+
+
+registry = AutoCallRegistry()
+
+
+async def _on_reset(payload: dict):
+    # Chỉ worker đang giữ quyền điều khiển có lịch của quầy; các worker khác bỏ qua
+    scheduler.reset(payload["tenxa_id"], payload["counter_id"], payload.get("immediate", False))
+
+event_bus.subscribe(event_bus.CHANNEL_AUTO_CALL_RESET, _on_reset)
@@ -0,0 +1,318 @@
+# app/utils/daily_stats.py
+# Bảng tổng hợp daily_counter_stats (xã, quầy, ngày) cho API thống kê:
+#  - chốt ngày (close_day): tính từ dữ liệu gốc + số phút vắng mặt, giờ vào làm từ seat_logs; đường tạo / gọi vé
+#    không ghi gì thêm vào bảng tổng hợp (ngày chưa chốt đã được tính trực tiếp khi đọc);
+#    mỗi worker đều chạy vòng chốt → advisory lock theo ngày để chỉ 1 tiến trình chốt 1 ngày tại 1 thời điểm
+#  - collect_counter_stats: ngày đã chốt đọc từ bảng tổng hợp, ngày chưa chốt (hôm nay) tính trực tiếp
+import os
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import pytz
+from sqlalchemy import Float, and_, cast, func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.models import DailyCounterStats, DailyStatsDay, Seat, SeatLog, Ticket
+
+vn_tz = pytz.timezone("Asia/Ho_Chi_Minh")
+
+DAILY_STATS_LOCK_KEY = int(os.getenv("DAILY_STATS_LOCK_KEY", "7420003"))
+
+WORK_START = time(7, 30)
+WORK_END = time(17, 30)
+
+TICKET_FIELDS = ("total_tickets", "attended_tickets", "called_tickets", "wait_seconds", "handling_seconds")
+
+SERVED = and_(Ticket.called_at.isnot(None), Ticket.finished_at.isnot(None))
+CALLED = and_(Ticket.created_at.isnot(None), Ticket.called_at.isnot(None))
+WAIT_SECONDS = func.extract("epoch", Ticket.called_at - Ticket.created_at)
+HANDLING_SECONDS = func.extract("epoch", Ticket.finished_at - Ticket.called_at)
+
+
+def get_datetime_range(start: date, end: date):
+    """Đổi khoảng ngày [start, end] thành khoảng thời gian nửa mở [start 00:00, end+1 00:00).
+
+    So sánh trực tiếp cột thời gian với mốc này (không bọc func.date) để Postgres dùng được index.
+    Mốc không kèm múi giờ, như các cột timestamp: cùng kết quả với func.date(col) BETWEEN start AND end
+    dù TimeZone của phiên là gì (mốc có múi giờ sẽ bị Postgres đổi theo TimeZone của phiên).
+    """
+    return datetime.combine(start, time.min), datetime.combine(end + timedelta(days=1), time.min)
+
+
+def empty_stats(counter_id: int) -> dict:
+    return {
+        "counter_id": counter_id,
+        "total_tickets": 0,
+        "attended_tickets": 0,
+        "called_tickets": 0,
+        "wait_seconds": 0.0,
+        "handling_seconds": 0.0,
+        "absent_minutes": 0.0,
+        "first_checkin": None,
+    }
+
+
+# ==== Tính trực tiếp từ dữ liệu gốc ====
+
+def ticket_totals(db: Session, tenxa_id: Optional[int], start: datetime, end: datetime):
+    """1 lượt GROUP BY trên tickets trong [start, end): đếm / tổng thời gian có điều kiện theo quầy"""
+    keys = [Ticket.tenxa_id, Ticket.counter_id]
+    query = (
+        db.query(
+            *keys,
+            func.count().label("total_tickets"),
+            func.count().filter(SERVED).label("attended_tickets"),
+            func.count().filter(CALLED).label("called_tickets"),
+            cast(func.coalesce(func.sum(WAIT_SECONDS).filter(CALLED), 0), Float).label("wait_seconds"),
+            cast(func.coalesce(func.sum(HANDLING_SECONDS).filter(SERVED), 0), Float).label("handling_seconds"),
+        )
+        .filter(Ticket.created_at >= start, Ticket.created_at < end)
+    )
+    if tenxa_id is not None:
+        query = query.filter(Ticket.tenxa_id == tenxa_id)
+    return query.group_by(*keys).all()
+
+
+# Khoảng vắng mặt = từ log "rời ghế" tới log "có mặt" kế tiếp của cùng ghế (LAG theo thời gian),
+# cắt theo giờ làm việc 07:30 - 17:30 của từng ngày mà khoảng đó đi qua
+SEAT_METRICS_SQL = text("""
+    WITH logs AS (
+        SELECT s.counter_id, l.timestamp, l.new_status,
+               LAG(l.new_status) OVER w AS prev_status,
+               LAG(l.timestamp) OVER w AS prev_time
+        FROM seat_logs l
+        JOIN seats s ON s.id = l.seat_id
+        WHERE l.tenxa_id = :tenxa_id
+          AND l.timestamp >= :start AND l.timestamp < :end
+          AND l.new_status IS NOT NULL
+        WINDOW w AS (PARTITION BY l.seat_id ORDER BY l.timestamp, l.id)
+    )
+    SELECT logs.counter_id,
+           COALESCE(SUM(GREATEST(0, EXTRACT(EPOCH FROM
+               LEAST(logs.timestamp, d.day + :work_end) - GREATEST(logs.prev_time, d.day + :work_start)
+           ))) FILTER (WHERE d.day IS NOT NULL), 0) / 60 AS absent_minutes,
+           MIN(logs.timestamp) FILTER (WHERE logs.new_status AND logs.timestamp >= :checkin_from) AS first_checkin
+    FROM logs
+    LEFT JOIN LATERAL (
+        SELECT generate_series(logs.prev_time::date, logs.timestamp::date, interval '1 day')::date AS day
+        WHERE logs.prev_status = false AND logs.new_status = true
+    ) d ON true
+    GROUP BY logs.counter_id
+""")
+
+
+def afk_seconds(afk_start: datetime, afk_end: datetime) -> float:
+    # Chỉ tính phần vắng mặt nằm trong giờ làm việc 07:30 - 17:30 của từng ngày (giờ VN)
+    if afk_start.tzinfo is not None:
+        afk_start = afk_start.astimezone(vn_tz).replace(tzinfo=None)
+    if afk_end.tzinfo is not None:
+        afk_end = afk_end.astimezone(vn_tz).replace(tzinfo=None)
+
+    total = 0.0
+    day = afk_start.date()
+    while day <= afk_end.date():
+        effective_start = max(afk_start, datetime.combine(day, WORK_START))
+        effective_end = min(afk_end, datetime.combine(day, WORK_END))
+        if effective_start < effective_end:
+            total += (effective_end - effective_start).total_seconds()
+        day += timedelta(days=1)
+    return total
+
+
+def seat_metrics(db: Session, tenxa_id: int, start: datetime, end: datetime, checkin_from: datetime):
+    """Phút vắng mặt theo quầy trong [start, end) + giờ có mặt đầu tiên từ checkin_from"""
+    if db.get_bind().dialect.name != "postgresql":
+        return _seat_metrics_python(db, tenxa_id, start, end, checkin_from)
+
+    rows = db.execute(SEAT_METRICS_SQL, {
+        "tenxa_id": tenxa_id,
+        "start": start,
+        "end": end,
+        "checkin_from": checkin_from,
+        "work_start": WORK_START,
+        "work_end": WORK_END,
+    })
+    afk_minutes = defaultdict(float)
+    first_checkin = {}
+    for counter_id, minutes, checkin in rows:
+        if minutes:
+            afk_minutes[counter_id] = float(minutes)
+        if checkin is not None:
+            first_checkin[counter_id] = checkin
+    return afk_minutes, first_checkin
+
+
+def _seat_metrics_python(db: Session, tenxa_id: int, start: datetime, end: datetime, checkin_from: datetime):
+    # Bản dự phòng cho DB không phải Postgres (vd. SQLite khi thử nghiệm): duyệt log theo luồng
+    afk_minutes = defaultdict(float)
+    first_checkin = {}
+
+    rows = (
+        db.query(Seat.counter_id, SeatLog.seat_id, SeatLog.new_status, SeatLog.timestamp)
+        .join(Seat, SeatLog.seat_id == Seat.id)
+        .filter(SeatLog.tenxa_id == tenxa_id)
+        .filter(
+            SeatLog.timestamp >= start,
+            SeatLog.timestamp < end,
+            SeatLog.new_status.in_([True, False])  # 0: vắng mặt, 1: có mặt
+        )
+        .order_by(SeatLog.seat_id, SeatLog.timestamp, SeatLog.id)
+        .yield_per(1000)
+    )
+
+    prev_seat = prev_status = prev_time = None
+    for counter_id, seat_id, status, timestamp in rows:
+        if seat_id != prev_seat:
+            prev_seat, prev_status, prev_time = seat_id, None, None
+
+        if prev_status is False and status is True:
+            seconds = afk_seconds(prev_time, timestamp)
+            if seconds:
+                afk_minutes[counter_id] += seconds / 60  # convert to minutes
+
+        if status is True and timestamp >= checkin_from:
+            if counter_id not in first_checkin or timestamp < first_checkin[counter_id]:
+                first_checkin[counter_id] = timestamp
+
+        prev_status = status
+        prev_time = timestamp
+
+    return afk_minutes, first_checkin
+
+
+# ==== Chốt ngày ====
+
+def close_day(db: Session, day: date, skip_closed: bool = False) -> Optional[int]:
+    """Tính lại số liệu ngày `day` của mọi xã từ dữ liệu gốc, ghi đè bảng tổng hợp và đánh dấu đã chốt.
+    None nếu tiến trình khác đang chốt ngày này, hoặc (skip_closed) ngày đã được chốt"""
+    # Khoá theo ngày, tự nhả khi commit / rollback
+    locked = db.execute(
+        text("SELECT pg_try_advisory_xact_lock(:key, :day)"),
+        {"key": DAILY_STATS_LOCK_KEY, "day": day.toordinal()},
+    ).scalar()
+    if not locked or (skip_closed and db.query(DailyStatsDay.day).filter(DailyStatsDay.day == day).first()):
+        db.rollback()
+        return None
+
+    start, end = get_datetime_range(day, day)
+    rows = {}
+
+    for tenxa_id, counter_id, *values in ticket_totals(db, None, start, end):
+        item = empty_stats(counter_id)
+        item.update(zip(TICKET_FIELDS, values))
+        rows[(tenxa_id, counter_id)] = item
+
+    tenxa_ids = [t for (t,) in db.query(SeatLog.tenxa_id).filter(SeatLog.timestamp >= start, SeatLog.timestamp < end).distinct()]
+    for tenxa_id in tenxa_ids:
+        afk_minutes, first_checkin = seat_metrics(db, tenxa_id, start, end, start)
+        for counter_id in set(afk_minutes) | set(first_checkin):
+            item = rows.setdefault((tenxa_id, counter_id), empty_stats(counter_id))
+            item["absent_minutes"] = afk_minutes.get(counter_id, 0.0)
+            item["first_checkin"] = first_checkin.get(counter_id)
+
+    db.query(DailyCounterStats).filter(DailyCounterStats.day == day).delete(synchronize_session=False)
+    for (tenxa_id, _), item in rows.items():
+        db.add(DailyCounterStats(tenxa_id=tenxa_id, day=day, **item))
+    db.execute(insert(DailyStatsDay).values(day=day).on_conflict_do_update(
+        index_elements=["day"], set_={"closed_at": func.now()}
+    ))
+    db.commit()
+    return len(rows)
+
+
+def close_pending_days(db: Session, lookback_days: int = 7) -> List[date]:
+    """Chốt các ngày trước hôm nay (trong `lookback_days` ngày gần nhất) chưa được chốt"""
+    today = datetime.now(vn_tz).date()
+    days = [today - timedelta(days=n) for n in range(lookback_days, 0, -1)]
+    closed = {d for (d,) in db.query(DailyStatsDay.day).filter(DailyStatsDay.day.in_(days))}
+    pending = [d for d in days if d not in closed]
+    closed_now = []
+    for day in pending:
+        # Worker khác vừa chốt / đang chốt ngày này → bỏ qua
+        count = close_day(db, day, skip_closed=True)
+        if count is not None:
+            closed_now.append(day)
+            print(f"📊 Đã chốt thống kê ngày {day} ({count} dòng)")
+    return closed_now
+
+
+# ==== Đọc cho API thống kê ====
+
+def _open_spans(days: List[date]) -> List[Tuple[date, date]]:
+    # Gom các ngày chưa chốt liền nhau thành khoảng để tính trực tiếp 1 lần
+    spans = []
+    for day in days:
+        if spans and spans[-1][1] + timedelta(days=1) == day:
+            spans[-1] = (spans[-1][0], day)
+        else:
+            spans.append((day, day))
+    return spans
+
+
+def collect_counter_stats(
+    db: Session,
+    tenxa_id: int,
+    start_date: date,
+    end_date: date,
+    with_seats: bool = True,
+) -> Dict[int, dict]:
+    """Số liệu theo quầy trong [start_date, end_date]; first_checkin là giờ có mặt đầu tiên của end_date"""
+    today = datetime.now(vn_tz).date()
+    result: Dict[int, dict] = {}
+
+    def item(counter_id):
+        return result.setdefault(counter_id, empty_stats(counter_id))
+
+    closed = {
+        d for (d,) in db.query(DailyStatsDay.day).filter(
+            DailyStatsDay.day >= start_date,
+            DailyStatsDay.day <= min(end_date, today - timedelta(days=1)),
+        )
+    }
+
+    # 1️⃣ Ngày đã chốt: cộng từ bảng tổng hợp
+    if closed:
+        rollup = (
+            db.query(
+                DailyCounterStats.counter_id,
+                *[func.sum(getattr(DailyCounterStats, name)) for name in TICKET_FIELDS],
+                func.sum(DailyCounterStats.absent_minutes),
+            )
+            .filter(DailyCounterStats.tenxa_id == tenxa_id, DailyCounterStats.day.in_(closed))
+            .group_by(DailyCounterStats.counter_id)
+            .all()
+        )
+        for counter_id, *values, absent in rollup:
+            item(counter_id).update(zip(TICKET_FIELDS, values))
+            if with_seats:
+                item(counter_id)["absent_minutes"] = absent or 0.0
+
+        if with_seats and end_date in closed:
+            checkins = db.query(DailyCounterStats.counter_id, DailyCounterStats.first_checkin).filter(
+                DailyCounterStats.tenxa_id == tenxa_id,
+                DailyCounterStats.day == end_date,
+                DailyCounterStats.first_checkin.isnot(None),
+            )
+            for counter_id, first_checkin in checkins:
+                item(counter_id)["first_checkin"] = first_checkin
+
+    # 2️⃣ Ngày chưa chốt (thường chỉ hôm nay): tính trực tiếp
+    open_days = [start_date + timedelta(days=n) for n in range((end_date - start_date).days + 1)]
+    checkin_from, _ = get_datetime_range(end_date, end_date)
+    for span_start, span_end in _open_spans([d for d in open_days if d not in closed]):
+        start, end = get_datetime_range(span_start, span_end)
+        for _, counter_id, *values in ticket_totals(db, tenxa_id, start, end):
+            stats = item(counter_id)
+            for name, value in zip(TICKET_FIELDS, values):
+                stats[name] += value
+
+        if with_seats:
+            afk_minutes, first_checkin = seat_metrics(db, tenxa_id, start, end, checkin_from)
+            for counter_id, minutes in afk_minutes.items():
+                item(counter_id)["absent_minutes"] += minutes
+            for counter_id, checkin in first_checkin.items():
+                item(counter_id)["first_checkin"] = checkin
+
+    return result
@@ -0,0 +1,146 @@
+# app/utils/event_bus.py
+# Kênh pub/sub giữa các worker uvicorn: sự kiện WebSocket, tín hiệu reset auto-call, huỷ cache audio TTS,
+# dựng lại chỉ mục tìm kiếm thủ tục, huỷ cache người dùng đăng nhập.
+#  - EVENT_BUS_BACKEND=memory   (mặc định) chỉ trong 1 tiến trình, đủ khi chạy 1 worker
+#  - EVENT_BUS_BACKEND=postgres  dùng LISTEN/NOTIFY của chính DB hiện có → chạy --workers N
+#    mà không cần thêm Redis / broker; mọi worker (kể cả worker gửi) nhận sự kiện qua NOTIFY
+import asyncio
+import json
+import os
+from typing import Awaitable, Callable, Dict, List, Set
+
+import asyncpg
+from sqlalchemy import text
+
+from app.database import async_engine, asyncpg_dsn
+
+CHANNEL_WS = "ws"                          # dữ liệu gửi tới màn hình (notify_frontend)
+CHANNEL_AUTO_CALL_RESET = "auto_call_reset"  # {"tenxa_id", "counter_id"}
+CHANNEL_TTS_INVALIDATE = "tts_invalidate"    # {"tenxa_id", "counter_id"}
+CHANNEL_PROCEDURE_INDEX_INVALIDATE = "procedure_index_invalidate"  # {"tenxa_id"}
+CHANNEL_USER_INVALIDATE = "user_invalidate"    # {"user_id"} (None → mọi người dùng)
+
+EVENT_BUS_BACKEND = os.getenv("EVENT_BUS_BACKEND", "memory")
+PG_CHANNEL_PREFIX = os.getenv("EVENT_BUS_PG_PREFIX", "lstd_")
+PG_RECONNECT_SECONDS = 5
+
+Handler = Callable[[dict], Awaitable[None]]
+
+_handlers: Dict[str, List[Handler]] = {}
+_tasks: Set[asyncio.Task] = set()  # task gửi / xử lý sự kiện đang chạy (event loop chỉ giữ tham chiếu yếu tới task)
+
+
+def subscribe(channel: str, handler: Handler):
+    """Đăng ký hàm async xử lý sự kiện của kênh (gọi lúc import module)"""
+    _handlers.setdefault(channel, []).append(handler)
+
+
+def _spawn(coro):
+    # Chạy nền trên event loop hiện tại, giữ tham chiếu tới khi xong
+    task = asyncio.get_running_loop().create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_task_done)
+
+
+def _task_done(task: asyncio.Task):
+    _tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"❌ Lỗi task event bus: {task.exception()!r}")
+
+
+async def _dispatch(channel: str, payload: dict):
+    for handler in _handlers.get(channel, []):
+        try:
+            await handler(payload)
+        except Exception as e:
+            print(f"❌ Lỗi xử lý sự kiện {channel}: {e}")
+
+
+class InProcessBackend:
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel: str, payload: dict):
+        await _dispatch(channel, payload)
+
+
+class PostgresBackend:
+    def __init__(self):
+        self.conn = None
+        self.task = None
+
+    async def start(self):
+        self.task = asyncio.create_task(self._listen_forever())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+        if self.conn and not self.conn.is_closed():
+            await self.conn.close()
+
+    async def publish(self, channel: str, payload: dict):
+        # NOTIFY gửi khi transaction commit; payload tối đa ~8KB (các sự kiện ở đây đều rất nhỏ)
+        async with async_engine.begin() as conn:
+            await conn.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": PG_CHANNEL_PREFIX + channel, "payload": json.dumps(payload)}
+            )
+
+    def _on_notify(self, connection, pid, pg_channel, payload):
+        channel = pg_channel[len(PG_CHANNEL_PREFIX):]
+        _spawn(_dispatch(channel, json.loads(payload)))
+
+    async def _listen_forever(self):
+        # 1 kết nối riêng cho LISTEN; mất kết nối (restart DB, mạng) → kết nối lại
+        while True:
+            try:
+                self.conn = await asyncpg.connect(asyncpg_dsn())
+                for channel in _handlers:
+                    await self.conn.add_listener(PG_CHANNEL_PREFIX + channel, self._on_notify)
+                print(f"📡 Event bus Postgres đang nghe {len(_handlers)} kênh")
+                while not self.conn.is_closed():
+                    await asyncio.sleep(PG_RECONNECT_SECONDS)
+                print("⚠️ Event bus Postgres mất kết nối, đang kết nối lại")
+            except Exception as e:
+                print(f"⚠️ Event bus Postgres lỗi: {e}")
+            await asyncio.sleep(PG_RECONNECT_SECONDS)
+
+
+backend = PostgresBackend() if EVENT_BUS_BACKEND == "postgres" else InProcessBackend()
+
+
+_loop = None  # event loop của worker, để code đồng bộ (threadpool, hook SQLAlchemy) gửi sự kiện
+
+
+async def publish(channel: str, payload: dict):
+    try:
+        await backend.publish(channel, payload)
+    except Exception as e:
+        print(f"❌ Không gửi được sự kiện {channel}: {e}")
+
+
+def publish_nowait(channel: str, payload: dict):
+    """Gửi sự kiện từ code đồng bộ, không chờ gửi xong (chưa start() → bỏ qua)"""
+    if _loop is None or _loop.is_closed():
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is _loop:
+        _spawn(publish(channel, payload))
+    else:
+        _loop.call_soon_threadsafe(_spawn, publish(channel, payload))
+
+
+async def start():
+    global _loop
+    _loop = asyncio.get_running_loop()
+    await backend.start()
+
+
+async def stop():
+    await backend.stop()
@@ -0,0 +1,191 @@
+# app/utils/live_queue.py
+# Hàng đợi hôm nay của từng xã giữ trong bộ nhớ: vé đang chờ và vé đang gọi theo từng quầy.
+# /tickets/waiting, /tickets/called và snapshot WebSocket đọc từ đây thay vì truy vấn Postgres mỗi lần.
+#  - nạp từ DB lúc khởi động (load_all) hoặc lần đọc đầu tiên của xã
+#  - cập nhật ngay trong các đường ghi vé (tạo vé, gọi số tay / auto-call, đổi trạng thái) của worker đó,
+#    và ở các worker khác qua sự kiện new_ticket / ticket_called / ticket_status trên kênh CHANNEL_WS
+#  - mỗi vé chỉ nhận bản mới hơn (theo finished_at, called_at) → nhận 1 thay đổi 2 lần hay sai thứ tự đều không sao
+#  - nạp lại từ DB khi: ghi vé lỗi (resync_on_error), sang ngày mới, hoặc quá LIVE_QUEUE_TTL giây
+#    (phòng mất sự kiện khi event bus mất kết nối)
+import asyncio
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from app import crud_async, models, schemas
+from app.crud import vn_tz
+from app.database import AsyncSessionLocal
+from app.utils import event_bus, tenxa_cache
+
+LIVE_QUEUE_TTL = float(os.getenv("LIVE_QUEUE_TTL", "300"))  # giây
+
+CREATED = "created"
+CALLED = "called"
+UPDATED = "updated"
+
+_EVENTS = {"new_ticket": CREATED, "ticket_called": CALLED, "ticket_status": UPDATED}
+
+
+def _version(ticket: schemas.Ticket):
+    return (ticket.finished_at or datetime.min, ticket.called_at or datetime.min)
+
+
+class TenantQueue:
+    def __init__(self, tenxa_id: int, slug: Optional[str]):
+        self.tenxa_id = tenxa_id
+        self.slug = slug
+        self.day = datetime.now(vn_tz).date()
+        self.expires_at = time.monotonic() + LIVE_QUEUE_TTL
+        self.tickets: Dict[int, schemas.Ticket] = {}              # mọi vé hôm nay đã biết (kể cả đã xong)
+        self.waiting: Dict[int, Dict[int, schemas.Ticket]] = {}   # counter_id -> ticket_id -> vé
+        self.called: Dict[int, Dict[int, schemas.Ticket]] = {}
+
+    def _bucket(self, status: str) -> Optional[Dict[int, Dict[int, schemas.Ticket]]]:
+        return {"waiting": self.waiting, "called": self.called}.get(status)
+
+    def upsert(self, ticket: schemas.Ticket):
+        old = self.tickets.get(ticket.id)
+        if old is not None:
+            if _version(ticket) < _version(old):
+                return  # sự kiện tới muộn của trạng thái cũ hơn
+            bucket = self._bucket(old.status)
+            if bucket is not None:
+                bucket.get(old.counter_id, {}).pop(old.id, None)
+        self.tickets[ticket.id] = ticket
+        bucket = self._bucket(ticket.status)
+        if bucket is not None:
+            bucket.setdefault(ticket.counter_id, {})[ticket.id] = ticket
+
+    def apply(self, kind: str, ticket: schemas.Ticket):
+        # Chỉ nhận trạng thái DB đã commit: vé gọi trước đó của quầy được đóng bằng sự kiện UPDATED riêng
+        # (crud.QueueAdvance.finished), không tự suy ra khi gọi vé mới
+        self.upsert(ticket)
+
+    def list(self, status: str, counter_id: Optional[int]) -> List[schemas.Ticket]:
+        bucket = self._bucket(status)
+        if counter_id is not None:
+            tickets = list(bucket.get(counter_id, {}).values())
+        else:
+            tickets = [t for by_id in bucket.values() for t in by_id.values()]
+        tickets.sort(key=lambda t: t.created_at)
+        return tickets
+
+    def is_fresh(self) -> bool:
+        return self.day == datetime.now(vn_tz).date() and self.expires_at > time.monotonic()
+
+
+_lock = threading.Lock()  # đường ghi đồng bộ (threadpool) và event loop cùng sửa
+_queues: Dict[int, TenantQueue] = {}
+_loading: Dict[int, list] = {}             # tenxa_id -> sự kiện tới trong lúc đang đọc DB, áp lại sau khi nạp
+_load_tasks: Dict[int, asyncio.Task] = {}
+
+
+async def _load(tenxa_id: int) -> TenantQueue:
+    with _lock:
+        _loading[tenxa_id] = []
+    try:
+        async with AsyncSessionLocal() as db:
+            slug = await crud_async.get_slug_from_tenxa_id(db, tenxa_id)
+            tickets = await crud_async.get_waiting_tickets(db, tenxa_id) + await crud_async.get_called_tickets(db, tenxa_id)
+        queue = TenantQueue(tenxa_id, slug)
+        with _lock:
+            for ticket in tickets:
+                queue.upsert(schemas.Ticket.from_orm(ticket))
+            for kind, ticket in _loading.get(tenxa_id, ()):
+                queue.apply(kind, ticket)
+            _queues[tenxa_id] = queue
+        return queue
+    finally:
+        with _lock:
+            _loading.pop(tenxa_id, None)
+
+
+async def get_queue(tenxa_id: int) -> TenantQueue:
+    queue = _queues.get(tenxa_id)
+    if queue is not None and queue.is_fresh():
+        return queue
+    # Nhiều request cùng lúc → chỉ nạp 1 lần
+    task = _load_tasks.get(tenxa_id)
+    if task is None:
+        task = asyncio.create_task(_load(tenxa_id))
+        _load_tasks[tenxa_id] = task
+        task.add_done_callback(lambda _: _load_tasks.pop(tenxa_id, None))
+    return await asyncio.shield(task)
+
+
+async def get_waiting(tenxa_id: int, counter_id: Optional[int] = None) -> List[schemas.Ticket]:
+    queue = await get_queue(tenxa_id)
+    with _lock:
+        return queue.list("waiting", counter_id)
+
+
+async def get_called(tenxa_id: int, counter_id: Optional[int] = None) -> List[schemas.Ticket]:
+    queue = await get_queue(tenxa_id)
+    with _lock:
+        return queue.list("called", counter_id)
+
+
+def apply(tenxa_id: int, kind: str, ticket):
+    """Ghi nhận 1 thay đổi vé (ORM Ticket hoặc schemas.Ticket) đã commit; lỗi → bỏ hàng đợi để nạp lại"""
+    try:
+        if not isinstance(ticket, schemas.Ticket):
+            ticket = schemas.Ticket.from_orm(ticket)
+        with _lock:
+            if tenxa_id in _loading:
+                _loading[tenxa_id].append((kind, ticket))
+            queue = _queues.get(tenxa_id)
+            if queue is not None:
+                queue.apply(kind, ticket)
+    except Exception as e:
+        print(f"⚠️ Không cập nhật được hàng đợi xã {tenxa_id}, sẽ nạp lại: {e}")
+        invalidate(tenxa_id)
+
+
+def invalidate(tenxa_id: Optional[int] = None):
+    """Bỏ hàng đợi của 1 xã (None → mọi xã); lần đọc kế tiếp nạp lại từ DB"""
+    with _lock:
+        if tenxa_id is None:
+            _queues.clear()
+        else:
+            _queues.pop(tenxa_id, None)
+
+
+@contextmanager
+def resync_on_error(tenxa_id: int):
+    """Bọc đường ghi vé: ghi lỗi (không rõ đã commit hay chưa) → nạp lại hàng đợi của xã từ DB"""
+    try:
+        yield
+    except HTTPException:
+        raise
+    except Exception:
+        invalidate(tenxa_id)
+        raise
+
+
+async def load_all():
+    """Nạp hàng đợi hôm nay của mọi xã lúc khởi động"""
+    async with AsyncSessionLocal() as db:
+        tenxa_ids = (await db.execute(select(models.Tenxa.id))).scalars().all()
+    for tenxa_id in tenxa_ids:
+        await get_queue(tenxa_id)
+    print(f"📋 Đã nạp hàng đợi {len(tenxa_ids)} xã vào bộ nhớ")
+
+
+async def _on_ws_event(data: dict):
+    # Sự kiện vé từ mọi worker (kể cả worker này - áp lại không đổi gì)
+    kind = _EVENTS.get(data.get("event"))
+    if kind is None or not data.get("ticket"):
+        return
+    tenxa_id = tenxa_cache.get_id(data.get("tenxa"))
+    if tenxa_id is None:
+        tenxa_id = next((q.tenxa_id for q in list(_queues.values()) if q.slug == data.get("tenxa")), None)
+    if tenxa_id is not None:
+        apply(tenxa_id, kind, schemas.Ticket.parse_obj(data["ticket"]))
+
+event_bus.subscribe(event_bus.CHANNEL_WS, _on_ws_event)
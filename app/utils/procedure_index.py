@@ -0,0 +1,159 @@
+# app/utils/procedure_index.py
+# Chỉ mục tìm kiếm thủ tục theo xã, giữ trong bộ nhớ: tên đã chuẩn hoá (chữ thường, bỏ dấu, đ → d) và
+# danh sách quầy phục vụ từng thủ tục (procedures → counter_field → counters) tính sẵn 1 lần.
+# Kiosk gõ tới đâu tìm tới đó chỉ chấm điểm trên chỉ mục (rapidfuzz.process.extract), không truy vấn DB.
+# Chỉ mục ngược theo n-gram giúp lọc trước ứng viên: từ ≥ 3 ký tự → trigram (có đệm khoảng trắng 2 đầu từ),
+# từ 1-2 ký tự → tiền tố; chỉ PROCEDURE_SEARCH_CANDIDATES thủ tục trùng nhiều n-gram nhất mới được chấm điểm
+# (trừ khi lấy mọi kết quả, limit=None).
+# Chỉ mục được dựng lại khi: hết PROCEDURE_INDEX_TTL giây, hoặc có POST /procedures/reindex (báo mọi worker
+# qua event bus) sau khi sửa thủ tục / lĩnh vực của quầy.
+import os
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+from rapidfuzz import fuzz, process
+from sqlalchemy.orm import Session
+
+from app import models
+from app.utils import event_bus
+
+PROCEDURE_INDEX_TTL = float(os.getenv("PROCEDURE_INDEX_TTL", "600"))  # giây
+PROCEDURE_SEARCH_CANDIDATES = int(os.getenv("PROCEDURE_SEARCH_CANDIDATES", "64"))
+
+
+def normalize(text: str) -> str:
+    """Chữ thường, bỏ dấu tiếng Việt → "Đăng ký khai sinh" và "dang ky khai sinh" khớp nhau"""
+    text = unicodedata.normalize("NFD", (text or "").lower().replace("đ", "d"))
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return " ".join(text.split())
+
+
+def token_grams(token: str, complete: bool = True) -> List[str]:
+    """Trigram của 1 từ có đệm: "dang" → [" da", "dan", "ang", "ng "].
+    complete=False (từ cuối đang gõ dở) → bỏ trigram cuối từ"""
+    padded = f" {token} " if complete else f" {token}"
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+class ProcedureIndex:
+    def __init__(self, tenxa_id: int, procedures: List[dict], field_counters: Dict[int, List[dict]]):
+        self.tenxa_id = tenxa_id
+        self.procedures = procedures  # {"id", "name", "field_id"} theo thứ tự id
+        self.names = [normalize(p["name"]) for p in procedures]
+        # Quầy phục vụ từng thủ tục (qua lĩnh vực), cùng thứ tự với procedures
+        self.counters = [field_counters.get(p["field_id"], []) for p in procedures]
+        self.expires_at = time.monotonic() + PROCEDURE_INDEX_TTL
+
+        # n-gram → vị trí các thủ tục chứa n-gram đó (mỗi vị trí 1 lần / n-gram)
+        grams: Dict[str, set] = {}
+        prefixes: Dict[str, set] = {}
+        for i, name in enumerate(self.names):
+            for token in name.split():
+                for gram in token_grams(token):
+                    grams.setdefault(gram, set()).add(i)
+                for size in (1, 2):
+                    prefixes.setdefault(token[:size], set()).add(i)
+        self.grams = {gram: sorted(positions) for gram, positions in grams.items()}
+        self.prefixes = {prefix: sorted(positions) for prefix, positions in prefixes.items()}
+
+    def candidates(self, query: str) -> Dict[int, str]:
+        """Các thủ tục trùng nhiều n-gram nhất với query (đã chuẩn hoá): vị trí → tên"""
+        tokens = query.split()
+        postings = []
+        for n, token in enumerate(tokens):
+            if len(token) <= 2:
+                postings.append(self.prefixes.get(token, ()))
+            else:
+                postings.extend(self.grams.get(gram, ()) for gram in set(token_grams(token, complete=n < len(tokens) - 1)))
+
+        # n-gram quá phổ biến (" da", "ng "...) gần như không phân biệt được thủ tục mà lại tốn thời gian đếm nhất
+        # → bỏ qua nếu query còn n-gram hiếm hơn
+        common = max(len(self.names) // 4, PROCEDURE_SEARCH_CANDIDATES)
+        selective = [p for p in postings if len(p) <= common]
+        hits = Counter()
+        for positions in selective or postings:
+            hits.update(positions)
+        return {i: self.names[i] for i, _ in hits.most_common(PROCEDURE_SEARCH_CANDIDATES)}
+
+    def search(self, query: str, scorer: Callable, score_cutoff: float, limit: Optional[int]) -> List[tuple]:
+        """[(vị trí, điểm)] theo điểm giảm dần; query rỗng → mọi thủ tục, điểm 100"""
+        query = normalize(query)
+        if not query:
+            positions = range(len(self.procedures) if limit is None else min(limit, len(self.procedures)))
+            return [(i, 100) for i in positions]
+        # Xã ít thủ tục → chấm điểm toàn bộ luôn; không thủ tục nào trùng n-gram (gõ sai nhiều) → cũng vậy.
+        # limit=None (lấy mọi thủ tục đủ điểm) → cũng không lọc trước, kẻo mất kết quả ngoài top ứng viên
+        choices = None
+        if limit is not None and len(self.names) > PROCEDURE_SEARCH_CANDIDATES:
+            choices = self.candidates(query)
+        choices = choices or self.names
+        matches = process.extract(
+            query, choices, scorer=scorer, processor=None, score_cutoff=score_cutoff, limit=limit
+        )
+        return [(i, score) for _, score, i in matches]
+
+
+_lock = threading.Lock()
+_indexes: Dict[int, ProcedureIndex] = {}
+
+
+def build(db: Session, tenxa_id: int) -> ProcedureIndex:
+    procedures = [
+        {"id": id, "name": name, "field_id": field_id}
+        for id, name, field_id in db.query(
+            models.Procedure.id, models.Procedure.name, models.Procedure.field_id
+        ).filter(models.Procedure.tenxa_id == tenxa_id).order_by(models.Procedure.id)
+    ]
+    counter_names = {
+        id: name for id, name in db.query(models.Counter.id, models.Counter.name).filter(models.Counter.tenxa_id == tenxa_id)
+    }
+    field_counters: Dict[int, List[dict]] = {}
+    for field_id, counter_id in db.query(
+        models.CounterField.field_id, models.CounterField.counter_id
+    ).filter(models.CounterField.tenxa_id == tenxa_id).order_by(models.CounterField.counter_id).distinct():
+        if counter_id in counter_names:
+            field_counters.setdefault(field_id, []).append({"id": counter_id, "name": counter_names[counter_id]})
+
+    index = ProcedureIndex(tenxa_id, procedures, field_counters)
+    with _lock:
+        _indexes[tenxa_id] = index
+    print(f"🔍 Dựng chỉ mục thủ tục xã {tenxa_id}: {len(procedures)} thủ tục")
+    return index
+
+
+def get_fresh(tenxa_id: int) -> Optional[ProcedureIndex]:
+    """Chỉ mục còn hạn của xã, None nếu chưa dựng / đã hết hạn / đã bị huỷ"""
+    index = _indexes.get(tenxa_id)
+    if index is None or index.expires_at < time.monotonic():
+        return None
+    return index
+
+
+def get_index(db: Session, tenxa_id: int) -> ProcedureIndex:
+    return get_fresh(tenxa_id) or build(db, tenxa_id)
+
+
+def search_with_counters(index: ProcedureIndex, search: str, limit: int = 3) -> List[dict]:
+    """Kết quả cho /procedures/search-extended và typeahead: thủ tục + điểm + các quầy phục vụ"""
+    return [
+        {**index.procedures[i], "score": score, "counters": index.counters[i]}
+        for i, score in index.search(search, fuzz.token_set_ratio, score_cutoff=10, limit=limit)
+    ]
+
+
+def invalidate(tenxa_id: Optional[int] = None):
+    """Bỏ chỉ mục của 1 xã (None → mọi xã); lần tìm kế tiếp sẽ dựng lại"""
+    with _lock:
+        if tenxa_id is None:
+            _indexes.clear()
+        else:
+            _indexes.pop(tenxa_id, None)
+
+
+async def _on_invalidate(payload: dict):
+    invalidate(payload.get("tenxa_id"))
+
+event_bus.subscribe(event_bus.CHANNEL_PROCEDURE_INDEX_INVALIDATE, _on_invalidate)
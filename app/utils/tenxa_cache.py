@@ -0,0 +1,54 @@
+# app/utils/tenxa_cache.py
+# Cache slug ↔ id của xã dùng chung cho cả process (có TTL)
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+TENXA_CACHE_TTL = float(os.getenv("TENXA_CACHE_TTL", "300"))  # giây
+
+_lock = threading.Lock()
+_by_slug: Dict[str, Tuple[int, float]] = {}   # slug -> (tenxa_id, hết hạn lúc)
+_by_id: Dict[int, Tuple[str, float]] = {}     # tenxa_id -> (slug, hết hạn lúc)
+
+
+def get_id(slug: str) -> Optional[int]:
+    entry = _by_slug.get(slug)
+    if entry is None or entry[1] < time.monotonic():
+        return None
+    return entry[0]
+
+
+def get_slug(tenxa_id: int) -> Optional[str]:
+    entry = _by_id.get(tenxa_id)
+    if entry is None or entry[1] < time.monotonic():
+        return None
+    return entry[0]
+
+
+def put(tenxa_id: int, slug: str):
+    expires = time.monotonic() + TENXA_CACHE_TTL
+    with _lock:
+        # Xã đổi slug → bỏ slug cũ
+        old = _by_id.get(tenxa_id)
+        if old is not None and old[0] != slug:
+            _by_slug.pop(old[0], None)
+        _by_slug[slug] = (tenxa_id, expires)
+        _by_id[tenxa_id] = (slug, expires)
+
+
+def invalidate(slug: Optional[str] = None, tenxa_id: Optional[int] = None):
+    """Xoá 1 xã khỏi cache (theo slug hoặc id); không truyền gì → xoá toàn bộ"""
+    with _lock:
+        if slug is None and tenxa_id is None:
+            _by_slug.clear()
+            _by_id.clear()
+            return
+        if slug is not None:
+            entry = _by_slug.pop(slug, None)
+            if entry is not None:
+                _by_id.pop(entry[0], None)
+        if tenxa_id is not None:
+            entry = _by_id.pop(tenxa_id, None)
+            if entry is not None:
+                _by_slug.pop(entry[0], None)
@@ -0,0 +1,289 @@
+# app/utils/tts_audio.py
+# Kho đoạn âm thanh TTS nạp sẵn trong bộ nhớ + ghép MP3 theo frame (không cần ffmpeg)
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app import models, crud
+
+TTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "TTS")  # app/utils/TTS
+
+PREFIX_PATH = os.path.join(TTS_FOLDER, "prefix", "prefix.mp3")
+NUMBERS_PATH = os.path.join(TTS_FOLDER, "numbers")
+COUNTER_PATH = os.path.join(TTS_FOLDER, "counter_audio")
+
+# Số thông báo đã ghép giữ trong bộ nhớ (LRU)
+ANNOUNCEMENT_CACHE_SIZE = int(os.getenv("TTS_ANNOUNCEMENT_CACHE_SIZE", "1024"))
+# Số vé đang chờ mỗi quầy được ghép sẵn khi có vé mới (0 = tắt)
+WARMUP_TICKETS = int(os.getenv("TTS_WARMUP_TICKETS", "0"))
+
+# Nguồn audio quầy: file Quay{c}_xa{t}.mp3 (POST /tts/) hoặc bản ghi TTSAudio (POST /tts/new)
+SOURCE_FILE = "file"
+SOURCE_DB = "db"
+
+# ==== MP3 FRAME PARSER ====
+
+# Bảng bitrate (kbps) theo (phiên bản MPEG, layer)
+_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_SAMPLE_RATES = {
+    1: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    25: [11025, 12000, 8000],
+}
+
+
+def _frame_length(header: bytes) -> int:
+    """Trả về độ dài frame MP3 bắt đầu bằng header 4 byte, 0 nếu không hợp lệ"""
+    if header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return 0
+
+    version_bits = (header[1] >> 3) & 0x03
+    layer_bits = (header[1] >> 1) & 0x03
+    bitrate_index = (header[2] >> 4) & 0x0F
+    sample_rate_index = (header[2] >> 2) & 0x03
+    padding = (header[2] >> 1) & 0x01
+
+    if version_bits == 0b01 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return 0
+
+    version = {0b11: 1, 0b10: 2, 0b00: 25}[version_bits]
+    layer = 4 - layer_bits
+    bitrate = _BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4
+    if layer == 3 and version != 1:
+        return 72 * bitrate // sample_rate + padding
+    return 144 * bitrate // sample_rate + padding
+
+
+def _is_info_frame(frame: bytes) -> bool:
+    # Frame Xing/Info/VBRI chỉ chứa metadata độ dài của file gốc → bỏ khi ghép
+    if len(frame) < 40:
+        return False
+    mpeg1 = (frame[1] >> 3) & 0x03 == 0b11
+    mono = (frame[3] >> 6) & 0x03 == 0b11
+    side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+    tag = frame[4 + side_info:8 + side_info]
+    return tag in (b"Xing", b"Info") or frame[36:40] == b"VBRI"
+
+
+def extract_mp3_frames(data: bytes) -> bytes:
+    """Bỏ tag ID3v2/ID3v1 và frame Xing/Info, chỉ giữ lại các frame âm thanh"""
+    pos = 0
+    end = len(data)
+
+    # ID3v2 ở đầu file (có thể có nhiều tag liên tiếp)
+    while end - pos >= 10 and data[pos:pos + 3] == b"ID3":
+        size = (data[pos + 6] << 21) | (data[pos + 7] << 14) | (data[pos + 8] << 7) | data[pos + 9]
+        footer = 10 if data[pos + 5] & 0x10 else 0
+        pos += 10 + size + footer
+
+    # ID3v1 ở cuối file
+    if end - pos >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+
+    frames = []
+    first = True
+    while end - pos >= 4:
+        length = _frame_length(data[pos:pos + 4])
+        if length == 0:
+            # Rác giữa các frame → dò tiếp byte đồng bộ
+            pos += 1
+            continue
+        frame = data[pos:min(pos + length, end)]
+        if not (first and _is_info_frame(frame)):
+            frames.append(frame)
+        first = False
+        pos += length
+
+    return b"".join(frames)
+
+
+def concat_mp3(*segments: bytes) -> bytes:
+    """Ghép nhiều đoạn MP3 (đã bỏ tag) thành 1 file MP3 liền mạch"""
+    return b"".join(segments)
+
+
+# ==== SEGMENT STORE ====
+
+_lock = threading.Lock()
+_loaded = False
+
+_prefix: Optional[bytes] = None
+_numbers: Dict[int, bytes] = {}
+_counter_files: Dict[Tuple[int, int], bytes] = {}   # (tenxa_id, counter_id) -> file Quay{c}_xa{t}.mp3
+_counter_blobs: Dict[Tuple[int, int], bytes] = {}   # (tenxa_id, counter_id) -> bản ghi TTSAudio
+
+
+def _read_frames(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return extract_mp3_frames(f.read())
+
+
+def load_segments():
+    """Nạp prefix, các số và file quầy từ đĩa vào bộ nhớ (gọi 1 lần lúc khởi động)"""
+    global _prefix, _loaded
+
+    with _lock:
+        if _loaded:
+            return
+
+        if os.path.exists(PREFIX_PATH):
+            _prefix = _read_frames(PREFIX_PATH)
+
+        if os.path.isdir(NUMBERS_PATH):
+            for name in os.listdir(NUMBERS_PATH):
+                stem, ext = os.path.splitext(name)
+                if ext.lower() == ".mp3" and stem.isdigit():
+                    _numbers[int(stem)] = _read_frames(os.path.join(NUMBERS_PATH, name))
+
+        if os.path.isdir(COUNTER_PATH):
+            for name in os.listdir(COUNTER_PATH):
+                stem, ext = os.path.splitext(name)
+                if ext.lower() != ".mp3" or not stem.startswith("Quay") or "_xa" not in stem:
+                    continue
+                counter_part, tenxa_part = stem[len("Quay"):].split("_xa", 1)
+                if counter_part.isdigit() and tenxa_part.isdigit():
+                    _counter_files[(int(tenxa_part), int(counter_part))] = _read_frames(os.path.join(COUNTER_PATH, name))
+
+        _loaded = True
+        print(f"🔊 Đã nạp {len(_numbers)} file số, {len(_counter_files)} file quầy vào bộ nhớ")
+
+
+def get_prefix() -> Optional[bytes]:
+    load_segments()
+    return _prefix
+
+
+def get_number(number: int) -> Optional[bytes]:
+    load_segments()
+    return _numbers.get(number)
+
+
+def get_counter_file(tenxa_id: int, counter_id: int) -> Optional[bytes]:
+    load_segments()
+    return _counter_files.get((tenxa_id, counter_id))
+
+
+def get_counter_blob(db: Session, tenxa_id: int, counter_id: int) -> Optional[bytes]:
+    """Lấy audio quầy lưu trong bảng TTSAudio, chỉ truy vấn DB ở lần đầu"""
+    key = (tenxa_id, counter_id)
+    blob = _counter_blobs.get(key)
+    if blob is not None:
+        return blob
+
+    audio_record = db.query(models.TTSAudio).filter(
+        models.TTSAudio.tenxa_id == tenxa_id,
+        models.TTSAudio.counter_id == counter_id
+    ).order_by(models.TTSAudio.created_at.desc()).first()
+    if not audio_record:
+        return None
+
+    blob = extract_mp3_frames(audio_record.audio_data)
+    _counter_blobs[key] = blob
+    return blob
+
+
+# ==== ANNOUNCEMENT CACHE ====
+
+# (source, tenxa_id, counter_id, ticket_number) -> (audio, etag)
+_announcements: "OrderedDict[Tuple[str, int, int, int], Tuple[bytes, str]]" = OrderedDict()
+_announcements_lock = threading.Lock()
+
+
+def make_etag(audio: bytes) -> str:
+    return '"' + hashlib.sha1(audio).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def get_announcement(source: str, tenxa_id: int, counter_id: int, number: int) -> Optional[Tuple[bytes, str]]:
+    key = (source, tenxa_id, counter_id, number)
+    with _announcements_lock:
+        entry = _announcements.get(key)
+        if entry is not None:
+            _announcements.move_to_end(key)
+        return entry
+
+
+def put_announcement(source: str, tenxa_id: int, counter_id: int, number: int, audio: bytes) -> Tuple[bytes, str]:
+    key = (source, tenxa_id, counter_id, number)
+    entry = (audio, make_etag(audio))
+    with _announcements_lock:
+        _announcements[key] = entry
+        _announcements.move_to_end(key)
+        while len(_announcements) > ANNOUNCEMENT_CACHE_SIZE:
+            _announcements.popitem(last=False)
+    return entry
+
+
+def invalidate_counter(tenxa_id: int, counter_id: int):
+    """Xoá audio quầy và mọi thông báo đã ghép của quầy (khi TTSAudio bị thay)"""
+    _counter_blobs.pop((tenxa_id, counter_id), None)
+    with _announcements_lock:
+        stale = [key for key in _announcements if key[1] == tenxa_id and key[2] == counter_id]
+        for key in stale:
+            del _announcements[key]
+
+
+def assemble_announcement(db: Session, source: str, tenxa_id: int, counter_id: int, number: int) -> Tuple[bytes, str]:
+    """Ghép (hoặc lấy từ cache) thông báo "mời số ... đến quầy ...".
+
+    Raise LookupError(tên đoạn thiếu) nếu thiếu 1 trong 3 đoạn âm thanh.
+    """
+    cached = get_announcement(source, tenxa_id, counter_id, number)
+    if cached is not None:
+        return cached
+
+    if source == SOURCE_DB:
+        counter_audio = get_counter_blob(db, tenxa_id, counter_id)
+        if counter_audio is None:
+            raise LookupError("counter audio in DB")
+    else:
+        counter_audio = get_counter_file(tenxa_id, counter_id)
+        if counter_audio is None:
+            raise LookupError(f"Quay{counter_id}_xa{tenxa_id}.mp3")
+
+    prefix = get_prefix()
+    if prefix is None:
+        raise LookupError("prefix.mp3")
+    number_audio = get_number(number)
+    if number_audio is None:
+        raise LookupError(f"{number}.mp3")
+
+    return put_announcement(source, tenxa_id, counter_id, number, concat_mp3(prefix, number_audio, counter_audio))
+
+
+def warm_up_announcements(db: Session, tenxa_id: int, limit: int) -> int:
+    """Ghép sẵn thông báo cho `limit` vé đang chờ đầu tiên của mỗi quầy"""
+    per_counter: Dict[int, int] = {}
+    warmed = 0
+    for ticket in crud.get_waiting_tickets(db, tenxa_id):
+        if per_counter.get(ticket.counter_id, 0) >= limit:
+            continue
+        per_counter[ticket.counter_id] = per_counter.get(ticket.counter_id, 0) + 1
+        for source in (SOURCE_DB, SOURCE_FILE):
+            try:
+                assemble_announcement(db, source, tenxa_id, ticket.counter_id, ticket.number)
+                warmed += 1
+            except LookupError:
+                pass
+    return warmed
@@ -0,0 +1,130 @@
+# app/utils/typeahead.py
+# Tìm thủ tục khi khách đang gõ trên kiosk (GET /procedures/typeahead, WS /procedures/ws/typeahead):
+#  - mỗi phiên (session_id của kiosk) chỉ giữ truy vấn mới nhất: truy vấn cũ chờ TYPEAHEAD_DEBOUNCE_MS,
+#    nếu đã có phím mới thì trả "superseded" mà không tìm
+#  - nhiều kiosk cùng gõ 1 chuỗi (cùng xã) trong cùng lúc → chỉ tìm 1 lần, các request dùng chung kết quả
+#  - kết quả các chuỗi vừa gõ gần đây ("d", "da", "dan"...) được cache theo xã, hết hạn sau TYPEAHEAD_CACHE_TTL
+#    hoặc khi chỉ mục thủ tục của xã được dựng lại
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.database import SessionLocal
+from app.utils import procedure_index
+
+TYPEAHEAD_DEBOUNCE_MS = float(os.getenv("TYPEAHEAD_DEBOUNCE_MS", "120"))
+TYPEAHEAD_CACHE_SIZE = int(os.getenv("TYPEAHEAD_CACHE_SIZE", "512"))  # số chuỗi / xã
+TYPEAHEAD_CACHE_TTL = float(os.getenv("TYPEAHEAD_CACHE_TTL", "60"))   # giây
+TYPEAHEAD_LIMIT = 3
+MAX_SESSIONS = 10000
+
+Key = Tuple[int, str]  # (tenxa_id, chuỗi đã chuẩn hoá)
+
+_cache: Dict[int, "OrderedDict[str, tuple]"] = {}  # tenxa_id -> chuỗi -> (chỉ mục, hết hạn, kết quả)
+_inflight: Dict[Key, asyncio.Task] = {}
+_building: Dict[int, asyncio.Task] = {}  # tenxa_id -> task dựng chỉ mục (nhiều chuỗi khác nhau chờ chung)
+_sessions: "OrderedDict[Tuple[int, str], int]" = OrderedDict()  # (tenxa_id, session_id) -> lượt gõ mới nhất
+_stats = {"requests": 0, "cache_hits": 0, "coalesced": 0, "superseded": 0, "searches": 0}
+
+
+def _build_index(tenxa_id: int) -> procedure_index.ProcedureIndex:
+    db = SessionLocal()
+    try:
+        return procedure_index.build(db, tenxa_id)
+    finally:
+        db.close()
+
+
+async def _get_index(tenxa_id: int) -> procedure_index.ProcedureIndex:
+    index = procedure_index.get_fresh(tenxa_id)
+    if index is not None:
+        return index
+    task = _building.get(tenxa_id)
+    if task is None:
+        task = asyncio.create_task(asyncio.to_thread(_build_index, tenxa_id))
+        _building[tenxa_id] = task
+        task.add_done_callback(lambda _: _building.pop(tenxa_id, None))
+    return await asyncio.shield(task)
+
+
+async def _search(tenxa_id: int, query: str) -> List[dict]:
+    index = await _get_index(tenxa_id)
+    # Chấm điểm trên chỉ mục < 1ms → chạy luôn trên event loop
+    results = procedure_index.search_with_counters(index, query, limit=TYPEAHEAD_LIMIT)
+    _stats["searches"] += 1
+
+    cache = _cache.setdefault(tenxa_id, OrderedDict())
+    cache[query] = (index, time.monotonic() + TYPEAHEAD_CACHE_TTL, results)
+    cache.move_to_end(query)
+    while len(cache) > TYPEAHEAD_CACHE_SIZE:
+        cache.popitem(last=False)
+    return results
+
+
+def _cached(tenxa_id: int, query: str) -> Optional[List[dict]]:
+    entry = _cache.get(tenxa_id, {}).get(query)
+    if entry is None:
+        return None
+    index, expires_at, results = entry
+    # Chỉ mục đã dựng lại (sửa thủ tục / hết TTL) → kết quả cũ không còn đúng
+    if expires_at < time.monotonic() or index is not procedure_index.get_fresh(tenxa_id):
+        _cache[tenxa_id].pop(query, None)
+        return None
+    return results
+
+
+async def lookup(tenxa_id: int, query: str) -> List[dict]:
+    """Kết quả tìm kiếm của 1 chuỗi: lấy từ cache, hoặc chờ chung lần tìm đang chạy, hoặc tìm mới"""
+    query = procedure_index.normalize(query)
+    results = _cached(tenxa_id, query)
+    if results is not None:
+        _stats["cache_hits"] += 1
+        return results
+
+    key = (tenxa_id, query)
+    task = _inflight.get(key)
+    if task is not None:
+        _stats["coalesced"] += 1
+    else:
+        # Task riêng: request đầu tiên bị huỷ (kiosk ngắt kết nối) không làm huỷ lần tìm của các request khác
+        task = asyncio.create_task(_search(tenxa_id, query))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+
+def _next_turn(tenxa_id: int, session_id: str) -> int:
+    key = (tenxa_id, session_id)
+    turn = _sessions.pop(key, 0) + 1
+    _sessions[key] = turn
+    while len(_sessions) > MAX_SESSIONS:
+        _sessions.popitem(last=False)
+    return turn
+
+
+def _is_latest(tenxa_id: int, session_id: str, turn: int) -> bool:
+    return _sessions.get((tenxa_id, session_id)) == turn
+
+
+async def typeahead(tenxa_id: int, query: str, session_id: Optional[str] = None) -> Optional[List[dict]]:
+    """None nếu phiên đã gõ thêm phím (truy vấn này bị thay thế), ngược lại là danh sách kết quả"""
+    _stats["requests"] += 1
+    if session_id is None:
+        return await lookup(tenxa_id, query)
+
+    turn = _next_turn(tenxa_id, session_id)
+    await asyncio.sleep(TYPEAHEAD_DEBOUNCE_MS / 1000)
+    if not _is_latest(tenxa_id, session_id, turn):
+        _stats["superseded"] += 1
+        return None
+    results = await lookup(tenxa_id, query)
+    if not _is_latest(tenxa_id, session_id, turn):
+        _stats["superseded"] += 1
+        return None
+    return results
+
+
+def stats() -> dict:
+    return {**_stats, "cached_queries": sum(len(c) for c in _cache.values()), "sessions": len(_sessions)}
@@ -0,0 +1,113 @@
+# app/utils/user_cache.py
+# Cache cho xác thực, dùng chung cho cả process:
+#  - token đã kiểm chữ ký → claims (giữ tới khi token hết hạn, tối đa TOKEN_CACHE_SIZE token)
+#  - thông tin người dùng theo id (vai trò, quầy, xã, còn hoạt động không) trong USER_CACHE_TTL giây
+# → request có token đã gặp và người dùng còn trong cache không cần giải mã JWT lẫn truy vấn bảng users.
+# Sửa / khoá / xoá người dùng qua ORM: khi session commit, cache của worker hiện tại được xoá ngay và các
+# worker khác nhận qua event bus (CHANNEL_USER_INVALIDATE). Sửa thẳng trong DB (UPDATE tay, bulk update)
+# → muộn nhất sau USER_CACHE_TTL giây.
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from app import models
+from app.utils import event_bus
+
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))      # giây
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+
+class CachedUser:
+    """Bản sao chỉ đọc của models.User (tách khỏi session) kèm slug xã để kiểm tra tenant không cần DB"""
+
+    __slots__ = ("id", "username", "full_name", "role", "is_active", "counter_id", "tenxa_id", "tenxa_slug")
+
+    def __init__(self, user: models.User, tenxa_slug: Optional[str]):
+        self.id = user.id
+        self.username = user.username
+        self.full_name = user.full_name
+        self.role = user.role
+        self.is_active = user.is_active is not False
+        self.counter_id = user.counter_id
+        self.tenxa_id = user.tenxa_id
+        self.tenxa_slug = tenxa_slug
+
+
+_lock = threading.Lock()
+_tokens: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()  # token -> (claims, hết hạn lúc theo time.time())
+_users: Dict[int, Tuple[CachedUser, float]] = {}                 # user_id -> (người dùng, hết hạn lúc)
+
+
+def get_claims(token: str) -> Optional[dict]:
+    entry = _tokens.get(token)
+    if entry is None:
+        return None
+    if entry[1] < time.time():
+        with _lock:
+            _tokens.pop(token, None)
+        return None
+    return entry[0]
+
+
+def put_claims(token: str, claims: dict):
+    with _lock:
+        _tokens[token] = (claims, float(claims.get("exp", 0)))
+        _tokens.move_to_end(token)
+        while len(_tokens) > TOKEN_CACHE_SIZE:
+            _tokens.popitem(last=False)
+
+
+def get_user(user_id: int) -> Optional[CachedUser]:
+    entry = _users.get(user_id)
+    if entry is None or entry[1] < time.monotonic():
+        return None
+    return entry[0]
+
+
+def put_user(user: CachedUser):
+    with _lock:
+        _users[user.id] = (user, time.monotonic() + USER_CACHE_TTL)
+
+
+def invalidate(user_id: Optional[int] = None):
+    """Xoá 1 người dùng khỏi cache; không truyền gì → xoá toàn bộ (claims của token vẫn giữ, chỉ nạp lại người dùng)"""
+    with _lock:
+        if user_id is None:
+            _users.clear()
+        else:
+            _users.pop(user_id, None)
+
+
+def _on_user_changed(mapper, connection, target):
+    # Ghi nhận trong session; chỉ báo các worker sau khi commit (rollback → không có gì thay đổi)
+    invalidate(target.id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_user_ids", set()).add(target.id)
+
+event.listen(models.User, "after_update", _on_user_changed)
+event.listen(models.User, "after_delete", _on_user_changed)
+
+
+def _on_commit(session):
+    for user_id in session.info.pop("changed_user_ids", ()):
+        invalidate(user_id)  # request khác có thể đã nạp lại bản cũ giữa lúc flush và commit
+        event_bus.publish_nowait(event_bus.CHANNEL_USER_INVALIDATE, {"user_id": user_id})
+
+
+def _on_rollback(session):
+    session.info.pop("changed_user_ids", None)
+
+event.listen(Session, "after_commit", _on_commit)
+event.listen(Session, "after_rollback", _on_rollback)
+
+
+async def _on_invalidate(payload: dict):
+    invalidate(payload.get("user_id"))
+
+event_bus.subscribe(event_bus.CHANNEL_USER_INVALIDATE, _on_invalidate)
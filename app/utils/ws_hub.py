@@ -0,0 +1,159 @@
+# app/utils/ws_hub.py
+# Phân phối sự kiện WebSocket theo kênh: mỗi client đăng ký theo xã (và có thể theo quầy) lúc kết nối,
+# mỗi sự kiện chỉ json.dumps 1 lần rồi đẩy vào hàng đợi riêng của từng client; task gửi riêng của client
+# mới gọi send_text → 1 màn hình chậm không làm chậm các màn hình khác, client bị đầy hàng đợi sẽ bị ngắt.
+#
+# Sự kiện của 1 xã được đánh số tăng dần "seq" (kèm "epoch" của worker) và giữ lại WS_REPLAY_SIZE
+# sự kiện gần nhất → client kết nối lại với ?since=<epoch>:<seq> nhận bù các sự kiện bị lỡ.
+import asyncio
+import json
+import os
+import uuid
+from collections import deque
+from typing import Deque, Dict, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+# Số tin nhắn tối đa chờ gửi cho 1 client và thời gian tối đa cho 1 lần gửi (giây)
+WS_CLIENT_QUEUE_SIZE = int(os.getenv("WS_CLIENT_QUEUE_SIZE", "100"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+WS_REPLAY_SIZE = int(os.getenv("WS_REPLAY_SIZE", "500"))
+
+# Đổi mỗi lần khởi động worker: seq của epoch khác không so sánh được → client phải lấy snapshot mới
+EPOCH = uuid.uuid4().hex[:12]
+
+ALL_TENXA = "*"  # client cũ không truyền ?tenxa= → nhận mọi sự kiện như trước
+
+
+class Subscriber:
+    def __init__(self, websocket: WebSocket, tenxa: Optional[str], counter_id: Optional[int]):
+        self.websocket = websocket
+        self.tenxa = tenxa or ALL_TENXA
+        self.counter_id = counter_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_CLIENT_QUEUE_SIZE)
+        self.task: Optional[asyncio.Task] = None
+        self.resumed = False  # đã nạp bù sự kiện từ replay buffer (không cần snapshot)
+
+    def start(self):
+        # Bắt đầu gửi các tin trong hàng đợi (gọi sau khi đã gửi snapshot)
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    def wants(self, counter_id: Optional[int]) -> bool:
+        # Đăng ký theo quầy → chỉ nhận sự kiện của quầy đó (sự kiện không gắn quầy thì vẫn nhận)
+        return self.counter_id is None or counter_id is None or self.counter_id == counter_id
+
+    async def run(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send_text(message), timeout=WS_SEND_TIMEOUT)
+        except Exception as e:
+            print(f"⚠️ Ngắt client WebSocket xã {self.tenxa} (gửi lỗi / quá chậm): {e!r}")
+            unsubscribe(self)
+            await _close(self.websocket)
+
+
+_channels: Dict[str, Set[Subscriber]] = {}
+_seq: Dict[str, int] = {}
+_replay: Dict[str, Deque[Tuple[int, Optional[int], str]]] = {}  # tenxa -> (seq, counter_id, message)
+_closing: Set[asyncio.Task] = set()  # task đóng client bị ngắt (event loop chỉ giữ tham chiếu yếu tới task)
+
+
+def current_seq(tenxa: str) -> int:
+    return _seq.get(tenxa, 0)
+
+
+def parse_since(since: Optional[str]) -> Optional[int]:
+    # "<epoch>:<seq>" của đúng worker này → seq; khác epoch / sai định dạng → None
+    if not since:
+        return None
+    epoch, _, seq = since.partition(":")
+    if epoch != EPOCH or not seq.isdigit():
+        return None
+    return int(seq)
+
+
+def subscribe(
+    websocket: WebSocket,
+    tenxa: Optional[str] = None,
+    counter_id: Optional[int] = None,
+    since: Optional[str] = None,
+) -> Subscriber:
+    """Đăng ký client; chưa gửi gì cho tới khi gọi subscriber.start().
+
+    Có `since` hợp lệ và còn đủ sự kiện trong replay buffer → nạp bù vào hàng đợi, subscriber.resumed = True.
+    """
+    subscriber = Subscriber(websocket, tenxa, counter_id)
+
+    last_seq = parse_since(since) if tenxa else None
+    if last_seq is not None and last_seq <= current_seq(tenxa):
+        buffered = _replay.get(tenxa, ())
+        missed = [(c, m) for seq, c, m in buffered if seq > last_seq]
+        oldest = buffered[0][0] if buffered else current_seq(tenxa) + 1
+        if oldest <= last_seq + 1 and len(missed) <= WS_CLIENT_QUEUE_SIZE:
+            for event_counter_id, message in missed:
+                if subscriber.wants(event_counter_id):
+                    subscriber.queue.put_nowait(message)
+            subscriber.resumed = True
+
+    # Không có await từ lúc đọc replay tới lúc đăng ký → không lỡ sự kiện nào ở giữa
+    _channels.setdefault(subscriber.tenxa, set()).add(subscriber)
+    return subscriber
+
+
+def unsubscribe(subscriber: Subscriber):
+    channel = _channels.get(subscriber.tenxa)
+    if channel is not None:
+        channel.discard(subscriber)
+        if not channel:
+            _channels.pop(subscriber.tenxa, None)
+    if subscriber.task is not None and subscriber.task is not asyncio.current_task():
+        subscriber.task.cancel()
+
+
+async def _close(websocket: WebSocket):
+    try:
+        await websocket.close(code=1013)  # Try again later
+    except Exception:
+        pass
+
+
+def _close_later(websocket: WebSocket):
+    # Đóng không chờ (publish là hàm đồng bộ), giữ tham chiếu tới task tới khi xong
+    task = asyncio.create_task(_close(websocket))
+    _closing.add(task)
+    task.add_done_callback(_closed)
+
+
+def _closed(task: asyncio.Task):
+    _closing.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"⚠️ Lỗi đóng client WebSocket: {task.exception()!r}")
+
+
+def publish(data: dict) -> int:
+    """Đánh số, lưu replay và đưa sự kiện vào hàng đợi của các client đăng ký; không chờ gửi"""
+    tenxa = data.get("tenxa")
+    counter_id = data.get("counter_id")
+    if tenxa:
+        _seq[tenxa] = current_seq(tenxa) + 1
+        data = {**data, "epoch": EPOCH, "seq": _seq[tenxa]}
+    message = json.dumps(data)
+    if tenxa:
+        _replay.setdefault(tenxa, deque(maxlen=WS_REPLAY_SIZE)).append((_seq[tenxa], counter_id, message))
+
+    targets = [s for s in _channels.get(tenxa, ()) if s.wants(counter_id)]
+    targets.extend(_channels.get(ALL_TENXA, ()))
+
+    delivered = 0
+    for subscriber in targets:
+        try:
+            subscriber.queue.put_nowait(message)
+            delivered += 1
+        except asyncio.QueueFull:
+            print(f"⚠️ Client WebSocket xã {subscriber.tenxa} không theo kịp ({WS_CLIENT_QUEUE_SIZE} tin chờ) → ngắt")
+            unsubscribe(subscriber)
+            _close_later(subscriber.websocket)
+    return delivered
+
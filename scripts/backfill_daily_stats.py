@@ -0,0 +1,55 @@
+# scripts/backfill_daily_stats.py
+# Tính lại bảng tổng hợp daily_counter_stats cho các ngày đã qua (dữ liệu trước khi có bảng tổng hợp,
+# hoặc sau khi sửa tay dữ liệu vé / seat_logs). Mỗi ngày được tính lại từ dữ liệu gốc và đánh dấu đã chốt.
+#
+#   python scripts/backfill_daily_stats.py                       # từ ngày có vé đầu tiên tới hôm qua
+#   python scripts/backfill_daily_stats.py --start 2025-01-01 --end 2025-01-31
+import argparse
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func  # noqa: E402
+
+from app.database import Base, SessionLocal, engine  # noqa: E402
+from app.models import SeatLog, Ticket  # noqa: E402
+from app.utils import daily_stats  # noqa: E402
+
+
+def first_day(db):
+    first = [v for v in (db.query(func.min(Ticket.created_at)).scalar(), db.query(func.min(SeatLog.timestamp)).scalar()) if v]
+    return min(first).date() if first else None
+
+
+def main(args):
+    Base.metadata.create_all(bind=engine)
+    yesterday = datetime.now(daily_stats.vn_tz).date() - timedelta(days=1)
+
+    db = SessionLocal()
+    try:
+        start = args.start or first_day(db)
+        end = min(args.end or yesterday, yesterday)  # hôm nay chưa kết thúc → không chốt
+        if start is None or start > end:
+            print("Không có ngày nào cần tính")
+            return 0
+
+        started = time.perf_counter()
+        day = start
+        while day <= end:
+            rows = daily_stats.close_day(db, day)
+            print(f"📊 {day}: {rows} dòng" if rows is not None else f"⏭️ {day}: đang được chốt ở tiến trình khác")
+            day += timedelta(days=1)
+        print(f"✅ Đã tính {(end - start).days + 1} ngày trong {time.perf_counter() - started:.1f}s")
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tính lại bảng tổng hợp thống kê theo ngày")
+    parser.add_argument("--start", type=date.fromisoformat, help="ngày bắt đầu (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, help="ngày kết thúc (mặc định: hôm qua)")
+    raise SystemExit(main(parser.parse_args()))
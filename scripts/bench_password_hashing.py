@@ -0,0 +1,73 @@
+# scripts/bench_password_hashing.py
+# Đo chi phí kiểm mật khẩu (pbkdf2_sha256) theo số vòng và số luồng của pool băm để chọn
+# PASSWORD_HASH_ROUNDS / PASSWORD_HASH_WORKERS: thời gian 1 lần kiểm, số lượt đăng nhập / giây
+# và / lõi khi nhiều cán bộ đăng nhập cùng lúc. Không cần DB.
+#
+#   python scripts/bench_password_hashing.py
+#   python scripts/bench_password_hashing.py --rounds 29000 100000 --workers 1 2 4 --logins 200
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passlib.context import CryptContext  # noqa: E402
+
+
+def make_context(rounds: int) -> CryptContext:
+    # Cùng cấu hình với app.auth.pwd_context
+    return CryptContext(
+        schemes=["pbkdf2_sha256"],
+        deprecated="auto",
+        pbkdf2_sha256__default_rounds=rounds,
+        pbkdf2_sha256__min_rounds=rounds,
+        pbkdf2_sha256__max_rounds=rounds,
+    )
+
+
+def single_verify_ms(context: CryptContext, hashed: str, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        context.verify("mat-khau-dung", hashed)
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def throughput(context: CryptContext, hashed: str, workers: int, logins: int) -> float:
+    # Như đầu giờ sáng: `logins` lượt đăng nhập dồn vào pool `workers` luồng cùng lúc
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        started = time.perf_counter()
+        list(pool.map(lambda _: context.verify_and_update("mat-khau-dung", hashed), range(logins)))
+        return logins / (time.perf_counter() - started)
+
+
+def main(args):
+    cores = os.cpu_count() or 1
+    print(f"🔍 {cores} lõi CPU, {args.logins} lượt đăng nhập mỗi lần đo")
+    for rounds in args.rounds:
+        context = make_context(rounds)
+        hashed = context.hash("mat-khau-dung")
+        latency = single_verify_ms(context, hashed, args.repeat)
+        print(f"📊 {rounds} vòng: 1 lần kiểm {latency:.1f} ms")
+        for workers in args.workers:
+            rate = throughput(context, hashed, workers, args.logins)
+            print(f"   {workers:3} luồng: {rate:8.1f} đăng nhập/giây   {rate / min(workers, cores):7.1f} / lõi")
+
+    # Kiểm tra băm lại: hash cũ với số vòng khác được verify_and_update trả về hash mới
+    old = make_context(args.rounds[0]).hash("mat-khau-dung")
+    ok, new_hash = make_context(args.rounds[0] * 2).verify_and_update("mat-khau-dung", old)
+    print(f"🔄 Đổi {args.rounds[0]} → {args.rounds[0] * 2} vòng: đúng mật khẩu={ok}, băm lại={'có' if new_hash else 'không'}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark băm / kiểm mật khẩu khi đăng nhập")
+    parser.add_argument("--rounds", type=int, nargs="+", default=[29000, 100000], help="các số vòng pbkdf2 cần đo")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="các kích thước pool băm cần đo")
+    parser.add_argument("--logins", type=int, default=100, help="số lượt đăng nhập mỗi lần đo thông lượng")
+    parser.add_argument("--repeat", type=int, default=20, help="số lần lặp khi đo 1 lần kiểm")
+    raise SystemExit(main(parser.parse_args()))
@@ -0,0 +1,87 @@
+# scripts/bench_procedure_search.py
+# Đo thời gian 1 lần tìm thủ tục trên chỉ mục trong bộ nhớ (lọc ứng viên bằng n-gram rồi mới chấm điểm)
+# so với cách cũ (chấm điểm fuzz.token_set_ratio trên toàn bộ tên gốc). Dùng tên thủ tục sinh ngẫu nhiên,
+# không cần DB.
+#
+#   python scripts/bench_procedure_search.py -n 5000 --repeat 200
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rapidfuzz import fuzz  # noqa: E402
+
+from app.utils.procedure_index import ProcedureIndex  # noqa: E402
+
+VERBS = ["Đăng ký", "Cấp", "Cấp lại", "Cấp đổi", "Điều chỉnh", "Xác nhận", "Thẩm định", "Gia hạn", "Chuyển", "Thu hồi"]
+OBJECTS = [
+    "khai sinh", "kết hôn", "khai tử", "giám hộ", "nhận cha mẹ con", "thường trú", "tạm trú", "giấy phép xây dựng",
+    "giấy chứng nhận quyền sử dụng đất", "mục đích sử dụng đất", "hộ kinh doanh", "giấy phép lái xe",
+    "chứng thực bản sao", "chứng thực chữ ký", "trợ cấp xã hội", "hộ nghèo", "bảo hiểm y tế", "người có công",
+]
+SUFFIXES = ["", "có yếu tố nước ngoài", "cho người nước ngoài", "lưu động", "trực tuyến", "lần đầu", "cho trẻ em dưới 6 tuổi"]
+QUERIES = [
+    "dang ky khai sinh", "khai sinh", "ket hon", "cap lai giay phep", "chung thuc", "quyen su dung dat",
+    "tam tru", "ho ngheo", "bao hiem", "dang k", "gia han giay phep lai xe", "xac nhan nguoi co cong",
+]
+
+
+def synthetic_procedures(n: int, seed: int):
+    rng = random.Random(seed)
+    procedures = []
+    for i in range(n):
+        name = f"{rng.choice(VERBS)} {rng.choice(OBJECTS)} {rng.choice(SUFFIXES)}".strip()
+        procedures.append({"id": i + 1, "name": f"{name} (mã {i + 1})", "field_id": i % 20})
+    return procedures
+
+
+def timed(fn, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def full_scan(procedures, query):
+    # Cách cũ: chấm điểm mọi tên gốc, sắp xếp, lấy 3
+    results = [(fuzz.token_set_ratio(query.lower(), p["name"].lower()), p) for p in procedures]
+    results = [r for r in results if r[0] >= 10]
+    results.sort(key=lambda r: r[0], reverse=True)
+    return results[:3]
+
+
+def main(args):
+    procedures = synthetic_procedures(args.n, args.seed)
+    started = time.perf_counter()
+    index = ProcedureIndex(0, procedures, {})
+    print(f"🔍 {args.n} thủ tục, dựng chỉ mục {(time.perf_counter() - started) * 1000:.0f} ms, "
+          f"{len(index.grams)} trigram, {len(index.prefixes)} tiền tố")
+
+    index_all, scan_all = [], []
+    for query in QUERIES:
+        indexed = timed(lambda: index.search(query, fuzz.token_set_ratio, score_cutoff=10, limit=3), args.repeat)
+        scanned = timed(lambda: full_scan(procedures, query), max(1, args.repeat // 20))
+        index_all.extend(indexed)
+        scan_all.extend(scanned)
+        top = index.search(query, fuzz.token_set_ratio, score_cutoff=10, limit=1)
+        best = procedures[top[0][0]]["name"] if top else "-"
+        print(f"  {query:28} chỉ mục {statistics.median(indexed):6.3f} ms   toàn bộ {statistics.median(scanned):7.2f} ms   → {best}")
+
+    index_all.sort()
+    print(f"📊 Chỉ mục: median {statistics.median(index_all):.3f} ms, p95 {index_all[int(len(index_all) * 0.95)]:.3f} ms; "
+          f"quét toàn bộ: median {statistics.median(scan_all):.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark tìm kiếm thủ tục qua chỉ mục n-gram")
+    parser.add_argument("-n", type=int, default=5000, help="số thủ tục sinh ngẫu nhiên")
+    parser.add_argument("--repeat", type=int, default=200, help="số lần lặp mỗi truy vấn")
+    parser.add_argument("--seed", type=int, default=1)
+    raise SystemExit(main(parser.parse_args()))
@@ -0,0 +1,82 @@
+# scripts/bench_ticket_allocation.py
+# Bắn hàng nghìn request POST /tickets/ đồng thời vào server đang chạy rồi kiểm tra số vé
+# có bị trùng hoặc bị nhảy cóc không. Nên chạy trên 1 xã thử nghiệm (không có kiosk thật).
+#
+#   pip install httpx
+#   python scripts/bench_ticket_allocation.py --base-url http://localhost:8000 --tenxa test --counter-id 1 -n 5000 -c 200
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def worker(client: httpx.AsyncClient, args, queue: asyncio.Queue, numbers: list, latencies: list, errors: list):
+    while True:
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        started = time.perf_counter()
+        try:
+            resp = await client.post(
+                "/tickets/",
+                params={"tenxa": args.tenxa},
+                json={"counter_id": args.counter_id},
+            )
+            latencies.append(time.perf_counter() - started)
+            if resp.status_code != 200:
+                errors.append(f"HTTP {resp.status_code}: {resp.text[:200]}")
+                continue
+            numbers.append(resp.json()["number"])
+        except httpx.HTTPError as e:
+            errors.append(repr(e))
+
+
+async def main(args):
+    queue: asyncio.Queue = asyncio.Queue()
+    for _ in range(args.requests):
+        queue.put_nowait(None)
+
+    numbers, latencies, errors = [], [], []
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            worker(client, args, queue, numbers, latencies, errors) for _ in range(args.concurrency)
+        ])
+        elapsed = time.perf_counter() - started
+
+    print(f"Requests:   {args.requests} ({args.concurrency} đồng thời)")
+    print(f"Thành công: {len(numbers)}  Lỗi: {len(errors)}")
+    print(f"Thời gian:  {elapsed:.2f}s  → {len(numbers) / elapsed:.1f} vé/giây")
+    if latencies:
+        latencies.sort()
+        pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+        print(f"Độ trễ ms:  p50={pick(0.50):.1f}  p95={pick(0.95):.1f}  p99={pick(0.99):.1f}  "
+              f"mean={statistics.mean(latencies) * 1000:.1f}")
+    for err in errors[:5]:
+        print("  ⚠️", err)
+
+    if not numbers:
+        return 1
+
+    duplicates = len(numbers) - len(set(numbers))
+    lo, hi = min(numbers), max(numbers)
+    gaps = sorted(set(range(lo, hi + 1)) - set(numbers))
+    print(f"Dải số:     {lo}..{hi}")
+    print(f"Trùng số:   {duplicates}")
+    print(f"Nhảy cóc:   {len(gaps)}" + (f" (ví dụ {gaps[:10]})" if gaps else ""))
+    return 0 if duplicates == 0 and not gaps and not errors else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stress test cấp số vé đồng thời")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--tenxa", required=True, help="slug xã dùng để test")
+    parser.add_argument("--counter-id", type=int, default=1)
+    parser.add_argument("-n", "--requests", type=int, default=2000)
+    parser.add_argument("-c", "--concurrency", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    raise SystemExit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,29 @@
+# scripts/create_indexes.py
+# Tạo các index khai báo trong app/models.py mà DB chưa có (create_all không thêm index cho bảng đã có),
+# và dựng lại index INVALID do lần tạo CONCURRENTLY trước bị lỗi. Chạy 1 lần mỗi lần triển khai
+# (render.yaml preDeployCommand), không khoá ghi trên bảng vé; chạy lại nhiều lần không sao.
+#
+#   python scripts/create_indexes.py
+#   python scripts/create_indexes.py --dry-run      # chỉ liệt kê index còn thiếu / INVALID
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import models  # noqa: E402  (nạp models vào Base.metadata)
+from app.database import engine  # noqa: E402
+from app.migrations import create_missing_indexes  # noqa: E402
+
+
+def main(args):
+    # Bảng mới (nếu có) kèm index của nó
+    models.Base.metadata.create_all(bind=engine)
+    failures = create_missing_indexes(engine, dry_run=args.dry_run)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tạo bù index còn thiếu / INVALID")
+    parser.add_argument("--dry-run", action="store_true", help="chỉ liệt kê, không tạo")
+    raise SystemExit(main(parser.parse_args()))
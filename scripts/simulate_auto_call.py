@@ -0,0 +1,178 @@
+# scripts/simulate_auto_call.py
+# Mô phỏng lại 1 ngày làm việc của 1 quầy với 2 cách tự gọi số và so sánh số vé phục vụ / thời gian quầy bỏ trống:
+#  - timer: chỉ gọi khi hết timeout_seconds kể từ lần đổi trạng thái ghế khách gần nhất (cách cũ)
+#  - event: như timer, nhưng ghế khách vừa trống mà cán bộ đang ngồi → gọi ngay (cách mới)
+# Dữ liệu vào: giờ lấy vé (tickets.created_at), thời gian phục vụ (các đoạn ghế khách có người trong seat_logs)
+# và thời gian cán bộ có mặt (seat_logs của ghế cán bộ) của quầy trong ngày; hoặc dữ liệu sinh ngẫu nhiên.
+# Mô phỏng theo từng giây, không ghi gì vào DB.
+#
+#   python scripts/simulate_auto_call.py --tenxa-id 1 --counter-id 1 --date 2025-06-02
+#   python scripts/simulate_auto_call.py --synthetic --rate 20 --timeout 60
+import argparse
+import os
+import random
+import sys
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.daily_stats import WORK_END, WORK_START, get_datetime_range  # noqa: E402
+
+DAY_START = WORK_START.hour * 3600 + WORK_START.minute * 60
+DAY_END = WORK_END.hour * 3600 + WORK_END.minute * 60
+
+
+def seconds_of_day(ts: datetime) -> int:
+    return ts.hour * 3600 + ts.minute * 60 + ts.second
+
+
+def occupied_intervals(logs, initially: bool):
+    """[(bắt đầu, kết thúc)] các đoạn ghế có người, từ danh sách (giây, trạng thái mới) đã sắp xếp"""
+    intervals, since = [], DAY_START if initially else None
+    for second, status in logs:
+        if status and since is None:
+            since = second
+        elif not status and since is not None:
+            intervals.append((since, second))
+            since = None
+    if since is not None:
+        intervals.append((since, DAY_END))
+    return intervals
+
+
+def load_trace(args):
+    from app.database import SessionLocal
+    from app.models import Counter, Seat, SeatLog, Ticket
+
+    start, end = get_datetime_range(args.date, args.date)
+    db = SessionLocal()
+    try:
+        counter = db.query(Counter).filter(Counter.tenxa_id == args.tenxa_id, Counter.id == args.counter_id).first()
+        if counter is None:
+            raise SystemExit(f"Không tìm thấy quầy {args.counter_id} của xã {args.tenxa_id}")
+        if args.timeout is None:
+            args.timeout = counter.timeout_seconds or 60
+
+        arrivals = [seconds_of_day(ts) for (ts,) in db.query(Ticket.created_at).filter(
+            Ticket.tenxa_id == args.tenxa_id, Ticket.counter_id == args.counter_id,
+            Ticket.created_at >= start, Ticket.created_at < end,
+        ).order_by(Ticket.created_at)]
+
+        def seat_trace(seat_type):
+            rows = db.query(SeatLog.timestamp, SeatLog.old_status, SeatLog.new_status).join(
+                Seat, Seat.id == SeatLog.seat_id
+            ).filter(
+                Seat.tenxa_id == args.tenxa_id, Seat.counter_id == args.counter_id, Seat.type == seat_type,
+                SeatLog.timestamp >= start, SeatLog.timestamp < end,
+            ).order_by(SeatLog.timestamp).all()
+            initially = bool(rows[0].old_status) if rows else seat_type == "officer"
+            return occupied_intervals([(seconds_of_day(r.timestamp), bool(r.new_status)) for r in rows], initially)
+
+        officer = seat_trace("officer")
+        services = [e - s for s, e in seat_trace("client") if e - s >= args.min_service]
+    finally:
+        db.close()
+    return arrivals, officer, services
+
+
+def synthetic_trace(args):
+    rng = random.Random(args.seed)
+    if args.timeout is None:
+        args.timeout = 60
+    arrivals, t = [], DAY_START
+    while True:
+        t += rng.expovariate(args.rate / 3600)
+        if t >= DAY_END - 1800:
+            break
+        arrivals.append(int(t))
+    lunch = (11 * 3600 + 30 * 60, 13 * 3600 + 30 * 60)
+    officer = [(DAY_START, lunch[0]), (lunch[1], DAY_END)]
+    services = [max(args.min_service, int(rng.expovariate(1 / args.service))) for _ in range(len(arrivals))]
+    return arrivals, officer, services
+
+
+def simulate(policy, arrivals, officer, services, timeout, walkup):
+    present = [False] * (DAY_END + 1)
+    for s, e in officer:
+        for t in range(max(s, DAY_START), min(e, DAY_END)):
+            present[t] = True
+
+    waiting, next_arrival, next_service = [], 0, 0
+    seat_busy_until = None   # ghế khách có người tới thời điểm này
+    walking_until = None     # khách đã được gọi, đang đi tới quầy
+    last_change = DAY_START  # mốc tính timeout: lần đổi trạng thái ghế khách / lần kiểm tra gần nhất
+    just_emptied = False
+    served, waits, idle = 0, [], 0
+
+    for t in range(DAY_START, DAY_END):
+        while next_arrival < len(arrivals) and arrivals[next_arrival] <= t:
+            waiting.append(arrivals[next_arrival])
+            next_arrival += 1
+        if seat_busy_until is not None and t >= seat_busy_until:
+            seat_busy_until, last_change, just_emptied = None, t, True
+        if walking_until is not None and t >= walking_until:
+            duration = services[next_service % len(services)] if services else 300
+            next_service += 1
+            walking_until, seat_busy_until, last_change = None, t + duration, t
+
+        seat_empty = seat_busy_until is None and walking_until is None
+        if seat_empty and present[t] and waiting:
+            idle += 1
+
+        due = t - last_change >= timeout or (policy == "event" and just_emptied)
+        just_emptied = False
+        if not due:
+            continue
+        last_change = t
+        if seat_empty and present[t] and waiting:
+            created = waiting.pop(0)
+            waits.append(t - created)
+            served += 1
+            walking_until = t + walkup
+
+    return {
+        "served": served,
+        "idle_minutes": idle / 60,
+        "avg_wait_minutes": (sum(waits) / len(waits) / 60) if waits else 0.0,
+        "left_waiting": len(waiting),
+    }
+
+
+def main(args):
+    if args.synthetic:
+        arrivals, officer, services = synthetic_trace(args)
+    else:
+        if args.tenxa_id is None or args.counter_id is None or args.date is None:
+            raise SystemExit("Cần --tenxa-id, --counter-id và --date (hoặc dùng --synthetic)")
+        arrivals, officer, services = load_trace(args)
+
+    hours = (DAY_END - DAY_START) / 3600
+    print(f"🎫 {len(arrivals)} vé, {len(services)} lượt phục vụ mẫu, timeout {args.timeout}s, "
+          f"cán bộ có mặt {sum(e - s for s, e in officer) / 3600:.1f}h")
+    results = {}
+    for policy in ("timer", "event"):
+        r = simulate(policy, arrivals, officer, services, args.timeout, args.walkup)
+        results[policy] = r
+        print(f"  {policy:5}: phục vụ {r['served']:4} vé ({r['served'] / hours:.1f} vé/giờ), "
+              f"quầy chờ khách {r['idle_minutes']:7.1f} phút, chờ TB {r['avg_wait_minutes']:6.1f} phút, "
+              f"còn {r['left_waiting']} vé")
+
+    before, after = results["timer"], results["event"]
+    print(f"📊 event so với timer: +{after['served'] - before['served']} vé, "
+          f"{before['idle_minutes'] - after['idle_minutes']:.1f} phút chờ khách ít hơn")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mô phỏng auto-call theo timeout và theo sự kiện ghế trống")
+    parser.add_argument("--tenxa-id", type=int)
+    parser.add_argument("--counter-id", type=int)
+    parser.add_argument("--date", type=date.fromisoformat, help="ngày cần mô phỏng (YYYY-MM-DD)")
+    parser.add_argument("--timeout", type=int, help="mặc định: counters.timeout_seconds của quầy (hoặc 60)")
+    parser.add_argument("--walkup", type=int, default=20, help="số giây khách đi từ lúc gọi tới lúc ngồi vào ghế")
+    parser.add_argument("--min-service", type=int, default=10, help="bỏ các lượt ngồi ngắn hơn (nhiễu cảm biến)")
+    parser.add_argument("--synthetic", action="store_true", help="dùng dữ liệu sinh ngẫu nhiên thay cho DB")
+    parser.add_argument("--rate", type=float, default=20, help="(synthetic) số vé / giờ")
+    parser.add_argument("--service", type=float, default=240, help="(synthetic) thời gian phục vụ TB (giây)")
+    parser.add_argument("--seed", type=int, default=1)
+    raise SystemExit(main(parser.parse_args()))
@@ -0,0 +1,81 @@
+# tests/test_call_next.py
+# Gọi tay + auto-call cùng lúc trên 1 quầy: mỗi quầy tối đa 1 vé "called", gọi đúng thứ tự lấy số
+import asyncio
+from datetime import datetime, timedelta
+
+from app import crud, crud_async, models
+from app.crud import vn_tz
+from app.database import AsyncSessionLocal, async_engine
+
+
+def add_waiting(db, count: int, counter_id: int = 1):
+    now = datetime.now(vn_tz)
+    tickets = [
+        models.Ticket(number=i + 1, counter_id=counter_id, tenxa_id=1, status="waiting",
+                      created_at=now - timedelta(seconds=count - i))
+        for i in range(count)
+    ]
+    db.add_all(tickets)
+    db.commit()
+    return [ticket.id for ticket in tickets]
+
+
+def call_concurrently(times: int, counter_id: int = 1):
+    async def call():
+        async with AsyncSessionLocal() as session:
+            return await crud_async.call_next_ticket(session, 1, counter_id)
+
+    async def main():
+        try:
+            return await asyncio.gather(*(call() for _ in range(times)))
+        finally:
+            await async_engine.dispose()  # kết nối asyncpg gắn với event loop của asyncio.run này
+
+    return asyncio.run(main())
+
+
+def statuses(db, counter_id: int = 1):
+    db.expire_all()
+    return {t.id: t.status for t in db.query(models.Ticket).filter(models.Ticket.counter_id == counter_id)}
+
+
+def test_concurrent_calls_keep_one_called_ticket(db):
+    ids = add_waiting(db, 2)
+
+    advances = call_concurrently(2)
+
+    assert all(advance is not None and advance.ticket is not None for advance in advances)
+    assert statuses(db) == {ids[0]: "done", ids[1]: "called"}
+    first, second = sorted(advances, key=lambda a: a.ticket.called_at)
+    assert first.ticket.id == ids[0] and first.finished == []
+    assert second.ticket.id == ids[1] and [t.id for t in second.finished] == [ids[0]]
+
+
+def test_concurrent_calls_follow_queue_order(db):
+    ids = add_waiting(db, 10)
+
+    advances = sorted(call_concurrently(10), key=lambda a: a.ticket.called_at)
+
+    assert [a.ticket.id for a in advances] == ids
+    # Mỗi lượt đóng đúng vé lượt trước vừa gọi
+    assert [[t.id for t in a.finished] for a in advances] == [[]] + [[i] for i in ids[:-1]]
+    assert list(statuses(db).values()).count("called") == 1
+
+
+def test_calls_beyond_queue_close_last_ticket(db):
+    ids = add_waiting(db, 3)
+
+    advances = call_concurrently(5)
+
+    called = [a for a in advances if a is not None and a.ticket is not None]
+    assert sorted(a.ticket.id for a in called) == ids
+    assert set(statuses(db).values()) == {"done"}
+
+
+def test_inactive_counter_is_not_advanced(db):
+    add_waiting(db, 1)
+    db.query(models.Counter).filter(models.Counter.id == 1).update({"status": "paused"})
+    db.commit()
+
+    assert crud.call_next_ticket(db, 1, 1) is None
+    assert set(statuses(db).values()) == {"waiting"}
@@ -0,0 +1,191 @@
+# tests/test_live_queue.py
+# Hàng đợi trong bộ nhớ (app/utils/live_queue.py): không cần DB, _load dùng session / crud_async giả
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from app import schemas
+from app.utils import live_queue
+from app.utils.live_queue import CALLED, CREATED, UPDATED, TenantQueue
+
+T0 = datetime(2024, 3, 11, 8, 0)
+
+
+def ticket(id, status="waiting", counter_id=1, created=0, called=None, finished=None):
+    minutes = lambda m: None if m is None else T0 + timedelta(minutes=m)  # noqa: E731
+    return schemas.Ticket(id=id, number=id, counter_id=counter_id, status=status,
+                          created_at=minutes(created), called_at=minutes(called), finished_at=minutes(finished))
+
+
+def ids(tickets):
+    return [t.id for t in tickets]
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    live_queue.invalidate()
+    live_queue._loading.clear()
+    yield
+    live_queue.invalidate()
+    live_queue._loading.clear()
+
+
+# ==== TenantQueue ====
+
+def test_events_move_ticket_between_buckets():
+    queue = TenantQueue(1, "x")
+    queue.apply(CREATED, ticket(2, created=5))
+    queue.apply(CREATED, ticket(1, created=1))
+    queue.apply(CREATED, ticket(3, counter_id=2, created=3))
+    assert ids(queue.list("waiting", 1)) == [1, 2]
+    assert ids(queue.list("waiting", None)) == [1, 3, 2]  # theo giờ lấy số
+
+    queue.apply(CALLED, ticket(1, "called", created=1, called=10))
+    assert ids(queue.list("waiting", 1)) == [2]
+    assert ids(queue.list("called", 1)) == [1]
+
+    queue.apply(UPDATED, ticket(1, "done", created=1, called=10, finished=12))
+    assert queue.list("called", 1) == []
+    assert queue.tickets[1].status == "done"
+
+
+def test_duplicate_events_are_idempotent():
+    queue = TenantQueue(1, "x")
+    for _ in range(2):
+        queue.apply(CREATED, ticket(1))
+        queue.apply(CALLED, ticket(1, "called", called=10))
+    assert queue.list("waiting", 1) == []
+    assert ids(queue.list("called", 1)) == [1]
+    assert len(queue.tickets) == 1
+
+
+def test_out_of_order_events_keep_newest_state():
+    queue = TenantQueue(1, "x")
+    # Sự kiện của worker khác tới sau sự kiện mới hơn
+    queue.apply(UPDATED, ticket(1, "done", called=10, finished=12))
+    queue.apply(CALLED, ticket(1, "called", called=10))
+    queue.apply(CREATED, ticket(1))
+    assert queue.tickets[1].status == "done"
+    assert queue.list("waiting", 1) == [] and queue.list("called", 1) == []
+
+    queue.apply(CALLED, ticket(2, "called", called=20))
+    queue.apply(CREATED, ticket(2))
+    assert ids(queue.list("called", 1)) == [2]
+    assert queue.list("waiting", 1) == []
+
+
+def test_call_does_not_close_previous_ticket_by_itself():
+    # Trong DB vé trước chỉ đóng khi có sự kiện UPDATED tương ứng (vd. ghi lỗi / sự kiện chưa tới) → bộ nhớ không tự đoán
+    queue = TenantQueue(1, "x")
+    queue.apply(CALLED, ticket(1, "called", called=10))
+    queue.apply(CALLED, ticket(2, "called", created=1, called=20))
+    assert ids(queue.list("called", 1)) == [1, 2]
+    assert queue.tickets[1].status == "called"
+
+    queue.apply(UPDATED, ticket(1, "done", called=10, finished=20))
+    assert ids(queue.list("called", 1)) == [2]
+
+
+def test_is_fresh_expires_on_new_day_and_ttl(monkeypatch):
+    queue = TenantQueue(1, "x")
+    assert queue.is_fresh()
+
+    class NextDay(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz) + timedelta(days=1)
+
+    monkeypatch.setattr(live_queue, "datetime", NextDay)
+    assert not queue.is_fresh()
+    monkeypatch.setattr(live_queue, "datetime", datetime)
+    assert queue.is_fresh()
+
+    queue.expires_at = live_queue.time.monotonic() - 1
+    assert not queue.is_fresh()
+
+
+# ==== Nạp từ DB ====
+
+class FakeDB:
+    """Thay AsyncSessionLocal + crud_async: trả `rows` (bản DB đọc được), gọi `during_read` giữa lúc đọc"""
+
+    def __init__(self, rows, during_read=None):
+        self.rows = rows
+        self.during_read = during_read
+        self.loads = 0
+
+    def install(self, monkeypatch):
+        @asynccontextmanager
+        async def session():
+            yield None
+
+        async def get_slug(db, tenxa_id):
+            return "x"
+
+        async def get_waiting(db, tenxa_id):
+            self.loads += 1
+            if self.during_read:
+                self.during_read()
+            return [t for t in self.rows if t.status == "waiting"]
+
+        async def get_called(db, tenxa_id):
+            return [t for t in self.rows if t.status == "called"]
+
+        monkeypatch.setattr(live_queue, "AsyncSessionLocal", session)
+        monkeypatch.setattr(live_queue.crud_async, "get_slug_from_tenxa_id", get_slug)
+        monkeypatch.setattr(live_queue.crud_async, "get_waiting_tickets", get_waiting)
+        monkeypatch.setattr(live_queue.crud_async, "get_called_tickets", get_called)
+        return self
+
+
+def test_events_during_load_are_replayed(monkeypatch):
+    # DB đọc được vé 1 còn chờ, nhưng trong lúc đọc vé 1 được gọi và vé 2 được tạo
+    def events():
+        live_queue.apply(1, CALLED, ticket(1, "called", called=10))
+        live_queue.apply(1, CREATED, ticket(2, created=5))
+
+    FakeDB([ticket(1)], during_read=events).install(monkeypatch)
+    assert ids(asyncio.run(live_queue.get_called(1))) == [1]
+    assert ids(asyncio.run(live_queue.get_waiting(1))) == [2]
+    assert live_queue._loading == {}
+
+
+def test_stale_event_during_load_does_not_override_db(monkeypatch):
+    # Sự kiện cũ tới muộn trong lúc nạp, DB đã có trạng thái mới hơn
+    def events():
+        live_queue.apply(1, CREATED, ticket(1))
+
+    FakeDB([ticket(1, "called", called=10)], during_read=events).install(monkeypatch)
+    assert ids(asyncio.run(live_queue.get_called(1))) == [1]
+    assert asyncio.run(live_queue.get_waiting(1)) == []
+
+
+def test_concurrent_reads_load_once(monkeypatch):
+    fake = FakeDB([ticket(1), ticket(2, created=1)]).install(monkeypatch)
+
+    async def read_many():
+        return await asyncio.gather(*[live_queue.get_waiting(1) for _ in range(5)])
+
+    assert [ids(r) for r in asyncio.run(read_many())] == [[1, 2]] * 5
+    assert fake.loads == 1
+
+
+def test_reload_on_new_day(monkeypatch):
+    fake = FakeDB([ticket(1)]).install(monkeypatch)
+    assert ids(asyncio.run(live_queue.get_waiting(1))) == [1]
+
+    # Sang ngày mới: hàng đợi cũ hết hạn, nạp lại từ DB (vé hôm qua không còn)
+    live_queue._queues[1].day = date(2000, 1, 1)
+    fake.rows = [ticket(5)]
+    assert ids(asyncio.run(live_queue.get_waiting(1))) == [5]
+    assert fake.loads == 2
+
+
+def test_failed_apply_invalidates_queue(monkeypatch):
+    FakeDB([ticket(1)]).install(monkeypatch)
+    asyncio.run(live_queue.get_waiting(1))
+
+    live_queue.apply(1, CREATED, object())  # không chuyển được sang schemas.Ticket
+    assert 1 not in live_queue._queues
@@ -0,0 +1,195 @@
+# tests/test_stats.py
+# Các endpoint /stats/* phải trả đúng như bản gốc (lọc theo func.date(cột) của giờ lưu trong DB), dù ngày đã chốt
+# vào daily_counter_stats hay tính trực tiếp, và dù TimeZone của phiên Postgres là gì (Render mặc định UTC).
+from datetime import date, datetime, time
+
+import pytest
+from sqlalchemy import func, text
+
+from app.api.endpoints import stats
+from app.models import Seat, SeatLog, Ticket
+from app.utils.daily_stats import close_day
+
+D0, D1, D2, D3, D4 = (date(2024, 3, d) for d in range(8, 13))
+DAYS = (D0, D1, D2, D3, D4)
+RANGES = [(D1, D3), (D2, D2), (D3, D4), (D0, D1), (D0, D4)]
+
+
+def at(day, hour=0, minute=0, second=0, micro=0):
+    return datetime.combine(day, time(hour, minute, second, micro))
+
+
+def seed(db):
+    # (quầy, lấy số, gọi, xong) — có vé ngay 00:00 và 23:59:59.999999 ở đầu / cuối mỗi khoảng ngày
+    tickets = [
+        (1, at(D0, 23, 59, 59, 999999), at(D1, 0, 5), at(D1, 0, 9)),
+        (1, at(D1), at(D1, 0, 2), at(D1, 0, 7)),
+        (1, at(D1, 0, 0, 0, 1), None, None),
+        (2, at(D1, 8, 15), at(D1, 8, 40), None),
+        (2, at(D1, 23, 59, 59, 999999), at(D2, 0, 1), at(D2, 0, 4)),
+        (1, at(D2, 7), at(D2, 7, 45), at(D2, 8, 5)),
+        (2, at(D2, 16), at(D2, 16, 10), at(D2, 16, 50, 30)),
+        (1, at(D3, 9, 30), at(D3, 9, 31), at(D3, 9, 40)),
+        (2, at(D3, 23, 59, 59, 999999), None, None),
+        (2, at(D4), at(D4, 0, 3), at(D4, 0, 4)),
+    ]
+    for number, (counter_id, created, called, finished) in enumerate(tickets, 1):
+        db.add(Ticket(number=number, counter_id=counter_id, created_at=created, called_at=called,
+                      finished_at=finished, status="done" if finished else "waiting", tenxa_id=1))
+    # Xã khác: không được lẫn vào số liệu của xã 1
+    db.add(Ticket(number=1, counter_id=1, created_at=at(D1, 9), called_at=at(D1, 9, 5),
+                  finished_at=at(D1, 9, 20), status="done", tenxa_id=2))
+
+    db.add_all([
+        Seat(id=1, name="Ghế 1", counter_id=1, type="officer", tenxa_id=1),
+        Seat(id=2, name="Ghế 2", counter_id=2, type="officer", tenxa_id=1),
+        Seat(id=3, name="Ghế 3", counter_id=1, type="client", tenxa_id=1),
+    ])
+    # Mỗi ngày của 1 ghế kết thúc bằng "có mặt": các khoảng vắng mặt không vắt qua nửa đêm
+    logs = [
+        (1, at(D1, 7, 29, 59), True),
+        (1, at(D1, 10), False), (1, at(D1, 10, 30), True),
+        (1, at(D1, 17), False), (1, at(D1, 18), True),
+        (3, at(D1), True),
+        (3, at(D1, 6), False), (3, at(D1, 7, 45), True),
+        (2, at(D2, 6), False), (2, at(D2, 7), True),
+        (2, at(D2, 7, 30), True),
+        (2, at(D3, 7, 30, 0, 1), True),
+        (2, at(D3, 12), False), (2, at(D3, 13, 0, 0, 500000), True),
+        (1, at(D3, 23, 59, 59, 999999), True),
+        (2, at(D4), True),
+        (2, at(D4, 8), False), (2, at(D4, 9), True),
+    ]
+    for seat_id, timestamp, status in logs:
+        db.add(SeatLog(seat_id=seat_id, old_status=not status, new_status=status, timestamp=timestamp, tenxa_id=1))
+    db.add(Seat(id=4, name="Ghế xã khác", counter_id=1, type="officer", tenxa_id=2))
+    db.add(SeatLog(seat_id=4, old_status=True, new_status=False, timestamp=at(D1, 8), tenxa_id=2))
+    db.add(SeatLog(seat_id=4, old_status=False, new_status=True, timestamp=at(D1, 9), tenxa_id=2))
+    db.commit()
+
+
+# ==== Bản gốc (trước khi có daily_counter_stats / khoảng thời gian nửa mở) ====
+
+def in_days(column, start, end):
+    return [func.date(column) >= start, func.date(column) <= end]
+
+
+def baseline_tickets(db, start, end, *filters, value=func.count()):
+    rows = (
+        db.query(Ticket.counter_id, value)
+        .filter(*filters, *in_days(Ticket.created_at, start, end))
+        .filter(Ticket.tenxa_id == 1)
+        .group_by(Ticket.counter_id)
+    )
+    return {counter_id: v for counter_id, v in rows}
+
+
+def baseline_handling(db, start, end, value=func.count()):
+    return baseline_tickets(db, start, end, Ticket.called_at.isnot(None), Ticket.finished_at.isnot(None), value=value)
+
+
+def baseline_waiting(db, start, end):
+    return baseline_tickets(
+        db, start, end, Ticket.created_at.isnot(None), Ticket.called_at.isnot(None),
+        value=func.avg(func.extract("epoch", Ticket.called_at - Ticket.created_at)),
+    )
+
+
+def baseline_checkins(db, date_check):
+    rows = (
+        db.query(Seat.counter_id, func.min(SeatLog.timestamp))
+        .join(Seat, Seat.id == SeatLog.seat_id)
+        .filter(SeatLog.tenxa_id == 1, SeatLog.new_status == True, func.date(SeatLog.timestamp) == date_check)  # noqa: E712
+        .group_by(Seat.counter_id)
+    )
+    return {counter_id: (first_checkin, first_checkin.time() > time(7, 30)) for counter_id, first_checkin in rows}
+
+
+def baseline_afk(db, start, end):
+    # Bản gốc so sánh giờ không múi giờ với giờ có múi giờ (TypeError khi có khoảng vắng) → giữ nguyên thuật toán,
+    # tính giờ làm việc không kèm múi giờ như cột timestamp
+    logs = (
+        db.query(SeatLog.seat_id, Seat.counter_id, SeatLog.new_status, SeatLog.timestamp)
+        .join(Seat, SeatLog.seat_id == Seat.id)
+        .filter(SeatLog.tenxa_id == 1, SeatLog.new_status.in_([True, False]), *in_days(SeatLog.timestamp, start, end))
+        .order_by(SeatLog.seat_id, SeatLog.timestamp)
+    )
+    total = {}
+    prev = {}
+    for seat_id, counter_id, status, timestamp in logs:
+        prev_status, prev_time = prev.get(seat_id, (None, None))
+        if prev_status is False and status is True:
+            effective_start = max(prev_time, datetime.combine(prev_time.date(), time(7, 30)))
+            effective_end = min(timestamp, datetime.combine(timestamp.date(), time(17, 30)))
+            if effective_start < effective_end:
+                total[counter_id] = total.get(counter_id, 0.0) + (effective_end - effective_start).total_seconds() / 60
+        prev[seat_id] = (status, timestamp)
+    return total
+
+
+# ==== Test ====
+
+def by_counter(items, field):
+    return {item.counter_id: getattr(item, field) for item in items}
+
+
+def approx(values):
+    return {k: pytest.approx(float(v)) for k, v in values.items()}
+
+
+@pytest.fixture(params=[None, "UTC", "Asia/Ho_Chi_Minh", "America/Los_Angeles"])
+def session_timezone(request, db):
+    # None: giữ TimeZone mặc định của server (như production)
+    if request.param:
+        db.execute(text("SELECT set_config('TimeZone', :tz, false)"), {"tz": request.param})
+        db.commit()
+    return request.param
+
+
+@pytest.mark.parametrize("closed_days", [(), (D1, D2), DAYS], ids=["open", "partly-closed", "closed"])
+def test_stats_match_baseline(db, session_timezone, closed_days):
+    seed(db)
+    for day in closed_days:
+        assert close_day(db, day) is not None
+
+    for start, end in RANGES:
+        kwargs = dict(start_date=start, end_date=end, tenxa_id=1, db=db)
+        total = baseline_tickets(db, start, end)
+        attended = baseline_handling(db, start, end)
+        handling = baseline_handling(db, start, end, value=func.avg(func.extract("epoch", Ticket.finished_at - Ticket.called_at)))
+        waiting = baseline_waiting(db, start, end)
+        afk = baseline_afk(db, start, end)
+        checkins = baseline_checkins(db, end)
+
+        assert by_counter(stats.tickets_per_counter(**kwargs), "total_tickets") == total
+        assert by_counter(stats.attended_tickets(**kwargs), "attended_tickets") == attended
+        assert by_counter(stats.average_handling_time(**kwargs), "avg_handling_time_seconds") == approx(handling)
+        assert by_counter(stats.average_waiting_time(**kwargs), "avg_waiting_time_seconds") == approx(waiting)
+        assert by_counter(stats.afk_duration(**kwargs), "total_absent_minutes") == approx(afk)
+        assert {
+            item.counter_id: (item.first_checkin, item.is_late)
+            for item in stats.working_time_check(date_check=end, tenxa_id=1, db=db)
+        } == checkins
+
+        summary = stats.stats_summary(**kwargs)
+        assert (summary.start_date, summary.end_date) == (start, end)
+        assert summary.total_tickets == sum(total.values())
+        assert summary.attended_tickets == sum(attended.values())
+        counters = {c.counter_id: c for c in summary.counters}
+        for counter_id, c in counters.items():
+            assert c.total_tickets == total.get(counter_id, 0)
+            assert c.attended_tickets == attended.get(counter_id, 0)
+            assert c.avg_handling_time_seconds == (pytest.approx(float(handling[counter_id])) if counter_id in handling else None)
+            assert c.avg_waiting_time_seconds == (pytest.approx(float(waiting[counter_id])) if counter_id in waiting else None)
+            assert c.total_absent_minutes == pytest.approx(afk.get(counter_id, 0.0))
+            assert (c.first_checkin, c.is_late) == checkins.get(counter_id, (None, None))
+        assert set(total) | set(afk) | set(checkins) <= set(counters)
+
+
+def test_seeded_edges_are_in_range(db):
+    # Bảo đảm dữ liệu mẫu thật sự chạm các mốc nửa đêm mà test trên kiểm tra
+    seed(db)
+    assert baseline_tickets(db, D1, D1) == {1: 2, 2: 2}
+    assert baseline_tickets(db, D4, D4) == {2: 1}
+    assert baseline_checkins(db, D1)[1] == (at(D1), False)
+    assert baseline_checkins(db, D3)[2] == (at(D3, 7, 30, 0, 1), True)